@@ -0,0 +1,54 @@
+# ai_cache_service.py
+import json
+import hashlib
+import threading
+
+from config import AI_CACHE_FILE, AI_CACHE_ENABLED, AI_CACHE_TTL_HOURS, AI_CACHE_MAX_MB
+from sqlite_cache import SQLiteCache, MISS
+
+# --- AI response cache ---
+# Gemini runs at temperature 0, so the same request gets the same answer: the
+# parsed JSON answer is kept under a fingerprint of (model, generation config,
+# prompt template + its version, prompt text). Flashcards/MCQs/summaries of a
+# course file shared by many users then cost one request. Storage is
+# sqlite_cache's: entries expire after AI_CACHE_TTL_HOURS and the least
+# recently used go once the cache is over AI_CACHE_MAX_MB. Failed requests
+# and empty answers are never cached (ai_service). 'ai_cache' is the table of
+# the previous layout.
+
+_cache = SQLiteCache(AI_CACHE_FILE, "ai_answers", AI_CACHE_MAX_MB, ttl_hours=AI_CACHE_TTL_HOURS,
+                     label="AICache", replaces=("ai_cache",))
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "bypassed": 0}
+
+def _count(name):
+    with _stats_lock: _stats[name] += 1
+
+def prompt_fingerprint(model: str, generation_config: dict, template: str, prompt: str) -> str:
+    """sha256 over everything that determines the answer ('template' carries its version, e.g. 'flashcards:1')."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([model, generation_config, template], sort_keys=True, default=str).encode("utf-8"))
+    digest.update(b"\0"); digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+def get_cached_response(fingerprint: str):
+    """The cached answer, or MISS."""
+    if not AI_CACHE_ENABLED: return MISS
+    cached = _cache.get(fingerprint)
+    _count("misses" if cached is MISS else "hits")
+    return cached
+
+def put_cached_response(fingerprint: str, response):
+    """Stores a parsed answer (expired / least-recently-used entries go over the size cap)."""
+    if not AI_CACHE_ENABLED: return
+    if _cache.put(fingerprint, response): _count("writes")
+
+def note_bypass():
+    _count("bypassed")
+
+def ai_cache_stats() -> dict:
+    with _stats_lock: stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    stats.update(_cache.stats())
+    return stats
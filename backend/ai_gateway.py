@@ -0,0 +1,177 @@
+# ai_gateway.py
+import re
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from config import (
+    GOOGLE_API_KEY, AI_RATE_PER_MINUTE, AI_BURST, AI_MAX_CONCURRENCY, AI_MAX_RETRIES,
+    AI_BACKOFF_BASE_SECONDS, AI_BACKOFF_MAX_SECONDS, AI_CALL_TIMEOUT_SECONDS
+)
+
+# --- AI request gateway ---
+# Every model call (ai_service, deadline fallback, planner, insights) is a job
+# submitted here instead of a blocking retry loop in the caller. Jobs run on
+# one asyncio loop in a background thread:
+#  - a token bucket per provider + API key paces requests (AI_RATE_PER_MINUTE,
+#    bursts of AI_BURST); a 429 pauses that bucket for every queued job, for
+#    the delay the API asked for, instead of each thread sleeping 60s
+#  - at most AI_MAX_CONCURRENCY calls are in flight (the SDK calls are
+#    blocking and run in a small thread pool)
+#  - rate-limited calls and transport/server errors are retried with
+#    exponential backoff and jitter; any other error (e.g. an answer that is
+#    not valid JSON) fails the job at once instead of paying for a new request
+# submit() returns a concurrent.futures.Future, to be collected later with
+# wait(); run() is submit() + wait() for callers that need the answer right away.
+
+class TokenBucket:
+    """Refills 'rate_per_minute' tokens a minute up to 'burst'; used on the gateway loop only."""
+    def __init__(self, rate_per_minute, burst):
+        self.rate = max(rate_per_minute, 0.01) / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now); continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1; return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Rate limited by the provider: nobody gets a token for 'seconds'."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+_RETRY_DELAY_RE = re.compile(r'(?:retry(?:_delay)?|Please retry in)\s*(?:{\s*seconds:\s*|\s*)(\d+)', re.IGNORECASE)
+
+_RATE_LIMIT_ERRORS = ("ResourceExhausted", "TooManyRequests", "RateLimitError")
+_SERVER_ERRORS = ("InternalServerError", "BadGateway", "ServiceUnavailable", "GatewayTimeout", "DeadlineExceeded")
+_TRANSPORT_ERRORS = ("ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout", "RetryError", "APIConnectionError")
+_STATUS_RE = re.compile(r'^\s*(429|50[0234])\b')
+
+def _classify(error) -> tuple[str, float | None]:
+    """('rate_limit' | 'server' | 'transport' | 'other', delay the provider asked for). Only 'other' is not retried."""
+    if isinstance(error, ValueError): return "other", None # Bad answer (JSON): the same request would be paid again
+    name = type(error).__name__
+    code = getattr(error, "code", None)
+    status = _STATUS_RE.match(str(error)) # SDK errors start with the HTTP status ("429 Resource has been exhausted")
+    if name in _RATE_LIMIT_ERRORS or code == 429 or (status and status.group(1) == "429"):
+        match = _RETRY_DELAY_RE.search(str(error))
+        return "rate_limit", (int(match.group(1)) + 2) if match else None
+    if name in _SERVER_ERRORS or code in (500, 502, 503, 504) or status:
+        return "server", None
+    if name in _TRANSPORT_ERRORS or isinstance(error, (ConnectionError, TimeoutError)):
+        return "transport", None
+    return "other", None
+
+def _backoff(attempt) -> float:
+    delay = min(AI_BACKOFF_MAX_SECONDS, AI_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(delay / 2, delay) # "Equal jitter": retries of a burst don't line up
+
+# --- Loop thread ---
+
+_loop = None
+_loop_lock = threading.Lock()
+_semaphore = None # Created on the loop
+_executor = ThreadPoolExecutor(max_workers=max(1, AI_MAX_CONCURRENCY), thread_name_prefix="ai-call")
+_buckets = {} # (provider, key fingerprint) -> TokenBucket
+_stats_lock = threading.Lock()
+_stats = {"submitted": 0, "succeeded": 0, "failed": 0, "retries": 0, "rate_limited": 0, "timeouts": 0, "in_flight": 0}
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True, name="ai-gateway").start()
+            print(f" 🤖 [AI Gateway] Started ({AI_RATE_PER_MINUTE}/min per key, {AI_MAX_CONCURRENCY} concurrent).")
+        return _loop
+
+def _count(**deltas):
+    with _stats_lock:
+        for name, delta in deltas.items(): _stats[name] += delta
+
+def _bucket(provider, key) -> TokenBucket:
+    fingerprint = hashlib.sha256((key or "").encode("utf-8")).hexdigest()[:12]
+    bucket = _buckets.get((provider, fingerprint))
+    if bucket is None:
+        bucket = _buckets[(provider, fingerprint)] = TokenBucket(AI_RATE_PER_MINUTE, AI_BURST)
+    return bucket
+
+async def _run_job(call, label, provider, key, retries):
+    global _semaphore
+    if _semaphore is None: _semaphore = asyncio.Semaphore(max(1, AI_MAX_CONCURRENCY))
+    bucket = _bucket(provider, key)
+    loop = asyncio.get_running_loop()
+    for attempt in range(retries):
+        await bucket.acquire()
+        async with _semaphore:
+            _count(in_flight=1)
+            try:
+                result = await loop.run_in_executor(_executor, call)
+                _count(succeeded=1)
+                return result
+            except Exception as e:
+                error = e
+            finally:
+                _count(in_flight=-1)
+        kind, asked_delay = _classify(error)
+        if kind == "other":
+            _count(failed=1)
+            print(f"         [{label}] Failed (not retried): {error}")
+            raise error
+        if attempt + 1 >= retries:
+            _count(failed=1)
+            print(f"         [{label}] Max retries reached: {error}")
+            raise error
+        _count(retries=1)
+        if kind == "rate_limit":
+            wait_time = asked_delay or _backoff(attempt + 2)
+            _count(rate_limited=1)
+            bucket.pause(wait_time) # Holds back every job on this key, not just this one
+            print(f"         [{label}] Rate Limit (429). Requests on this key paused {wait_time:.0f}s (Attempt {attempt + 1}/{retries})...")
+        else:
+            wait_time = _backoff(attempt)
+            print(f"         [{label}] {'Server error' if kind == 'server' else 'Connection error'} (Attempt {attempt + 1}/{retries}): {error}. Retrying in {wait_time:.1f}s...")
+            await asyncio.sleep(wait_time)
+
+def submit(call, label="AI", provider="gemini", key=GOOGLE_API_KEY, retries=AI_MAX_RETRIES):
+    """
+    Queues 'call' (a blocking function doing one model request) and returns
+    a concurrent.futures.Future with its result. Submit several calls before
+    collecting them with wait(), so they share the rate limit instead of queueing one by one.
+    """
+    _count(submitted=1)
+    return asyncio.run_coroutine_threadsafe(_run_job(call, label, provider, key, max(1, retries)), _get_loop())
+
+def wait(future, label="AI", timeout=AI_CALL_TIMEOUT_SECONDS):
+    """
+    The result of a submit()ted job, waiting up to 'timeout' seconds (queueing
+    and retries included). Raises the call's last error, or TimeoutError after cancelling the job.
+    """
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        future.cancel()
+        _count(timeouts=1)
+        raise TimeoutError(f"{label}: no AI response within {timeout}s (rate limited or busy)")
+
+def run(call, label="AI", timeout=AI_CALL_TIMEOUT_SECONDS, **kwargs):
+    """submit() and wait(): for callers that can't do anything else until the answer is in."""
+    return wait(submit(call, label=label, **kwargs), label=label, timeout=timeout)
+
+def gateway_stats() -> dict:
+    with _stats_lock: stats = dict(_stats)
+    now = time.monotonic()
+    stats["paused_keys"] = sum(1 for bucket in list(_buckets.values()) if bucket.paused_until > now)
+    return stats
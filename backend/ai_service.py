@@ -1,18 +1,23 @@
 # ai_service.py
 import google.generativeai as genai
-import re
-import time
 import json
+import multiprocessing
+from concurrent.futures import Future
 from config import GOOGLE_API_KEY # Import from config
+import ai_gateway
+from ai_cache_service import prompt_fingerprint, get_cached_response, put_cached_response, note_bypass, MISS
 
 # --- AI Client Setup ---
 print("Initializing Google Gemini client...")
 ai_client = None
-if GOOGLE_API_KEY:
+GEMINI_MODEL = "models/gemini-flash-latest"
+GENERATION_CONFIG = {"response_mime_type": "application/json", "temperature": 0.0}
+if multiprocessing.parent_process() is not None:
+    pass # An extraction worker importing app.py (forkserver/spawn): no client, no test request
+elif GOOGLE_API_KEY:
     try:
         genai.configure(api_key=GOOGLE_API_KEY)
-        generation_config = {"response_mime_type": "application/json", "temperature": 0.0}
-        ai_client = genai.GenerativeModel("models/gemini-flash-latest", generation_config=generation_config)
+        ai_client = genai.GenerativeModel(GEMINI_MODEL, generation_config=GENERATION_CONFIG)
         ai_client.generate_content("test", generation_config={"response_mime_type": "text/plain"})
         print("🤖 Google Gemini client initialized successfully.")
     except Exception as e:
@@ -23,11 +28,71 @@ else:
     ai_client = None
 
 # --- AI Helper Functions ---
+# Requests go through ai_gateway (shared rate limit, retries with backoff);
+# a function gets None back once the gateway gives up (an answer that is not
+# JSON is not requested again). Answers are cached by
+# ai_cache_service under a fingerprint of model, config, template version and
+# prompt; use_cache=False skips the lookup (the fresh answer replaces the old).
+# Empty answers ('null', [], only "Not Found" deadlines) are not cached, so a
+# miss is asked again next time instead of being pinned for the whole TTL.
+
+# Bump a template's version when its prompt changes, so its cached answers are not reused
+PROMPT_VERSIONS = {"analyze": 1, "grade": 1, "flashcards": 1, "mcq": 1, "hint": 1, "deadlines": 1}
+
+def _is_empty_answer(data) -> bool:
+    if not data: return True
+    if isinstance(data, list):
+        return all(isinstance(item, dict) and item.get("status") == "Not Found" for item in data)
+    return False
+
+def _submit_json(prompt: str, label: str, template: str, allow_null=True, use_cache=True) -> Future:
+    """
+    Queues one Gemini request for a JSON answer and returns a Future with the
+    parsed data (None for a 'null' answer); a cached answer comes back already done.
+    """
+    template = f"{template}:{PROMPT_VERSIONS[template]}"
+    fingerprint = prompt_fingerprint(GEMINI_MODEL, GENERATION_CONFIG, template, prompt)
+    if use_cache:
+        cached = get_cached_response(fingerprint)
+        if cached is not MISS:
+            print(f"         [{label}] Answer served from the AI cache.")
+            future = Future(); future.set_result(cached)
+            return future
+    else:
+        note_bypass()
+
+    def call():
+        text = ai_client.generate_content(prompt).text
+        if allow_null and text.strip().lower() == "null":
+            print(f"         [{label}] AI indicated text was not useful.")
+            data = None
+        else:
+            try:
+                data = json.loads(text)
+            except ValueError:
+                print(f"         [{label}] Raw response content: {text[:500]}")
+                raise # Not retried: the gateway only retries rate limits and transport errors
+        if not _is_empty_answer(data): put_cached_response(fingerprint, data)
+        return data
+    return ai_gateway.submit(call, label=label)
+
+def _collect_json(future: Future, label: str):
+    """The answer of a _submit_json() request, or None if it failed."""
+    try:
+        return ai_gateway.wait(future, label=label)
+    except Exception as e:
+        print(f"         [{label}] AI request failed: {e}")
+        return None
+
+def _generate_json(prompt: str, label: str, template: str, allow_null=True, use_cache=True):
+    """One Gemini request for a JSON answer: the parsed data, or None ('null' answer / failure)."""
+    return _collect_json(_submit_json(prompt, label, template, allow_null, use_cache), label)
+
 # (Paste your functions: analyze_document_with_ai, generate_multiple_choice_ai, 
 #  and generate_hint_with_ai here, exactly as they were in app.py)
 #
 # Example (paste your full function):
-def analyze_document_with_ai(file_text: str, file_type: str) -> dict | None:
+def analyze_document_with_ai(file_text: str, file_type: str, use_cache=True) -> dict | None:
     if not ai_client: return None
     if not file_text or file_text.isspace(): return None
 
@@ -40,63 +105,11 @@ def analyze_document_with_ai(file_text: str, file_type: str) -> dict | None:
 Return ONLY JSON: {{"summary": [], "key_topics": []}}. If unusable, return null. TEXT: {file_text}"""
 
 
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            # --- API Call ---
-            response = ai_client.generate_content(prompt)
-            data_string = response.text
-            if data_string.strip().lower() == "null":
-                print("         [AI Analyze] AI indicated text was not useful.")
-                return None # Successfully determined not useful
-            data = json.loads(data_string)
-            print(f"         [AI Analyze] AI summary received (Attempt {attempt+1}).")
-            return data # Success! Exit the function.
-
-
-        except Exception as e:
-            error_str = str(e)
-            is_rate_limit = "429" in error_str
-
-
-            if is_rate_limit:
-                wait_time = 60 # Default
-                match = re.search(r'(?:retry(?:_delay)?|Please retry in)\s*(?:{\s*seconds:\s*|\s*)(\d+)', error_str, re.IGNORECASE)
-                if match: wait_time = int(match.group(1)) + 2
-                print(f"         [AI Analyze] Rate Limit (429). Waiting {wait_time}s (Attempt {attempt+1}/{max_retries})...")
-
-
-                # Check if it's the last attempt BEFORE sleeping
-                if attempt + 1 >= max_retries:
-                    print("         [AI Analyze] Max retries reached after rate limit.")
-                    break # Exit the loop, will return None below
-                else:
-                    time.sleep(wait_time)
-                    # --- Use continue to go to the next iteration of the loop ---
-                    continue
+    data = _generate_json(prompt, "AI Analyze", "analyze", use_cache=use_cache)
+    if data is not None: print("         [AI Analyze] AI summary received.")
+    return data
 
-
-            else: # Handle other errors (like JSON parsing, etc.)
-                print(f"         [AI Analyze] AI method failed (Attempt {attempt+1}/{max_retries}): {e}")
-                if hasattr(response, 'text'): print(f"         [AI Analyze] Raw response: {response.text}")
-                # Optional: Add a short delay before retrying non-rate-limit errors?
-                # time.sleep(5)
-
-
-                # Check if it's the last attempt
-                if attempt + 1 >= max_retries:
-                    print(f"         [AI Analyze] Max retries reached after error.")
-                    break # Exit the loop
-                else:
-                     # Optionally add a small delay before the next attempt for non-429 errors
-                     time.sleep(5)
-                     continue # Go to the next iteration
-
-
-    # This part is reached only if the loop finishes without returning (i.e., max retries hit)
-    return None
-
-def grade_homework_with_ai(question_text: str, answer_text: str, file_type: str) -> dict | None:
+def grade_homework_with_ai(question_text: str, answer_text: str, file_type: str, use_cache=True) -> dict | None:
     """
     Uses AI to grade a user's answer against the original homework question/document.
     """
@@ -135,26 +148,12 @@ You must return a JSON object with the following structure. Do not add any other
 ```
 """
 
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            response = ai_client.generate_content(prompt)
-            data = json.loads(response.text)
-            print(f"         [AI Grade] AI grading received (Attempt {attempt+1}).")
-            return data
-        except Exception as e:
-            print(f"         [AI Grade] AI grading failed (Attempt {attempt+1}/{max_retries}): {e}")
-            if hasattr(response, 'text'):
-                print(f"         [AI Grade] Raw response: {response.text}")
-            if attempt < max_retries - 1:
-                time.sleep(5) # Wait before retrying
-            else:
-                print("         [AI Grade] Max retries reached. Giving up.")
-                return None
-    return None
-
-
-def generate_flashcards_ai(file_text: str, file_type: str) -> dict | None:
+    data = _generate_json(prompt, "AI Grade", "grade", use_cache=use_cache)
+    if data is not None: print("         [AI Grade] AI grading received.")
+    return data
+
+
+def generate_flashcards_ai(file_text: str, file_type: str, use_cache=True) -> dict | None:
     """Sends extracted text to Gemini to generate flashcards with terms and definitions."""
     if not ai_client: return None
     if not file_text or file_text.isspace(): return None
@@ -193,54 +192,12 @@ def generate_flashcards_ai(file_text: str, file_type: str) -> dict | None:
     {file_text}
     """
 
-    max_retries = 3
-    base_wait_time = 10
-
-    for attempt in range(max_retries):
-        response = None
-        try:
-            response = ai_client.generate_content(prompt)
-            data_string = response.text
-            if data_string.strip().lower() == "null":
-                print("         [AI Flashcards] AI indicated text was not useful.")
-                return None
-            data = json.loads(data_string)
-            print(f"         [AI Flashcards] AI flashcards received (Attempt {attempt + 1}).")
-            return data
-
-        except Exception as e:
-            error_str = str(e)
-            is_rate_limit = "429" in error_str
-            is_server_error = any(code in error_str for code in ["500", "502", "503", "504"])
-            wait_time = 0
-
-            if is_rate_limit:
-                wait_time = 60
-                match = re.search(r'(?:retry(?:_delay)?|Please retry in)\s*(?:{\s*seconds:\s*|\s*)(\d+)', error_str,
-                                  re.IGNORECASE)
-                if match: wait_time = int(match.group(1)) + 2
-                print(f"         [AI Flashcards] Rate Limit (429). Waiting {wait_time}s...")
-            elif is_server_error:
-                wait_time = base_wait_time * (2 ** attempt)
-                print(f"         [AI Flashcards] Server Error. Waiting {wait_time}s...")
-            else:
-                wait_time = 5
-                print(f"         [AI Flashcards] Failed: {e}")
-
-            if response is not None and hasattr(response, 'text'):
-                print(f"         [AI Flashcards] Raw response content: {response.text}")
-
-            if attempt + 1 >= max_retries:
-                print(f"         [AI Flashcards] Max retries reached.")
-                break
-            else:
-                time.sleep(wait_time)
-                continue
-
-    return None
+    data = _generate_json(prompt, "AI Flashcards", "flashcards", use_cache=use_cache)
+    if data is not None: print("         [AI Flashcards] AI flashcards received.")
+    return data
     
 
-def generate_multiple_choice_ai(file_text: str, file_type: str) -> dict | None:
+def generate_multiple_choice_ai(file_text: str, file_type: str, use_cache=True) -> dict | None:
     """Sends extracted text to Gemini to generate multiple-choice review questions."""
     if not ai_client: return None
     if not file_text or file_text.isspace(): return None
@@ -275,44 +232,11 @@ def generate_multiple_choice_ai(file_text: str, file_type: str) -> dict | None:
     """
     # --- End New Prompt ---
 
-    max_retries = 3
-    base_wait_time = 10
-
-    for attempt in range(max_retries):
-        response = None
-        try:
-            # --- API Call ---
-            response = ai_client.generate_content(prompt)
-            data_string = response.text
-            if data_string.strip().lower() == "null":
-                print("         [AI MCQs] AI indicated text was not useful.")
-                return None
-            data = json.loads(data_string)
-            print(f"         [AI MCQs] AI multiple-choice questions received (Attempt {attempt+1}).")
-            return data # Success!
-
-        except Exception as e:
-            # --- (Full retry logic, same as before) ---
-            error_str = str(e); is_rate_limit = "429" in error_str; is_server_error = any(code in error_str for code in ["500", "502", "503", "504"])
-            wait_time = 0
-            if is_rate_limit:
-                wait_time = 60; match = re.search(r'(?:retry(?:_delay)?|Please retry in)\s*(?:{\s*seconds:\s*|\s*)(\d+)', error_str, re.IGNORECASE);
-                if match: wait_time = int(match.group(1)) + 2
-                print(f"         [AI MCQs] Rate Limit (429). Waiting {wait_time}s...")
-            elif is_server_error:
-                wait_time = base_wait_time * (2 ** attempt); print(f"         [AI MCQs] Server Error. Waiting {wait_time}s...")
-            else: wait_time = 5; print(f"         [AI MCQs] Failed: {e}")
-            
-            if response is not None and hasattr(response, 'text'):
-                 print(f"         [AI MCQs] Raw response content: {response.text}")
-            
-            if attempt + 1 >= max_retries: print(f"         [AI MCQs] Max retries reached."); break
-            else: time.sleep(wait_time); continue
-            # --- (End Retry Logic) ---
-
-    return None # Failed after retries
-
-def generate_hint_with_ai(file_text: str, file_type: str, user_question: str) -> dict | None:
+    data = _generate_json(prompt, "AI MCQs", "mcq", use_cache=use_cache)
+    if data is not None: print("         [AI MCQs] AI multiple-choice questions received.")
+    return data
+
+def generate_hint_with_ai(file_text: str, file_type: str, user_question: str, use_cache=True) -> dict | None:
     """Sends extracted text and a user's question to Gemini to get a hint."""
     if not ai_client: return None
     if not file_text or file_text.isspace(): return None
@@ -343,38 +267,38 @@ def generate_hint_with_ai(file_text: str, file_type: str, user_question: str) ->
     """
     # --- End New Prompt ---
 
-    max_retries = 3
-    base_wait_time = 10
-
-    for attempt in range(max_retries):
-        response = None
-        try:
-            response = ai_client.generate_content(prompt)
-            data_string = response.text
-            if data_string.strip().lower() == "null":
-                print("         [AI Hint] AI indicated text/question was not useful.")
-                return None
-            data = json.loads(data_string)
-            print(f"         [AI Hint] AI hint received (Attempt {attempt+1}).")
-            return data # Success!
-
-        except Exception as e:
-            # --- (Full retry logic, same as before) ---
-            error_str = str(e); is_rate_limit = "429" in error_str; is_server_error = any(code in error_str for code in ["500", "502", "503", "504"])
-            wait_time = 0
-            if is_rate_limit:
-                wait_time = 60; match = re.search(r'(?:retry(?:_delay)?|Please retry in)\s*(?:{\s*seconds:\s*|\s*)(\d+)', error_str, re.IGNORECASE);
-                if match: wait_time = int(match.group(1)) + 2
-                print(f"         [AI Hint] Rate Limit (429). Waiting {wait_time}s...")
-            elif is_server_error:
-                wait_time = base_wait_time * (2 ** attempt); print(f"         [AI Hint] Server Error. Waiting {wait_time}s...")
-            else: wait_time = 5; print(f"         [AI Hint] Failed: {e}")
-            
-            if response is not None and hasattr(response, 'text'):
-                 print(f"         [AI Hint] Raw response content: {response.text}")
-            
-            if attempt + 1 >= max_retries: print(f"         [AI Hint] Max retries reached."); break
-            else: time.sleep(wait_time); continue
-            # --- (End Retry Logic) ---
-
-    return None # Failed after retries
\ No newline at end of file
+    data = _generate_json(prompt, "AI Hint", "hint", use_cache=use_cache)
+    if data is not None: print("         [AI Hint] AI hint received.")
+    return data
+
+def submit_deadlines_batch(pages: list) -> Future | None:
+    """
+    Queues ONE Gemini request for the deadlines of several Moodle activity
+    pages, 'pages' being [(page_id, region_main_text), ...]. Collect the
+    answer with collect_deadlines_batch(); None if AI is disabled.
+    """
+    if not ai_client or not pages: return None
+
+    print(f"         [AI Deadlines] Sending {len(pages)} page(s) ({sum(len(t) for _, t in pages)} chars) to Gemini...")
+    page_blocks = "\n\n".join(f"=== PAGE {page_id} ===\n{text}" for page_id, text in pages)
+    prompt = f"""You are given the main text of {len(pages)} Moodle assignment/quiz pages, each starting with '=== PAGE <id> ==='.
+For EACH page find its due date, deadline or time remaining.
+Return ONLY a JSON array with one object per page:
+[{{"id": "<page id>", "status": "Due" | "Overdue" | "Time Remaining" | "Not Found", "time": "<the date/time text as written, or null>"}}]
+
+{page_blocks}"""
+
+    return _submit_json(prompt, "AI Deadlines", "deadlines", allow_null=False)
+
+def collect_deadlines_batch(future: Future | None, page_count: int) -> dict:
+    """{page_id: {"status", "time"}} for the pages of a submit_deadlines_batch() request where a deadline was found."""
+    if future is None: return {}
+    data = _collect_json(future, "AI Deadlines")
+    if data is None: return {}
+    if isinstance(data, dict): data = data.get("pages") or [data]
+    found = {}
+    for item in data:
+        if not isinstance(item, dict) or item.get("status") in (None, "Not Found") or not item.get("time"): continue
+        found[str(item.get("id"))] = {"status": item["status"], "time": item["time"]}
+    print(f"         [AI Deadlines] {len(found)}/{page_count} deadline(s) found.")
+    return found
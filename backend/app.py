@@ -11,6 +11,9 @@ import config
 import database
 import routes
 import schedule # Assuming you still use this for the background scheduler
+from search_service import merge_index_segments, migrate_stale_indexes
+from index_maintenance_service import run_index_maintenance
+from conversion_service import wait_for_conversions
 import state # To set stop flag
 
 # --- Create App ---
@@ -44,6 +47,17 @@ if __name__ == '__main__':
     # --- Setup Database on Start ---
     database.setup_database()
     
+    # --- Search index segment merges (off the scrape commits) ---
+    schedule.every(config.INDEX_MERGE_INTERVAL_MINUTES).minutes.do(
+        lambda: threading.Thread(target=merge_index_segments, daemon=True, name="index-merge").start()
+    ).tag("index_merge")
+    # --- Index maintenance: stats, optimize + sidecar check in the low-traffic window ---
+    schedule.every(config.INDEX_MAINTENANCE_INTERVAL_MINUTES).minutes.do(
+        lambda: threading.Thread(target=run_index_maintenance, daemon=True, name="index-maintenance").start()
+    ).tag("index_maintenance")
+    # --- Rebuild indexes from an older schema version (searches use the old one meanwhile) ---
+    threading.Thread(target=migrate_stale_indexes, daemon=True, name="index-migrate").start()
+
     # --- Start Background Scheduler ---
     print("[Scheduler] Starting background scheduler thread...")
     scheduler_thread = threading.Thread(target=run_background_schedule, daemon=True)
@@ -66,4 +80,8 @@ if __name__ == '__main__':
         if scheduler_thread.is_alive():
             scheduler_thread.join(timeout=5)
         print("[Scheduler] Scheduler thread stopped.")
+        # Let queued Office -> PDF conversions finish (they run on daemon threads)
+        print("[Converter] Waiting for queued PDF conversions...")
+        if not wait_for_conversions(timeout=config.CONVERT_TIMEOUT_SECONDS):
+            print(f"[Converter] Conversions still queued after {config.CONVERT_TIMEOUT_SECONDS}s; stopping anyway.")
         print("Flask server stopped.")
\ No newline at end of file
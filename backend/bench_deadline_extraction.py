@@ -0,0 +1,72 @@
+# bench_deadline_extraction.py
+# Benchmarks deadline extraction over saved activity pages (the *.html files the
+# scraper writes into courses_data). Compares the old full-page html.parser
+# parse with the #region-main engine in deadline_extractor (the parse
+# _scrape_subpage does once per page and shares with its file-link scan).
+#
+#   python bench_deadline_extraction.py [DIR] [--repeat N] [--all]
+
+import os
+import sys
+import glob
+import time
+import argparse
+import contextlib
+from bs4 import BeautifulSoup
+
+import deadline_extractor
+from deadline_extractor import extract_deadline, extract_deadline_with_selectors, HTML_PARSER
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "courses_data")
+
+def _legacy(html):
+    return extract_deadline_with_selectors(BeautifulSoup(html, "html.parser"))
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+def _time_pages(pages, fn, repeat):
+    per_page, results = [], []
+    for html in pages:
+        started = time.perf_counter()
+        for _ in range(repeat): result = fn(html)
+        per_page.append((time.perf_counter() - started) * 1000 / repeat)
+        results.append(result)
+    return per_page, results
+
+def run_benchmark(folder, repeat=3, include_all=False):
+    paths = sorted(glob.glob(os.path.join(folder, "**", "*.html"), recursive=True))
+    if not include_all: # Only activity pages that go through deadline extraction
+        paths = [p for p in paths if "mod%2Fassign" in p or "mod%2Fquiz" in p]
+    if not paths:
+        print(f"❌ No saved pages found under {folder} (use --all to include every *.html).")
+        return False
+    pages = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f: pages.append(f.read())
+    total_kb = sum(len(p) for p in pages) / 1024
+
+    print(f"🔧 {len(pages)} page(s), {total_kb:.0f} KB, {repeat} run(s) each, engine parser: {HTML_PARSER}")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull): # Silence per-hit logging
+        legacy_ms, legacy_results = _time_pages(pages, _legacy, repeat)
+        engine_ms, engine_results = _time_pages(pages, extract_deadline, repeat)
+
+    for name, timings, results in (("full page (html.parser)", legacy_ms, legacy_results),
+                                   ("#region-main engine", engine_ms, engine_results)):
+        found = sum(1 for r in results if r)
+        print(f"   {name:<24} mean {sum(timings) / len(timings):7.2f} ms/page   "
+              f"p95 {_percentile(timings, 0.95):7.2f} ms   found {found}/{len(pages)}")
+    agree = sum(1 for a, b in zip(legacy_results, engine_results) if a == b)
+    speedup = sum(legacy_ms) / max(sum(engine_ms), 1e-9)
+    print(f"   Same result on {agree}/{len(pages)} page(s); {speedup:.1f}x faster.")
+    print(f"   Engine stats: {deadline_extractor.extractor_stats()}")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark deadline extraction on saved pages.")
+    parser.add_argument("folder", nargs="?", default=DEFAULT_DIR)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--all", action="store_true", help="Include every *.html, not just assign/quiz pages")
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.folder, args.repeat, args.all) else 1)
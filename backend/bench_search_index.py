@@ -0,0 +1,84 @@
+# bench_search_index.py
+# Compares the search index with stored chunk text (INDEX_STORE_CONTENT=1)
+# against an index without it, where snippets are cut from the .txt sidecars.
+# Builds both from one user's sidecars in courses_data into temporary folders
+# and reports index size and the latency of a 10-hit page with snippets.
+#
+#   python bench_search_index.py USER_ID [--query Q ...] [--repeat N]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+from whoosh.index import create_in
+from whoosh.qparser import QueryParser
+
+import search_service
+from search_service import get_search_schema, sidecar_course_documents, search_results_page
+
+def _folder_mb(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names) / 1e6
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+def _build(folder, user_id, store_content):
+    ix = create_in(folder, get_search_schema(store_content=store_content))
+    started = time.perf_counter(); docs = 0
+    for course_docs in sidecar_course_documents(user_id):
+        writer = ix.writer(limitmb=search_service.INDEX_WRITER_LIMITMB)
+        for doc in course_docs: writer.add_document(**doc)
+        writer.commit(optimize=True); docs += len(course_docs)
+    return ix, docs, time.perf_counter() - started
+
+def _time_queries(ix, user_id, queries, repeat):
+    first, warm = [], []
+    search_service._sidecar_pages.cache_clear()
+    with ix.searcher() as searcher, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for query_str in queries:
+            query = QueryParser("content", ix.schema).parse(query_str)
+            for run in range(repeat):
+                started = time.perf_counter()
+                search_results_page(searcher, user_id, query, 1, 10)
+                (first if run == 0 else warm).append((time.perf_counter() - started) * 1000)
+    return first, warm
+
+def run_benchmark(user_id, queries=None, repeat=5):
+    tmp = tempfile.mkdtemp(prefix="bench_index_")
+    try:
+        rows = []
+        for store_content in (True, False):
+            folder = os.path.join(tmp, "stored" if store_content else "unstored")
+            os.makedirs(folder)
+            ix, docs, build_s = _build(folder, user_id, store_content)
+            if not docs:
+                print(f"❌ No sidecars found for user {user_id} under {search_service.SAVE_DIR}.")
+                return False
+            if not queries:
+                with ix.searcher() as searcher:
+                    queries = [term.decode("utf-8") for _, term in searcher.reader().most_frequent_terms("content", 5)]
+            first, warm = _time_queries(ix, user_id, queries, repeat)
+            rows.append(("stored content" if store_content else "sidecar snippets", docs, build_s, _folder_mb(folder), first, warm))
+
+        print(f"🔧 User {user_id}: {rows[0][1]} chunk document(s), queries {queries}, {repeat} run(s) each")
+        for name, docs, build_s, size_mb, first, warm in rows:
+            warm = warm or first
+            print(f"   {name:<17} index {size_mb:8.2f} MB   build {build_s:6.1f}s   "
+                  f"first query {sum(first) / len(first):7.2f} ms   warm mean {sum(warm) / len(warm):7.2f} ms   "
+                  f"p95 {_percentile(warm, 0.95):7.2f} ms")
+        print(f"   Index size: {rows[1][3] / max(rows[0][3], 1e-9):.0%} of the stored-content index.")
+        return True
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark stored vs sidecar search snippets.")
+    parser.add_argument("user_id")
+    parser.add_argument("--query", action="append", help="Query to time (repeatable); default: 5 most frequent terms")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.user_id, args.query, args.repeat) else 1)
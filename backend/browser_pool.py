@@ -0,0 +1,286 @@
+# browser_pool.py
+import time
+import atexit
+import hashlib
+import threading
+import requests
+from datetime import datetime
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import TimeoutException, NoSuchElementException
+import undetected_chromedriver as uc
+
+from config import (
+    LMS_BASE_URL, REQUESTS_TIMEOUT, BROWSER_POOL_MAX_DRIVERS, BROWSER_IDLE_SECONDS,
+    BROWSER_ACQUIRE_TIMEOUT, LMS_SESSION_TTL_SECONDS
+)
+from moodle_service import extract_sesskey
+
+# --- Warm browser pool + Moodle session cache ---
+# Starting Chrome and logging in costs seconds and hundreds of MB, so drivers
+# are kept warm per (kind, LMS account) and handed out one caller at a time.
+#   kind "headless": plain headless Chrome (scraper login / page fallback)
+#   kind "uc":       undetected_chromedriver window (homework submission)
+# Idle drivers are quit after BROWSER_IDLE_SECONDS; dead ones are replaced.
+# Logged-in cookies + sesskey are cached per account, so most scrapes skip the
+# browser entirely and new drivers skip the login form.
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.0.0 Safari/537.36"
+
+class _PooledDriver:
+    def __init__(self, key, kind):
+        self.key = key
+        self.kind = kind
+        self.driver = None
+        self.busy = True
+        self.logged_in = False
+        self.last_used = time.monotonic()
+
+_cond = threading.Condition()
+_drivers = {} # (kind, account_key) -> _PooledDriver
+_session_cache = {} # account_key -> {"cookies", "sesskey", "user_agent", "at"}
+_session_lock = threading.Lock()
+_reaper = None
+
+def _account_key(username, password) -> str:
+    # The password is part of the key so a wrong password never gets someone else's session
+    return f"{username}:{hashlib.sha256(password.encode('utf-8')).hexdigest()[:16]}"
+
+# --- Driver lifecycle ---
+
+def _create_driver(kind):
+    if kind == "uc":
+        options = uc.ChromeOptions()
+        options.add_argument("--start-maximized")
+        # options.add_argument("--headless") # Headless can be detected
+        options.add_argument("--disable-blink-features=AutomationControlled")
+        options.add_experimental_option("prefs", {
+            "profile.default_content_setting_values.notifications": 2,
+            "download.prompt_for_download": False
+        })
+        return uc.Chrome(options=options, use_subprocess=True)
+    options = webdriver.ChromeOptions()
+    for arg in ("--headless", "--disable-gpu", "--window-size=1920,1080", "--no-sandbox",
+                "--disable-dev-shm-usage", f"user-agent={DEFAULT_USER_AGENT}"):
+        options.add_argument(arg)
+    driver = webdriver.Chrome(options=options)
+    driver.implicitly_wait(10)
+    return driver
+
+def _is_healthy(driver) -> bool:
+    try:
+        driver.execute_script("return 1;")
+        return True
+    except Exception:
+        return False
+
+def _quit(entry):
+    if entry.driver:
+        try: entry.driver.quit()
+        except Exception: pass
+        entry.driver = None
+
+def _evict_idle_locked(force_one=False) -> bool:
+    """Quits drivers idle longer than BROWSER_IDLE_SECONDS (or the LRU idle one if force_one)."""
+    now = time.monotonic()
+    idle = sorted((e for e in _drivers.values() if not e.busy), key=lambda e: e.last_used)
+    evicted = False
+    for entry in idle:
+        if force_one or now - entry.last_used > BROWSER_IDLE_SECONDS:
+            print(f"[BrowserPool] Closing idle {entry.kind} browser for {entry.key[1].split(':')[0]}.")
+            del _drivers[entry.key]; _quit(entry); evicted = True
+            if force_one: break
+    return evicted
+
+def _reaper_loop():
+    while True:
+        time.sleep(30)
+        with _cond:
+            if _evict_idle_locked(): _cond.notify_all()
+
+def _checkout(key, kind) -> _PooledDriver:
+    global _reaper
+    deadline = time.monotonic() + BROWSER_ACQUIRE_TIMEOUT
+    with _cond:
+        if _reaper is None:
+            _reaper = threading.Thread(target=_reaper_loop, daemon=True, name="browser-reaper"); _reaper.start()
+        while True:
+            entry = _drivers.get(key)
+            if entry and not entry.busy:
+                entry.busy = True
+                break
+            if entry is None and (len(_drivers) < BROWSER_POOL_MAX_DRIVERS or _evict_idle_locked(force_one=True)):
+                entry = _PooledDriver(key, kind) # Reserved (busy); Chrome starts outside the lock
+                _drivers[key] = entry
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No browser available after {BROWSER_ACQUIRE_TIMEOUT}s (pool size {BROWSER_POOL_MAX_DRIVERS}).")
+            _cond.wait(remaining)
+
+    if entry.driver is not None and not _is_healthy(entry.driver):
+        print(f"[BrowserPool] Warm {kind} browser failed its health check; replacing it.")
+        _quit(entry); entry.logged_in = False
+    if entry.driver is None:
+        print(f"[BrowserPool] Launching {kind} browser...")
+        try:
+            entry.driver = _create_driver(kind)
+        except Exception:
+            _discard(entry); raise
+    else:
+        print(f"[BrowserPool] Reusing warm {kind} browser.")
+    return entry
+
+def _release(entry):
+    with _cond:
+        entry.busy = False; entry.last_used = time.monotonic()
+        _cond.notify_all()
+
+def _discard(entry):
+    with _cond:
+        if _drivers.get(entry.key) is entry: del _drivers[entry.key]
+        _cond.notify_all()
+    _quit(entry)
+
+@contextmanager
+def acquire_driver(username, password, kind="headless"):
+    """
+    Yields a logged-in driver for this LMS account, reusing a warm one when
+    possible. The driver goes back to the pool afterwards, or is discarded if
+    the caller raised (its state is unknown).
+    """
+    entry = _checkout((kind, _account_key(username, password)), kind)
+    try:
+        if not entry.logged_in:
+            _log_in(entry.driver, username, password)
+            entry.logged_in = True
+        yield entry.driver
+    except BaseException:
+        _discard(entry)
+        raise
+    else:
+        _release(entry)
+
+def shutdown_pool():
+    with _cond:
+        entries = list(_drivers.values()); _drivers.clear()
+    for entry in entries: _quit(entry)
+
+atexit.register(shutdown_pool)
+
+# --- Login ---
+
+def _on_logged_in_page(driver) -> bool:
+    return "/login/" not in driver.current_url and bool(driver.find_elements(By.ID, "loggedin-user"))
+
+def _log_in(driver, username, password):
+    """Logs the driver in: cached session cookies first, the login form only if they are stale."""
+    with _session_lock:
+        cached = _session_cache.get(_account_key(username, password))
+        cookies = dict(cached["cookies"]) if cached else None
+    if cookies:
+        driver.get(f"{LMS_BASE_URL}/") # Cookies can only be set for the current domain
+        driver.delete_all_cookies()
+        for name, value in cookies.items():
+            driver.add_cookie({"name": name, "value": value})
+        driver.get(f"{LMS_BASE_URL}/my/")
+        if _on_logged_in_page(driver):
+            print("   ✅ Logged in with cached session cookies (login form skipped).")
+            return
+    _login_form(driver, username, password)
+
+def _login_form(driver, username, password):
+    """Submits the Moodle login form. Raises on failure."""
+    print(f"   Attempting login...")
+    driver.get(f"{LMS_BASE_URL}/login/index.php")
+    try:
+        username_field = WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.ID, "username")))
+        username_field.send_keys(username)
+        driver.find_element(By.ID, "password").send_keys(password)
+        driver.find_element(By.ID, "loginbtn").click()
+        print("   Login form submitted. Waiting for login result...")
+        WebDriverWait(driver, 25).until(
+            EC.any_of(
+                EC.presence_of_element_located((By.ID, "loggedin-user")),
+                EC.presence_of_element_located((By.CSS_SELECTOR, "div.alert.alert-danger"))
+            )
+        )
+    except TimeoutException:
+        print("   ❌ Login failed: Timeout waiting for success/failure element.")
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S"); driver.save_screenshot(f"login_timeout_{timestamp}.png")
+        raise
+    try:
+        driver.find_element(By.ID, "loggedin-user")
+        print("   ✅ Login successful (Found 'loggedin-user' ID).")
+    except NoSuchElementException: # Login failed
+        error_message = "Unknown login error"
+        try: error_message = driver.find_element(By.CSS_SELECTOR, "div.alert.alert-danger").text
+        except NoSuchElementException: pass
+        print(f"   ❌ Login failed: {error_message}")
+        raise Exception(f"Login failed: {error_message}")
+
+# --- Session cache for HTTP scraping ---
+
+def _validate_cached_session(cached) -> str | None:
+    """Cheap HTTP check that cached cookies are still logged in. Returns a fresh sesskey or None."""
+    try:
+        response = requests.get(f"{LMS_BASE_URL}/my/courses.php", cookies=cached["cookies"],
+                                headers={"user-agent": cached["user_agent"]}, timeout=REQUESTS_TIMEOUT)
+        if response.status_code != 200 or "/login/index.php" in response.url: return None
+        return extract_sesskey(response.text)
+    except requests.exceptions.RequestException:
+        return None
+
+def get_lms_session(username, password) -> dict:
+    """
+    Returns {"cookies", "sesskey", "user_agent"} for a logged-in Moodle session.
+    A cached session that still validates over HTTP is reused without any
+    browser; otherwise a pooled driver logs in and the new session is cached.
+    """
+    key = _account_key(username, password)
+    with _session_lock:
+        cached = _session_cache.get(key)
+    if cached and time.time() - cached["at"] < LMS_SESSION_TTL_SECONDS:
+        sesskey = _validate_cached_session(cached)
+        if sesskey:
+            print("   ♻️ Reusing cached LMS session (no browser needed).")
+            with _session_lock:
+                cached["sesskey"] = sesskey
+            return {"cookies": dict(cached["cookies"]), "sesskey": sesskey, "user_agent": cached["user_agent"]}
+        print("   Cached LMS session expired; logging in again.")
+    with _session_lock:
+        _session_cache.pop(key, None)
+
+    with acquire_driver(username, password) as driver:
+        print("      Extracting session key & cookies...")
+        driver.get(f"{LMS_BASE_URL}/my/courses.php")
+        if "/login/index.php" in driver.current_url: # Warm browser's session timed out
+            _login_form(driver, username, password)
+            driver.get(f"{LMS_BASE_URL}/my/courses.php")
+        time.sleep(2)
+        page_source = driver.page_source
+        sesskey = extract_sesskey(page_source)
+        if not sesskey:
+            print("      Failed to extract sesskey from /my/courses.php.")
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            try:
+                 driver.save_screenshot(f"sesskey_fail_screenshot_{timestamp}.png")
+                 with open(f"sesskey_fail_source_{timestamp}.html", "w", encoding="utf-8") as f: f.write(page_source)
+                 print(f"         Saved debug info for sesskey failure.")
+            except Exception as save_e: print(f"         Could not save debug info: {save_e}")
+            raise ValueError("Sesskey not found post-login")
+        cookies = {c['name']: c['value'] for c in driver.get_cookies()}
+        user_agent = driver.execute_script("return navigator.userAgent;")
+
+    print(f"      🔑 Sesskey: {sesskey}")
+    with _session_lock:
+        _session_cache[key] = {"cookies": cookies, "sesskey": sesskey, "user_agent": user_agent, "at": time.time()}
+    return {"cookies": dict(cookies), "sesskey": sesskey, "user_agent": user_agent}
+
+def invalidate_lms_session(username, password):
+    """Drops a cached session (e.g. after the LMS bounced it to the login page)."""
+    with _session_lock:
+        _session_cache.pop(_account_key(username, password), None)
@@ -17,9 +17,13 @@ from config import (
     GOOGLE_API_KEY,
     DATABASE_FILE,
     SAVE_DIR,
-    MAX_TEXT_LENGTH_FOR_SUMMARY
+    MAX_TEXT_LENGTH_FOR_SUMMARY,
+    SEMANTIC_SEARCH_ENABLED,
+    SEMANTIC_CANDIDATES
 )
-from scraper_service import read_pdf, read_docx, read_pptx, read_txt
+from extraction_service import extract_text
+from semantic_service import semantic_search, vectors_current
+from search_service import hit_text
 
 # --- Environment Variables (Add to your .env file) ---
 # ANTHROPIC_API_KEY=sk-ant-...
@@ -89,10 +93,12 @@ if OPENAI_API_KEY:
 
 
 
-def get_course_context(user_id: int, course_db_id: int, max_chars: int = 15000) -> str:
+def get_course_context(user_id: int, course_db_id: int, max_chars: int = 15000, query: str | None = None) -> str:
     """
     Retrieves text content from a specific course's scraped files.
-    Returns concatenated text up to max_chars.
+    With a 'query' (the user's message) and semantic search enabled, the
+    course's chunks most similar to it are used; otherwise the .txt files
+    are concatenated. Returns text up to max_chars.
     """
     print(f"[Chat] Loading course context for course_db_id {course_db_id}...")
     
@@ -119,6 +125,11 @@ def get_course_context(user_id: int, course_db_id: int, max_chars: int = 15000)
         if not os.path.exists(course_folder):
             return ""
         
+        if query and SEMANTIC_SEARCH_ENABLED and vectors_current(user_id):
+            relevant = get_relevant_chunks(user_id, course['lms_course_id'], query, max_chars)
+            if relevant:
+                return f"=== COURSE: {course['name']} (most relevant excerpts) ===\n\n{relevant}"
+
         # Read all .txt files (which contain extracted text)
         all_text = f"=== COURSE: {course['name']} ===\n\n"
         
@@ -143,6 +154,18 @@ def get_course_context(user_id: int, course_db_id: int, max_chars: int = 15000)
         return ""
 
 
+def get_relevant_chunks(user_id: int, lms_course_id, query: str, max_chars: int) -> str:
+    """The course's chunks closest to the query (semantic_service), as '--- file (p.N) ---' blocks."""
+    parts = []; total = 0
+    for row, _score in semantic_search(user_id, query, SEMANTIC_CANDIDATES, course_id=lms_course_id):
+        text = hit_text(row, user_id)
+        if not text: continue
+        block = f"--- {row['file_name']}{' (' + row['location'] + ')' if row.get('location') else ''} ---\n{text}\n\n"
+        if total + len(block) > max_chars: break
+        parts.append(block); total += len(block)
+    return "".join(parts)
+
+
 def extract_file_content(user_id: int, course_db_id: int, filename: str) -> tuple[str, str]:
     """
     Extracts text from an uploaded/referenced file.
@@ -171,19 +194,8 @@ def extract_file_content(user_id: int, course_db_id: int, filename: str) -> tupl
         if not os.path.exists(file_path):
             return "Unknown", ""
         
-        # Extract based on file type
-        ext = os.path.splitext(filename)[1].lower()
-        
-        if ext == '.pdf':
-            return "PDF", read_pdf(file_path)
-        elif ext == '.docx':
-            return "Word", read_docx(file_path)
-        elif ext == '.pptx':
-            return "PowerPoint", read_pptx(file_path)
-        elif ext == '.txt':
-            return "Text", read_txt(file_path)
-        else:
-            return "Unknown", ""
+        # Extract based on file type (PDF/DOCX/PPTX parsing runs in the extraction pool)
+        return extract_text(file_path)
             
     except Exception as e:
         print(f"[Chat] Error extracting file {filename}: {e}")
@@ -479,7 +491,7 @@ def send_chat_message(
         
         # Add course context if specified
         if course_db_id:
-            course_context = get_course_context(user_id, course_db_id)
+            course_context = get_course_context(user_id, course_db_id, query=message)
             if course_context:
                 context_parts.append(course_context)
         
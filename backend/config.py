@@ -13,6 +13,10 @@ INDEX_DIR = os.path.join(APP_ROOT, "search_index")
 UPLOAD_FOLDER = os.path.join(APP_ROOT, 'uploads')
 MEET_RECORDING_DIR = os.path.join(APP_ROOT, "meet_recordings") # Renamed from ZOOM
 STATE_FILE = os.path.join(APP_ROOT, 'scrape_state.json')
+TEXT_CACHE_FILE = os.path.join(APP_ROOT, 'text_cache.db')
+CONVERT_PROFILE_DIR = os.path.join(APP_ROOT, 'soffice_profiles') # Persistent LibreOffice user profiles
+SEMANTIC_DIR = os.path.join(APP_ROOT, 'semantic_index') # Per-user chunk embeddings
+AI_CACHE_FILE = os.path.join(APP_ROOT, 'ai_cache.db') # Cached AI answers (ai_cache_service)
 
 # --- Credentials ---
 LMS_USERNAME = os.environ.get("LMS_USERNAME")
@@ -24,10 +28,94 @@ GMAIL_APP_PASSWORD = os.environ.get("GMAIL_APP_PASSWORD")
 GMAIL_RECEIVER = os.environ.get("GMAIL_RECEIVER")
 
 # --- Scraper Config ---
+LMS_BASE_URL = os.environ.get("LMS_BASE_URL", "https://lms.fit.hanu.vn")
+# "ws": discover course contents/assignments through Moodle web services (AJAX), HTML as fallback
+# "html": crawl course and activity pages only
+SCRAPE_CRAWLER_MODE = os.environ.get("SCRAPE_CRAWLER_MODE", "ws")
+# Load a page in headless Chrome (with the session cookies) when plain HTTP can't
+SCRAPE_SELENIUM_FALLBACK = os.environ.get("SCRAPE_SELENIUM_FALLBACK", "1") == "1"
 REQUESTS_TIMEOUT = 30
 MAX_SUBPAGES = None
 MAX_TEXT_LENGTH_FOR_SUMMARY = 75000
 ALLOWED_EXTENSIONS = {'.txt', '.pdf', '.docx', '.pptx'}
+# Scrape jobs run concurrently for different users, at most this many at once
+SCRAPE_MAX_CONCURRENT_JOBS = int(os.environ.get("SCRAPE_MAX_CONCURRENT_JOBS", "2"))
+# Seconds a scrape waits for another scrape's index commit to release the writer lock
+INDEX_WRITER_TIMEOUT = int(os.environ.get("INDEX_WRITER_TIMEOUT", "300"))
+# Whoosh writer tuning. Big per-course batches of the offline rebuild (rebuild_search_index.py)
+# are indexed by a multi-process writer; the server never forks one (see open_index_writer).
+# Defaults to 1 proc on Windows, where subprocesses re-import the whole app.
+INDEX_WRITER_PROCS = int(os.environ.get("INDEX_WRITER_PROCS", "1" if os.name == "nt" else str(min(4, os.cpu_count() or 1))))
+INDEX_WRITER_LIMITMB = int(os.environ.get("INDEX_WRITER_LIMITMB", "256")) # Posting pool memory per writer (process)
+INDEX_BULK_MIN_DOCS = int(os.environ.get("INDEX_BULK_MIN_DOCS", "50")) # Smaller batches use a single-process writer
+# Commits don't merge segments; a scheduled job does, optimizing when there are too many
+INDEX_MERGE_INTERVAL_MINUTES = int(os.environ.get("INDEX_MERGE_INTERVAL_MINUTES", "30"))
+INDEX_MAX_SEGMENTS = int(os.environ.get("INDEX_MAX_SEGMENTS", "24"))
+# Index maintenance job: segment stats every interval; the optimize (which also purges deleted
+# documents) and the .txt sidecar integrity check only run in the low-traffic window
+# (local hours "start-end", empty = any time) and once nobody has searched for IDLE minutes
+INDEX_MAINTENANCE_INTERVAL_MINUTES = int(os.environ.get("INDEX_MAINTENANCE_INTERVAL_MINUTES", "60"))
+INDEX_MAINTENANCE_WINDOW = os.environ.get("INDEX_MAINTENANCE_WINDOW", "2-6")
+INDEX_MAINTENANCE_IDLE_MINUTES = int(os.environ.get("INDEX_MAINTENANCE_IDLE_MINUTES", "5"))
+INDEX_VERIFY_REPAIR = os.environ.get("INDEX_VERIFY_REPAIR", "1") == "1" # Re-index files that don't match their sidecar
+SEARCH_LATENCY_SAMPLES = int(os.environ.get("SEARCH_LATENCY_SAMPLES", "2000")) # Recent searches kept for the p95
+# Files are indexed per PDF page / PPTX slide; longer pages and page-less files are split at this size
+INDEX_CHUNK_CHARS = int(os.environ.get("INDEX_CHUNK_CHARS", "3000"))
+# Keep each chunk's text in the index (Whoosh deflates stored fields). With 0 only the
+# inverted index is written and snippets are cut from the .txt sidecars at query time.
+INDEX_STORE_CONTENT = os.environ.get("INDEX_STORE_CONTENT", "1") == "1"
+# Semantic / hybrid search: chunk embeddings kept next to each user's keyword index.
+# SEMANTIC_MODEL is a sentence-transformers model run on CPU; without the package
+# (or with "hashing") hashed word vectors are used instead.
+SEMANTIC_SEARCH_ENABLED = os.environ.get("SEMANTIC_SEARCH_ENABLED", "1") == "1"
+SEMANTIC_MODEL = os.environ.get("SEMANTIC_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+SEMANTIC_EMBED_BATCH = int(os.environ.get("SEMANTIC_EMBED_BATCH", "32"))
+SEMANTIC_CANDIDATES = int(os.environ.get("SEMANTIC_CANDIDATES", "100")) # Per ranker, before hybrid fusion
+SEMANTIC_MIN_SCORE = float(os.environ.get("SEMANTIC_MIN_SCORE", "0.1")) # Chunks less similar than this are dropped
+# /api/search/suggest: term dictionaries kept in memory (one per user, LRU) and completions returned
+SUGGEST_MAX_USERS = int(os.environ.get("SUGGEST_MAX_USERS", "64"))
+SUGGEST_LIMIT = int(os.environ.get("SUGGEST_LIMIT", "8"))
+# Per-user search result cache (LRU + TTL); entries die with the index generation they came from
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "2000"))
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get("SEARCH_CACHE_TTL_SECONDS", "600"))
+# Long-lived Whoosh searchers kept open (one per user index, least recently used closed first)
+SEARCHER_MAX_OPEN = int(os.environ.get("SEARCHER_MAX_OPEN", "64"))
+# /api/search paging: default and largest page_size a client may ask for
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", "10"))
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get("SEARCH_MAX_PAGE_SIZE", "50"))
+# Worker pools for the pipelined scrape (HTML subpages / downloads + text extraction)
+SCRAPE_PAGE_WORKERS = int(os.environ.get("SCRAPE_PAGE_WORKERS", "6"))
+SCRAPE_DOWNLOAD_WORKERS = int(os.environ.get("SCRAPE_DOWNLOAD_WORKERS", "4"))
+# Shared keep-alive HTTP session: connection pool size and download retry/backoff
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", str(SCRAPE_PAGE_WORKERS + SCRAPE_DOWNLOAD_WORKERS)))
+DOWNLOAD_MAX_RETRIES = int(os.environ.get("DOWNLOAD_MAX_RETRIES", "3"))
+DOWNLOAD_BACKOFF_SECONDS = float(os.environ.get("DOWNLOAD_BACKOFF_SECONDS", "1.0"))
+# A failed/interrupted scrape is resumed from its checkpoints if it started less than this long ago
+SCRAPE_RESUME_MAX_AGE_HOURS = int(os.environ.get("SCRAPE_RESUME_MAX_AGE_HOURS", "24"))
+# Incremental scrapes skip files whose ETag/Last-Modified/sha256 did not change
+SCRAPE_INCREMENTAL = os.environ.get("SCRAPE_INCREMENTAL", "1") == "1"
+# Text extraction process pool (0 workers = extract inline in the calling thread)
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_TIMEOUT_SECONDS = int(os.environ.get("EXTRACT_TIMEOUT_SECONDS", "120"))
+EXTRACT_MAX_PAGES = int(os.environ.get("EXTRACT_MAX_PAGES", "500"))
+EXTRACT_RECYCLE_AFTER = int(os.environ.get("EXTRACT_RECYCLE_AFTER", "200")) # Tasks before the pool is replaced
+TEXT_CACHE_MAX_MB = int(os.environ.get("TEXT_CACHE_MAX_MB", "512"))
+# Office -> PDF conversion (LibreOffice). SOFFICE_PATH falls back to PATH lookup.
+SOFFICE_PATH = os.environ.get("SOFFICE_PATH")
+CONVERT_WORKERS = int(os.environ.get("CONVERT_WORKERS", "1"))
+CONVERT_BATCH_SIZE = int(os.environ.get("CONVERT_BATCH_SIZE", "20"))
+CONVERT_BATCH_DELAY_SECONDS = float(os.environ.get("CONVERT_BATCH_DELAY_SECONDS", "2"))
+CONVERT_TIMEOUT_SECONDS = int(os.environ.get("CONVERT_TIMEOUT_SECONDS", "60")) # Per file in a batch
+# Pages the deadline selectors can't parse go to Gemini in batches after the crawl
+AI_DEADLINE_BATCH_PAGES = int(os.environ.get("AI_DEADLINE_BATCH_PAGES", "8"))
+AI_DEADLINE_BATCH_TOKENS = int(os.environ.get("AI_DEADLINE_BATCH_TOKENS", "12000")) # ~4 chars per token
+AI_DEADLINE_PAGE_CHARS = int(os.environ.get("AI_DEADLINE_PAGE_CHARS", "6000")) # #region-main text kept per page
+# Warm, logged-in browsers kept per LMS account (scraper + homework submission)
+BROWSER_POOL_MAX_DRIVERS = int(os.environ.get("BROWSER_POOL_MAX_DRIVERS", "3"))
+BROWSER_IDLE_SECONDS = int(os.environ.get("BROWSER_IDLE_SECONDS", "600")) # Idle browsers are quit after this
+BROWSER_ACQUIRE_TIMEOUT = int(os.environ.get("BROWSER_ACQUIRE_TIMEOUT", "300")) # Wait for a free browser slot
+# Cached Moodle session cookies are re-validated over HTTP and reused up to this age
+LMS_SESSION_TTL_SECONDS = int(os.environ.get("LMS_SESSION_TTL_SECONDS", "3600"))
 
 # --- Google Calendar ---
 GOOGLE_SERVICE_ACCOUNT_FILE = os.environ.get("GOOGLE_SERVICE_ACCOUNT_FILE")
@@ -37,8 +125,22 @@ GOOGLE_CLEANUP_DELETED = os.environ.get("GOOGLE_CLEANUP_DELETED", "1") == "1"
 GOOGLE_REMINDER_MINUTES = [int(m) for m in os.environ.get("GOOGLE_REMINDER_MINUTES", "60,1440").split(",")]
 GOOGLE_EVENT_DURATION_MIN = int(os.environ.get("GOOGLE_EVENT_DURATION_MIN", "1"))
 
+# --- AI Gateway (ai_gateway.py) ---
+# Requests per minute and burst allowed per provider + API key; a 429 pauses that key for everyone
+AI_RATE_PER_MINUTE = float(os.environ.get("AI_RATE_PER_MINUTE", "15"))
+AI_BURST = int(os.environ.get("AI_BURST", "5"))
+AI_MAX_CONCURRENCY = int(os.environ.get("AI_MAX_CONCURRENCY", "4")) # Model calls in flight at once
+AI_MAX_RETRIES = int(os.environ.get("AI_MAX_RETRIES", "3"))
+AI_BACKOFF_BASE_SECONDS = float(os.environ.get("AI_BACKOFF_BASE_SECONDS", "2")) # Doubled per retry, with jitter
+AI_BACKOFF_MAX_SECONDS = float(os.environ.get("AI_BACKOFF_MAX_SECONDS", "60"))
+AI_CALL_TIMEOUT_SECONDS = int(os.environ.get("AI_CALL_TIMEOUT_SECONDS", "180")) # A caller's wait, queueing included
+# Cache of parsed AI answers keyed by a fingerprint of model, config, prompt template version and input
+AI_CACHE_ENABLED = os.environ.get("AI_CACHE_ENABLED", "1") == "1"
+AI_CACHE_TTL_HOURS = int(os.environ.get("AI_CACHE_TTL_HOURS", "720"))
+AI_CACHE_MAX_MB = int(os.environ.get("AI_CACHE_MAX_MB", "64"))
+
 # --- Create Folders ---
-for folder in [SAVE_DIR, INDEX_DIR, UPLOAD_FOLDER, MEET_RECORDING_DIR]:
+for folder in [SAVE_DIR, INDEX_DIR, SEMANTIC_DIR, UPLOAD_FOLDER, MEET_RECORDING_DIR]:
     os.makedirs(folder, exist_ok=True)
 
 if not LMS_USERNAME or not LMS_PASSWORD:
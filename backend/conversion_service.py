@@ -0,0 +1,163 @@
+# conversion_service.py
+import os
+import time
+import queue
+import shutil
+import threading
+import subprocess
+
+from config import (
+    SOFFICE_PATH, CONVERT_WORKERS, CONVERT_BATCH_SIZE, CONVERT_BATCH_DELAY_SECONDS,
+    CONVERT_TIMEOUT_SECONDS, CONVERT_PROFILE_DIR
+)
+
+# --- Office -> PDF conversion ---
+# Conversions run on background worker threads, off the scrape critical path.
+# Queued files are grouped per output folder and converted with ONE soffice
+# invocation per batch. Each worker also keeps its own persistent LibreOffice
+# profile (-env:UserInstallation), so only the very first run pays for profile
+# creation; a profile cannot be shared by concurrent soffice processes.
+
+_SOFFICE_CANDIDATES = [
+    "soffice", "libreoffice", "soffice.com",
+    r"C:\Program Files\LibreOffice\program\soffice.com",
+    r"C:\Program Files (x86)\LibreOffice\program\soffice.com",
+    "/Applications/LibreOffice.app/Contents/MacOS/soffice",
+]
+
+_soffice_binary = None
+_soffice_lookup_done = False
+_queue = queue.Queue()
+_workers = []
+_workers_lock = threading.Lock()
+_pending = 0
+_pending_cond = threading.Condition()
+_stats_lock = threading.Lock()
+_stats = {"converted": 0, "skipped": 0, "failed": 0, "batches": 0, "seconds": 0.0}
+
+def find_soffice() -> str | None:
+    """Resolves the LibreOffice binary from SOFFICE_PATH, then PATH, then common install dirs."""
+    global _soffice_binary, _soffice_lookup_done
+    if _soffice_lookup_done: return _soffice_binary
+    for candidate in ([SOFFICE_PATH] if SOFFICE_PATH else []) + _SOFFICE_CANDIDATES:
+        resolved = shutil.which(candidate) or (candidate if os.path.isfile(candidate) else None)
+        if resolved:
+            _soffice_binary = resolved
+            break
+    _soffice_lookup_done = True
+    if _soffice_binary: print(f"[Converter] Using LibreOffice at {_soffice_binary}")
+    else: print("[Converter] ⚠️ LibreOffice (soffice) not found. Set SOFFICE_PATH to enable PDF conversion.")
+    return _soffice_binary
+
+def _pdf_path_for(file_path, output_dir) -> str:
+    return os.path.join(output_dir, f"{os.path.splitext(os.path.basename(file_path))[0]}.pdf")
+
+def is_pdf_up_to_date(file_path, output_dir) -> bool:
+    """True if the converted PDF already exists and is newer than its source."""
+    pdf_path = _pdf_path_for(file_path, output_dir)
+    try:
+        return os.path.getmtime(pdf_path) >= os.path.getmtime(file_path)
+    except OSError:
+        return False
+
+def _bump_stats(**deltas):
+    with _stats_lock:
+        for key, value in deltas.items(): _stats[key] += value
+
+def _run_soffice(files, output_dir, profile_dir) -> list:
+    """Converts a batch of files in one soffice process. Returns the PDF paths that now exist."""
+    soffice = find_soffice()
+    if not soffice: return []
+    profile_url = "file:///" + os.path.abspath(profile_dir).replace("\\", "/").lstrip("/")
+    command = [soffice, f"-env:UserInstallation={profile_url}", "--headless", "--norestore",
+               "--convert-to", "pdf", "--outdir", output_dir, *files]
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(command, capture_output=True, text=True,
+                                timeout=CONVERT_TIMEOUT_SECONDS * len(files))
+        if result.returncode != 0:
+            print(f"   [Converter]  Batch failed. Return code: {result.returncode}")
+            print(f"   [Converter] STDERR: {result.stderr}")
+    except subprocess.TimeoutExpired:
+        print(f"   [Converter]  ERROR: Batch of {len(files)} file(s) in {output_dir} timed out.")
+    except Exception as e:
+        print(f"   [Converter]  An unexpected error occurred during conversion: {e}")
+    elapsed = time.perf_counter() - started
+
+    converted = [p for p in (_pdf_path_for(f, output_dir) for f in files) if os.path.exists(p)]
+    _bump_stats(converted=len(converted), failed=len(files) - len(converted), batches=1, seconds=elapsed)
+    print(f"   [Converter]  {len(converted)}/{len(files)} file(s) -> PDF in {elapsed:.1f}s ({os.path.basename(output_dir)})")
+    return converted
+
+# --- Background batching workers ---
+
+def _mark_done(count):
+    global _pending
+    with _pending_cond:
+        _pending -= count
+        if _pending <= 0: _pending_cond.notify_all()
+
+def _worker_loop(worker_idx):
+    profile_dir = os.path.join(CONVERT_PROFILE_DIR, f"worker_{worker_idx}")
+    while True:
+        first = _queue.get()
+        # Give the scraper a moment to queue the rest of the folder, then drain
+        time.sleep(CONVERT_BATCH_DELAY_SECONDS)
+        items = [first]
+        while True:
+            try: items.append(_queue.get_nowait())
+            except queue.Empty: break
+
+        by_folder = {}
+        for file_path, output_dir in items:
+            by_folder.setdefault(output_dir, [])
+            if file_path not in by_folder[output_dir]: by_folder[output_dir].append(file_path)
+        try:
+            for output_dir, files in by_folder.items():
+                todo = [f for f in files if os.path.exists(f) and not is_pdf_up_to_date(f, output_dir)]
+                if len(todo) < len(files): _bump_stats(skipped=len(files) - len(todo))
+                for i in range(0, len(todo), CONVERT_BATCH_SIZE):
+                    _run_soffice(todo[i:i + CONVERT_BATCH_SIZE], output_dir, profile_dir)
+        except Exception as e:
+            print(f"   [Converter]  Worker {worker_idx} error: {e}")
+        finally:
+            _mark_done(len(items))
+
+def _ensure_workers():
+    with _workers_lock:
+        if _workers: return
+        os.makedirs(CONVERT_PROFILE_DIR, exist_ok=True)
+        for i in range(max(1, CONVERT_WORKERS)):
+            t = threading.Thread(target=_worker_loop, args=(i,), daemon=True, name=f"soffice-{i}")
+            t.start(); _workers.append(t)
+
+def enqueue_conversion(file_path, output_dir) -> bool:
+    """
+    Queues a .docx/.pptx for background PDF conversion and returns immediately.
+    Returns False if nothing was queued (PDF already up to date or no soffice).
+    """
+    if is_pdf_up_to_date(file_path, output_dir):
+        _bump_stats(skipped=1); return False
+    global _pending
+    if not find_soffice(): return False
+    _ensure_workers()
+    with _pending_cond: _pending += 1
+    _queue.put((file_path, output_dir))
+    return True
+
+def wait_for_conversions(timeout=None) -> bool:
+    """Blocks until every queued conversion has finished (app.py shutdown). Returns False on timeout."""
+    deadline = time.monotonic() + timeout if timeout else None
+    with _pending_cond:
+        while _pending > 0:
+            remaining = deadline - time.monotonic() if deadline else None
+            if remaining is not None and remaining <= 0: return False
+            _pending_cond.wait(remaining)
+    return True
+
+def conversion_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["seconds"] = round(stats["seconds"], 1)
+    stats["queued"] = _pending
+    return stats
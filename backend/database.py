@@ -222,6 +222,73 @@ def init_db(db_conn):
         db_conn.rollback()
         raise
 
+def ensure_scrape_tables(db_conn):
+    """
+    Creates the scraper bookkeeping tables if they are missing.
+    Safe to run on every start (and from the scrape thread's own connection),
+    so existing databases pick them up without a separate migration script.
+    """
+    db_conn.executescript("""
+    /* One row per downloaded LMS file: lets incremental scrapes send
+       conditional requests and skip unchanged files entirely. */
+    CREATE TABLE IF NOT EXISTS file_manifest (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id INTEGER NOT NULL,
+      lms_course_id INTEGER NOT NULL,
+      url TEXT NOT NULL,
+      local_path TEXT,
+      file_type TEXT,
+      etag TEXT,
+      last_modified TEXT,
+      size INTEGER,
+      sha256 TEXT,
+      updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+      UNIQUE(user_id, url),
+      FOREIGN KEY (user_id) REFERENCES user (id) ON DELETE CASCADE
+    );
+
+    /* Fingerprint of each course's deadlines/assignments/files from the last scrape */
+    CREATE TABLE IF NOT EXISTS course_scrape_state (
+      user_id INTEGER NOT NULL,
+      lms_course_id INTEGER NOT NULL,
+      content_hash TEXT NOT NULL,
+      scraped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (user_id, lms_course_id),
+      FOREIGN KEY (user_id) REFERENCES user (id) ON DELETE CASCADE
+    );
+
+    /* The user's latest scrape run; an unfinished run is resumed by the next scrape */
+    CREATE TABLE IF NOT EXISTS scrape_runs (
+      user_id INTEGER PRIMARY KEY,
+      run_id TEXT NOT NULL,
+      status TEXT NOT NULL, /* running | failed | completed */
+      started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+      updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+      FOREIGN KEY (user_id) REFERENCES user (id) ON DELETE CASCADE
+    );
+
+    /* Courses fully committed (DB rows + index docs) within a run */
+    CREATE TABLE IF NOT EXISTS scrape_checkpoints (
+      user_id INTEGER NOT NULL,
+      run_id TEXT NOT NULL,
+      lms_course_id INTEGER NOT NULL,
+      completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (user_id, run_id, lms_course_id),
+      FOREIGN KEY (user_id) REFERENCES user (id) ON DELETE CASCADE
+    );
+
+    /* Parsed subpage results within a run (nested files, assignment, deadline as JSON) */
+    CREATE TABLE IF NOT EXISTS scrape_subpage_checkpoints (
+      user_id INTEGER NOT NULL,
+      run_id TEXT NOT NULL,
+      url TEXT NOT NULL,
+      result_json TEXT NOT NULL,
+      PRIMARY KEY (user_id, run_id, url),
+      FOREIGN KEY (user_id) REFERENCES user (id) ON DELETE CASCADE
+    );
+    """)
+    db_conn.commit()
+
 def setup_database():
     """
     Ensures the DB file AND tables exist before starting.
@@ -245,6 +312,8 @@ def setup_database():
             print("[DB] Tables not found. Initializing database...")
             # Pass the connection to init_db
             init_db(db) # This function will create tables and commit
+
+        ensure_scrape_tables(db)
             
     except Exception as e:
         print(f"[DB] ❌ Error during database setup: {e}")
@@ -0,0 +1,184 @@
+# deadline_extractor.py
+import re
+import time
+import threading
+import soupsieve
+from bs4 import BeautifulSoup, SoupStrainer, FeatureNotFound
+
+# --- Deadline extraction engine ---
+# Assignment/quiz pages are parsed only inside #region-main (SoupStrainer), so
+# the tree holds the activity body instead of the whole Moodle chrome, with
+# lxml when it is installed. Selectors and patterns are compiled once, and the
+# selector that last matched for a page template (theme + page type) is tried
+# first on later pages of that template.
+# No config import on purpose: bench_deadline_extraction.py runs standalone.
+
+def _pick_parser() -> str:
+    try:
+        BeautifulSoup("<p></p>", "lxml")
+        return "lxml"
+    except FeatureNotFound:
+        return "html.parser"
+
+HTML_PARSER = _pick_parser()
+MAIN_REGION = SoupStrainer(id="region-main")
+
+# Submission-status cells, most reliable first
+DEADLINE_SELECTORS = (
+    "td.submissionstatustable_duedate", # Specific class for due date cell?
+    "td.submissionstatustable_timeremaining", # Specific class for time remaining?
+    ".submissionstatustable td.c2", # Value cell in submission status table
+    "td.timeremaining", # General time remaining cells
+    "td.overdue",       # General overdue cells
+    ".timeremaining",   # Div/Span with class timeremaining
+    ".overdue"          # Div/Span with class overdue
+)
+# Activity introduction/description areas (might need adjustment per Moodle theme)
+INTRO_SELECTORS = ("#intro.box.generalbox", ".activity-description", ".no-overflow")
+_COMPILED = {sel: soupsieve.compile(sel) for sel in DEADLINE_SELECTORS + INTRO_SELECTORS}
+
+ABSOLUTE_DATE_RE = re.compile(r'\d{1,2}\s+\w+\s+\d{4},\s+\d{1,2}:\d{2}\s+(?:AM|PM)')
+# Keyword ("Deadline:", "Hạn nộp:"...) followed by a date/time, matched only in a
+# short window after each keyword so long intros can't make the regex backtrack
+INTRO_KEYWORD_RE = re.compile(r'\b(?:Deadline|Hạn nộp|Due date|Hết hạn)\b', re.IGNORECASE)
+INTRO_DEADLINE_RE = re.compile(
+    r'((?:Deadline|Hạn nộp|Due date|Hết hạn)\b[:\s]*)'
+    r'(.*?((?:Mon|Tue|Wed|Thu|Fri|Sat|Sun|Thứ)\s*\d+.*?\d{4}.*?\d{1,2}:\d{2}\s*(?:AM|PM)?'
+    r'|\d{1,2}[/-]\d{1,2}[/-]\d{2,4}.*?\d{1,2}:\d{2}\s*(?:AM|PM)?'
+    r'|\d+\s+(?:days|ngày|hours|giờ|minutes|phút)\b))',
+    re.IGNORECASE)
+INTRO_WINDOW_CHARS = 300
+
+_THEME_RE = re.compile(r'/theme/styles(?:_debug)?\.php/(\w+)/')
+_BODY_ID_RE = re.compile(r'<body[^>]*?\bid="([\w-]+)"')
+
+_memo = {} # template key -> selector that matched last time
+_lock = threading.Lock()
+_stats = {"pages": 0, "found": 0, "memo_hits": 0, "parse_seconds": 0.0, "match_seconds": 0.0}
+
+def template_key(html_content: str) -> str:
+    """'<theme>:<page type>' (e.g. 'boost:page-mod-assign-view'), read from the raw HTML."""
+    theme = _THEME_RE.search(html_content)
+    body_id = _BODY_ID_RE.search(html_content)
+    return f"{theme.group(1) if theme else '?'}:{body_id.group(1) if body_id else '?'}"
+
+def main_region(html_content: str, soup: BeautifulSoup | None = None):
+    """
+    The #region-main subtree. Reuses an already parsed page if given, otherwise
+    parses only that element; pages without it are parsed in full.
+    """
+    if soup is not None:
+        return soup.select_one("#region-main") or soup
+    region = BeautifulSoup(html_content, HTML_PARSER, parse_only=MAIN_REGION)
+    if region.find(id="region-main") is None:
+        return BeautifulSoup(html_content, HTML_PARSER)
+    return region
+
+def _ordered(selectors, learned):
+    if learned in selectors:
+        return (learned,) + tuple(s for s in selectors if s != learned)
+    return selectors
+
+def _cell_status(sel, element, text) -> str:
+    label = element.find_previous_sibling(class_="c1")
+    lowered = text.lower()
+    if "duedate" in sel or (label is not None and "Due date" in label.get_text()):
+        return "Due"
+    if "overdue" in sel or "overdue" in lowered or "quá hạn" in lowered:
+        return "Overdue"
+    if "timeremaining" in sel or "remaining" in lowered or "còn lại" in lowered:
+        return "Time Remaining"
+    if ABSOLUTE_DATE_RE.search(text):
+        return "Due" # Assume absolute dates mean 'Due'
+    return "Unknown"
+
+def _search_intro(intro_text: str):
+    for keyword in INTRO_KEYWORD_RE.finditer(intro_text):
+        window = intro_text[keyword.start():keyword.start() + INTRO_WINDOW_CHARS]
+        match = INTRO_DEADLINE_RE.match(window)
+        if match: return match
+    return None
+
+def extract_deadline_with_selectors(soup, template: str | None = None) -> dict | None:
+    """
+    Tries to get deadline data using specific selectors and basic text pattern
+    matching. 'template' (see template_key) enables the learned-selector memo.
+    """
+    learned = _memo.get(template) if template else None
+    try:
+        # 1. Try Specific Table Cells (Most Reliable if Present)
+        for sel in _ordered(DEADLINE_SELECTORS, learned):
+            element = _COMPILED[sel].select_one(soup)
+            if element is None: continue
+            text = element.get_text(strip=True)
+            if not text: continue # Skip empty elements
+            status = _cell_status(sel, element, text)
+            if status != "Unknown":
+                _remember(template, sel, learned)
+                print(f"         [Selector] Found deadline via selector '{sel}': {status} - {text}")
+                return {"status": status, "time": text}
+
+        # 2. Look in Activity Introduction/Description Areas
+        for sel in _ordered(INTRO_SELECTORS, learned):
+            intro_box = _COMPILED[sel].select_one(soup)
+            if intro_box is None: continue
+            match = _search_intro(intro_box.get_text(" ", strip=True))
+            if match:
+                _remember(template, sel, learned)
+                time_str = match.group(2).strip()
+                print(f"         [Selector/Regex] Found deadline via intro text pattern: Due - {time_str}")
+                return {"status": "Due", "time": time_str} # Found date patterns mean 'Due'
+
+        # 3. If nothing found by selectors or regex
+        return None
+    except Exception as e:
+        print(f"         [Selector WARN] Error during advanced selector search: {e}")
+        return None
+
+def _remember(template, sel, learned):
+    if not template: return
+    with _lock:
+        if sel == learned: _stats["memo_hits"] += 1
+        else: _memo[template] = sel
+
+def extract_deadline(html_content: str, soup: BeautifulSoup | None = None) -> dict | None:
+    """
+    Selector-based deadline extraction for one assignment/quiz page.
+    Pass the page's existing soup to avoid parsing it again.
+    """
+    started = time.perf_counter()
+    try:
+        region = main_region(html_content, soup)
+    except Exception as e:
+        print(f"         [Selector WARN] Could not parse page: {e}")
+        return None
+    parsed = time.perf_counter()
+    data = extract_deadline_with_selectors(region, template_key(html_content))
+    with _lock:
+        _stats["pages"] += 1
+        _stats["found"] += 1 if data else 0
+        _stats["parse_seconds"] += parsed - started
+        _stats["match_seconds"] += time.perf_counter() - parsed
+    return data
+
+def main_region_html(html_content: str, max_chars: int | None = None) -> str:
+    """#region-main as HTML text (e.g. for the AI fallback prompt), optionally truncated."""
+    try: html = str(main_region(html_content))
+    except Exception: html = html_content
+    if max_chars and len(html) > max_chars: html = html[:max_chars] + "...(truncated)"
+    return html
+
+def main_region_text(html_content: str, soup: BeautifulSoup | None = None, max_chars: int | None = None) -> str:
+    """Whitespace-collapsed #region-main text, the compact form queued for the AI fallback."""
+    try: text = " ".join(main_region(html_content, soup).get_text(" ", strip=True).split())
+    except Exception: return ""
+    return text[:max_chars] if max_chars else text
+
+def extractor_stats() -> dict:
+    with _lock:
+        stats = dict(_stats); templates = dict(_memo)
+    pages = stats["pages"] or 1
+    return {"pages": stats["pages"], "found": stats["found"], "memo_hits": stats["memo_hits"],
+            "avg_parse_ms": round(stats["parse_seconds"] * 1000 / pages, 2),
+            "avg_match_ms": round(stats["match_seconds"] * 1000 / pages, 2),
+            "parser": HTML_PARSER, "learned_templates": templates}
@@ -0,0 +1,201 @@
+# download_service.py
+import os
+import re
+import time
+import random
+import hashlib
+import tempfile
+import threading
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    REQUESTS_TIMEOUT, HTTP_POOL_SIZE, DOWNLOAD_MAX_RETRIES, DOWNLOAD_BACKOFF_SECONDS
+)
+
+# Responses worth retrying: throttling and transient server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+GENERIC_FILENAMES = ["pluginfile.php", "download", "content", "index.php", ""]
+KNOWN_EXTENSIONS = (".pdf", ".docx", ".pptx", ".zip", ".rar", ".xls", ".xlsx", ".txt", ".csv")
+
+# --- Session ---
+
+def create_session(cookies: dict, user_agent: str, pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Creates the single pooled, keep-alive session used for one scrape.
+    Every page fetch and download reuses its connections, so a file costs
+    one request instead of a fresh TLS handshake per HEAD/GET.
+    """
+    session = requests.Session()
+    session.headers.update({"user-agent": user_agent})
+    session.cookies.update(cookies)
+    # Retries are done by download_file (with backoff), not by urllib3
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# --- Metrics ---
+
+class DownloadStats:
+    """Thread-safe per-download bytes/latency log for one scrape."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = [] # (url, status, bytes, seconds)
+
+    def record(self, url, status, num_bytes, seconds):
+        with self._lock:
+            self.records.append((url, status, num_bytes, seconds))
+
+    def summary(self) -> dict:
+        with self._lock:
+            records = list(self.records)
+        downloaded = [r for r in records if r[1] == "downloaded"]
+        latencies = sorted(r[3] for r in records if r[1] != "failed")
+        total_bytes = sum(r[2] for r in downloaded)
+        download_seconds = sum(r[3] for r in downloaded)
+
+        def percentile(p):
+            if not latencies: return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return {
+            "requests": len(records),
+            "downloaded": len(downloaded),
+            "not_modified": sum(1 for r in records if r[1] == "not_modified"),
+            "failed": sum(1 for r in records if r[1] == "failed"),
+            "bytes": total_bytes,
+            "seconds": round(download_seconds, 2),
+            "mb_per_second": round(total_bytes / download_seconds / 1_000_000, 2) if download_seconds else None,
+            "latency_p50": percentile(0.50),
+            "latency_p95": percentile(0.95),
+            "slowest": [{"url": r[0], "bytes": r[2], "seconds": round(r[3], 2)}
+                        for r in sorted(downloaded, key=lambda r: r[3], reverse=True)[:5]],
+        }
+
+# --- Filename helpers ---
+
+def _filename_from_disposition(content_disposition: str | None) -> str | None:
+    """Reads filename*=UTF-8''... (preferred) or filename="..." from a Content-Disposition header."""
+    if not content_disposition: return None
+    match = re.search(r"filename\*\s*=\s*(?:[\w-]+)?'[^']*'([^;\n]+)", content_disposition, re.IGNORECASE)
+    if not match:
+        match = re.search(r'filename\s*=\s*"?([^";\n]+)"?', content_disposition, re.IGNORECASE)
+    return urllib.parse.unquote(match.group(1)).strip().strip('"') if match else None
+
+def _choose_filename(response, link_text: str) -> str:
+    """Picks a local filename from the GET response (header, final URL) or the link text."""
+    filename = _filename_from_disposition(response.headers.get("content-disposition"))
+    if filename:
+        print(f"         [Download] Filename from header: {filename}")
+    else:
+        # response.url is the post-redirect URL, so no separate HEAD is needed
+        filename = urllib.parse.unquote(os.path.basename(urllib.parse.urlparse(response.url).path))
+
+    if not filename or filename in GENERIC_FILENAMES:
+        if link_text and link_text.lower().endswith(KNOWN_EXTENSIONS):
+            filename = re.sub(r'[\\/*?:"<>|]', "_", link_text).strip()
+        else:
+            # Last resort, generate a generic name
+            generic_name = "downloaded_file"
+            query = urllib.parse.urlparse(response.url).query.replace('&','_').replace('=','-')
+            generic_name += ("_" + re.sub(r'[\\/*?:"<>|]', "_", query)[:50]) if query else f"_{int(time.time())}"
+            ext_match = re.search(r'\.(pdf|docx|pptx|zip|rar|xls|xlsx|txt|csv)$', link_text or response.url, re.IGNORECASE)
+            if ext_match: generic_name += ext_match.group(0)
+            filename = generic_name
+
+    # Final sanitization (shorten long names too)
+    return re.sub(r'[\\/*?:"<>|\n\r\t]', "_", filename).strip()[:200]
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with jitter: ~1s, 2s, 4s ... scaled by DOWNLOAD_BACKOFF_SECONDS."""
+    return DOWNLOAD_BACKOFF_SECONDS * (2 ** attempt) * (0.5 + random.random())
+
+# --- Download ---
+
+def download_file(session, url, folder, link_text="", file_info=None, stats=None) -> str | None:
+    """
+    Downloads one LMS file into 'folder' with a single streamed GET and
+    returns its local path (None on failure).
+
+    The body is streamed to a temp file in the same folder and renamed into
+    place, so readers never see a half-written file. Transient failures
+    (timeouts, connection resets, 429/5xx) are retried with backoff.
+
+    'file_info' is an optional manifest entry (etag, last_modified, sha256,
+    local_path from the previous scrape). When given, the GET is conditional
+    and the dict is updated in place with the new validators, size and
+    sha256; file_info["not_modified"] is set when the server answered 304 or
+    the bytes hash to the same sha256 as before.
+    """
+    request_headers = {"accept": "*/*"}
+    if file_info is not None:
+        file_info["not_modified"] = False
+        previous_path = file_info.get("local_path")
+        if previous_path and os.path.exists(previous_path):
+            if file_info.get("etag"): request_headers["If-None-Match"] = file_info["etag"]
+            if file_info.get("last_modified"): request_headers["If-Modified-Since"] = file_info["last_modified"]
+
+    started = time.perf_counter()
+    for attempt in range(DOWNLOAD_MAX_RETRIES + 1):
+        temp_path = None
+        try:
+            with session.get(url, headers=request_headers, timeout=(REQUESTS_TIMEOUT, REQUESTS_TIMEOUT * 2), stream=True) as r_get:
+                if r_get.status_code == 304:
+                    print(f"         [Download] Not modified, keeping {file_info['local_path']}")
+                    file_info["not_modified"] = True
+                    if stats: stats.record(url, "not_modified", 0, time.perf_counter() - started)
+                    return file_info["local_path"]
+                if r_get.status_code in RETRYABLE_STATUS and attempt < DOWNLOAD_MAX_RETRIES:
+                    wait_time = _backoff(attempt)
+                    print(f"         [Download] HTTP {r_get.status_code} for {url}, retrying in {wait_time:.1f}s...")
+                    time.sleep(wait_time); continue
+                r_get.raise_for_status() # Check for HTTP errors (4xx, 5xx)
+
+                local_path = os.path.join(folder, _choose_filename(r_get, link_text))
+                bytes_written = 0
+                sha256 = hashlib.sha256()
+                with tempfile.NamedTemporaryFile(dir=folder, prefix=".dl_", suffix=".part", delete=False) as f:
+                    temp_path = f.name
+                    for chunk in r_get.iter_content(chunk_size=8192*8):
+                        if chunk: # filter out keep-alive new chunks
+                            f.write(chunk)
+                            sha256.update(chunk)
+                            bytes_written += len(chunk)
+                os.replace(temp_path, local_path) # Atomic on the same filesystem
+                temp_path = None
+
+            if bytes_written == 0:
+                print(f"          WARNING: Downloaded file is empty: {local_path}")
+
+            elapsed = time.perf_counter() - started
+            if file_info is not None:
+                digest = sha256.hexdigest()
+                # Some servers ignore conditional headers; an identical hash is still "unchanged"
+                file_info["not_modified"] = (digest == file_info.get("sha256") and local_path == file_info.get("local_path"))
+                file_info.update({"etag": r_get.headers.get("ETag"), "last_modified": r_get.headers.get("Last-Modified"),
+                                  "size": bytes_written, "sha256": digest, "local_path": local_path})
+            if stats: stats.record(url, "downloaded", bytes_written, elapsed)
+            print(f"         📥 Download complete -> {local_path} ({bytes_written} bytes in {elapsed:.2f}s)")
+            return local_path
+
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as net_e:
+            if attempt < DOWNLOAD_MAX_RETRIES:
+                wait_time = _backoff(attempt)
+                print(f"         [Download] {type(net_e).__name__} for {url}, retrying in {wait_time:.1f}s...")
+                time.sleep(wait_time); continue
+            print(f"          Failed download {url} after {attempt + 1} attempt(s): {net_e}")
+        except requests.exceptions.HTTPError as http_e:
+            print(f"          Failed download {url} (HTTP Error): {http_e.response.status_code} {http_e.response.reason}")
+        except Exception as e:
+            print(f"          Failed download {url} (Other Error): {e}")
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                try: os.remove(temp_path)
+                except OSError: pass
+        break
+
+    if stats: stats.record(url, "failed", 0, time.perf_counter() - started)
+    return None
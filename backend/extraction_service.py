@@ -0,0 +1,296 @@
+# extraction_service.py
+import os
+import re
+import time
+import atexit
+import threading
+import multiprocessing
+import docx
+import pptx
+import pdfplumber
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from config import (
+    EXTRACT_WORKERS, EXTRACT_TIMEOUT_SECONDS, EXTRACT_MAX_PAGES, EXTRACT_RECYCLE_AFTER
+)
+from text_cache_service import file_sha256, get_cached_text, put_cached_text
+
+# Bump whenever a reader's output changes, so cached text is re-extracted
+EXTRACTOR_VERSION = "2" # 2: PPTX text carries '--- Slide N ---' markers
+FILE_TYPES = {".pdf": "PDF", ".docx": "Word", ".pptx": "PowerPoint", ".txt": "Text"}
+# '--- Page N ---' (PDF) / '--- Slide N ---' (PPTX) markers written by the readers
+PAGE_MARKER_RE = re.compile(r'-{3} (Page|Slide) (\d+) -{3}')
+
+# --- File Readers ---
+# These run inside the worker processes. Each _read_* returns (text, pages) so
+# throughput can be reported in pages/sec (PDF pages, PPTX slides, DOCX/TXT = 1).
+
+def _read_docx(file_path: str, max_pages: int | None = None) -> tuple[str, int]:
+    try: doc = docx.Document(file_path); return "\n".join(p.text for p in doc.paragraphs if p.text), 1
+    except Exception as e: print(f" [DOCX Error] {os.path.basename(file_path)}: {e}"); return "", 0
+
+def _read_txt(file_path: str, max_pages: int | None = None) -> tuple[str, int]:
+    """Extracts text from a plain .txt file, trying common encodings."""
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return f.read(), 1
+    except UnicodeDecodeError:
+        try: # Fallback for other common encodings
+            with open(file_path, "r", encoding="latin-1") as f:
+                return f.read(), 1
+        except Exception as e:
+            print(f"         [TXT Error] Failed to read {os.path.basename(file_path)}: {e}")
+            return "", 0
+    except Exception as e:
+        print(f"         [TXT Error] Failed to read {os.path.basename(file_path)}: {e}")
+        return "", 0
+
+def _read_pptx(file_path: str, max_pages: int | None = None) -> tuple[str, int]:
+    try:
+        prs = pptx.Presentation(file_path); full_text = []; slides = 0
+        for slide in prs.slides:
+            if max_pages and slides >= max_pages:
+                print(f"         [PPTX] {os.path.basename(file_path)}: stopped at slide limit ({max_pages}).")
+                break
+            slides += 1; slide_text = []
+            for shape in slide.shapes:
+                if not shape.has_text_frame: continue
+                para_text = "\n".join(p.text for p in shape.text_frame.paragraphs if p.text)
+                if para_text: slide_text.append(para_text)
+            if slide_text: full_text.append(f"--- Slide {slides} ---\n" + "\n\n".join(slide_text))
+        return "\n\n".join(full_text), slides
+    except Exception as e: print(f" [PPTX Error] {os.path.basename(file_path)}: {e}"); return "", 0
+
+def _read_pdf(file_path: str, max_pages: int | None = None) -> tuple[str, int]:
+    """Extracts text from a .pdf file using pdfplumber, up to 'max_pages' pages."""
+    full_text = []; pages = 0
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            # Password errors are caught below (pdfplumber has no 'is_encrypted')
+            for i, page in enumerate(pdf.pages):
+                if max_pages and i >= max_pages:
+                    print(f"         [PDF] {os.path.basename(file_path)}: stopped at page limit ({max_pages}).")
+                    break
+                # extract_text can return None if page has no text
+                text = page.extract_text(x_tolerance=1, y_tolerance=1)
+                pages += 1
+                if text:
+                    full_text.append(f"--- Page {i+1} ---\n{text}")
+                if hasattr(page, "close"): page.close() # Drop the parsed layout objects as we go
+        return "\n\n".join(full_text), pages
+
+    except pdfplumber.exceptions.PasswordRequired:
+         print(f"         [PDF Error] Failed to read {os.path.basename(file_path)}: File is password-protected.")
+         return "", 0
+    except Exception as e:
+        # Catch other errors (e.g., corrupted file)
+        print(f"         [PDF Error] Failed to read {os.path.basename(file_path)}: {e}")
+        return "", 0
+
+READERS = {".pdf": _read_pdf, ".docx": _read_docx, ".pptx": _read_pptx, ".txt": _read_txt}
+
+# Plain-text readers kept for existing callers (in-process, no page limit)
+def read_docx(file_path: str) -> str: return _read_docx(file_path)[0]
+def read_txt(file_path: str) -> str: return _read_txt(file_path)[0]
+def read_pptx(file_path: str) -> str: return _read_pptx(file_path)[0]
+def read_pdf(file_path: str) -> str: return _read_pdf(file_path)[0]
+
+def split_pages(text: str) -> list[tuple[str | None, int | None, str]]:
+    """
+    Splits reader output (or a cleaned .txt sidecar) at its page/slide markers.
+    Returns [(kind, number, text)] with kind 'page'/'slide'; text before the
+    first marker, or a file without markers (DOCX/TXT), has kind/number None.
+    """
+    pieces = PAGE_MARKER_RE.split(text or "")
+    pages = [(None, None, pieces[0])] if pieces[0].strip() else []
+    for i in range(1, len(pieces), 3):
+        pages.append((pieces[i].lower(), int(pieces[i + 1]), pieces[i + 2]))
+    return pages
+
+def _extract_worker(file_path: str, max_pages: int | None) -> tuple[str, int]:
+    """Process-pool entry point (must stay module-level so it can be pickled)."""
+    reader = READERS[os.path.splitext(file_path)[1].lower()]
+    return reader(file_path, max_pages)
+
+# --- Metrics ---
+
+class ExtractionStats:
+    """Thread-safe per-file pages/latency log for one scrape (or the process lifetime)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = [] # (file_name, status, pages, seconds)
+
+    def record(self, file_name, status, pages, seconds):
+        with self._lock:
+            self.records.append((file_name, status, pages, seconds))
+
+    def summary(self) -> dict:
+        with self._lock:
+            records = list(self.records)
+        extracted = [r for r in records if r[1] == "ok"]
+        pages = sum(r[2] for r in extracted)
+        seconds = sum(r[3] for r in extracted)
+        return {
+            "files": len(records),
+            "extracted": len(extracted),
+            "cached": sum(1 for r in records if r[1] == "cached"),
+            "timed_out": sum(1 for r in records if r[1] == "timeout"),
+            "failed": sum(1 for r in records if r[1] == "failed"),
+            "pages": pages,
+            "seconds": round(seconds, 2),
+            "pages_per_second": round(pages / seconds, 1) if seconds else None,
+        }
+
+lifetime_stats = ExtractionStats() # Every extraction since start-up (/api/extraction/stats)
+
+# --- Process Pool ---
+# Workers are started with forkserver (spawn where it isn't available), not
+# fork: forking this multithreaded server could copy locks held by other
+# threads into a worker. The readers are preloaded into the fork server once.
+# Workers are recycled by retiring the whole pool every EXTRACT_RECYCLE_AFTER
+# tasks; the old pool finishes its in-flight work and exits. A task that
+# times out only retires its pool: new tasks go to a fresh one, and the stuck
+# worker is killed once the other tasks already on that pool have finished.
+
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _mp_context = multiprocessing.get_context("forkserver")
+    _mp_context.set_forkserver_preload(["extraction_service"])
+else:
+    _mp_context = multiprocessing.get_context("spawn")
+
+_pool = None
+_pool_tasks = 0
+_pool_lock = threading.Lock()
+_in_flight = {} # pool -> futures submitted to it that haven't finished
+_stuck = {} # retired pool -> its timed-out futures
+
+def _submit(file_path: str, max_pages: int | None):
+    """Submits one extraction to the current pool (replacing it when due). Returns (pool, future)."""
+    global _pool, _pool_tasks
+    with _pool_lock:
+        if _pool is not None and _pool_tasks >= EXTRACT_RECYCLE_AFTER:
+            print(f"[Extract] Recycling worker pool after {_pool_tasks} task(s).")
+            _pool.shutdown(wait=False)
+            _pool = None
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=_mp_context)
+            _pool_tasks = 0
+        _pool_tasks += 1
+        pool = _pool
+        try: future = pool.submit(_extract_worker, file_path, max_pages)
+        except BrokenProcessPool:
+            _pool = None; pool.shutdown(wait=False); raise
+        _in_flight.setdefault(pool, set()).add(future)
+    future.add_done_callback(lambda f: _task_done(pool, f))
+    return pool, future
+
+def _only_stuck_left(pool) -> bool:
+    """Called with _pool_lock held."""
+    return pool in _stuck and not (_in_flight.get(pool, set()) - _stuck[pool])
+
+def _task_done(pool, future):
+    with _pool_lock:
+        running = _in_flight.get(pool)
+        if running is not None:
+            running.discard(future)
+            if not running and pool not in _stuck: del _in_flight[pool]
+        kill = _only_stuck_left(pool)
+    if kill: _kill_pool(pool)
+
+def _retire_pool(pool, future):
+    """'future' timed out on 'pool': stop using the pool, and kill it once its other tasks are done."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool: _pool = None
+        _stuck.setdefault(pool, set()).add(future)
+        kill = _only_stuck_left(pool)
+    if kill: _kill_pool(pool)
+
+def _kill_pool(pool: ProcessPoolExecutor):
+    """Terminates a pool whose worker is stuck (timeout) or dead, so the next call gets a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool: _pool = None
+        _in_flight.pop(pool, None); _stuck.pop(pool, None)
+    for proc in list((getattr(pool, "_processes", None) or {}).values()):
+        try: proc.terminate()
+        except Exception: pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+atexit.register(shutdown_pool)
+
+# --- Public API ---
+
+def extract_text(file_path: str, timeout: int = EXTRACT_TIMEOUT_SECONDS,
+                 max_pages: int = EXTRACT_MAX_PAGES, stats: ExtractionStats | None = None,
+                 sha256: str | None = None) -> tuple[str, str]:
+    """
+    Extracts text from a PDF/DOCX/PPTX/TXT file in the extraction process pool.
+    Returns (file_type, text); text is "" for unsupported files, failures and
+    timeouts. Blocks the caller (scrape thread or Flask request thread) only
+    on the future, so CPU-heavy parsing no longer holds this process's GIL.
+
+    Results are looked up in / saved to the content-addressed text cache by
+    the file's sha256 (pass 'sha256' if already known, e.g. from a download).
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext not in READERS: return "Unknown", ""
+    file_type = FILE_TYPES[ext]; file_name = os.path.basename(file_path)
+
+    started = time.perf_counter(); status = "ok"; text = ""; pages = 0
+    cache_version = f"{EXTRACTOR_VERSION}:{max_pages}"
+    if ext != ".txt":
+        try:
+            sha256 = sha256 or file_sha256(file_path)
+        except OSError as e:
+            print(f"         [Extract] Cannot read {file_name}: {e}"); sha256 = None
+        cached = get_cached_text(sha256, cache_version) if sha256 else None
+        if cached:
+            for s in (stats, lifetime_stats):
+                if s is not None: s.record(file_name, "cached", cached[2], time.perf_counter() - started)
+            print(f"         [Extract] {file_name}: text cache hit ({cached[2]} page(s)).")
+            return cached[0], cached[1]
+
+    if ext == ".txt" or EXTRACT_WORKERS <= 0:
+        text, pages = _extract_worker(file_path, max_pages)
+    else:
+        for attempt in range(2):
+            pool = None
+            try:
+                pool, future = _submit(file_path, max_pages)
+                text, pages = future.result(timeout=timeout)
+                break
+            except FutureTimeoutError:
+                status = "timeout"
+                if future.cancel(): # Still queued behind other files: no worker to stop
+                    print(f"         [Extract] ⏱️ Timed out after {timeout}s waiting for a worker: {file_name}.")
+                else:
+                    print(f"         [Extract] ⏱️ Timed out after {timeout}s: {file_name}. Replacing its worker.")
+                    _retire_pool(pool, future)
+                break
+            except BrokenProcessPool:
+                # A worker died (or the pool was killed by another timeout); retry once on a fresh pool
+                if pool is not None: _kill_pool(pool)
+                if attempt == 0: continue
+                print(f"         [Extract] Worker crashed on {file_name}."); status = "failed"
+            except Exception as e:
+                print(f"         [Extract] Failed on {file_name}: {e}"); status = "failed"; break
+
+    elapsed = time.perf_counter() - started
+    if status == "ok" and not text and ext != ".txt": status = "failed"
+    for s in (stats, lifetime_stats):
+        if s is not None: s.record(file_name, status, pages, elapsed)
+    if status == "ok" and ext != ".txt":
+        rate = pages / elapsed if elapsed else 0
+        print(f"         [Extract] {file_name}: {pages} page(s) in {elapsed:.2f}s ({rate:.1f} pages/s)")
+        if sha256: put_cached_text(sha256, cache_version, file_type, text, pages)
+    return file_type, text
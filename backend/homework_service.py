@@ -7,7 +7,8 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
-import undetected_chromedriver as uc
+
+from browser_pool import acquire_driver
 
 def submit_homework_to_lms(
     assignment_url: str,
@@ -23,153 +24,140 @@ def submit_homework_to_lms(
     print(f"   Assignment URL: {assignment_url}")
     print(f"   File: {file_path}")
 
-    driver = None
-
     try:
         if not os.path.exists(file_path):
             print(f"   ❌ ERROR: File not found: {file_path}")
             return # Just log the error and end the thread
 
-        options = uc.ChromeOptions()
-        options.add_argument("--start-maximized")
-        # options.add_argument("--headless") # Headless can be detected
-        options.add_argument("--disable-blink-features=AutomationControlled")
-        
-        prefs = {
-            "profile.default_content_setting_values.notifications": 2,
-            "download.prompt_for_download": False
-        }
-        options.add_experimental_option("prefs", prefs)
-
-        print("   Launching browser...")
-        driver = uc.Chrome(options=options, use_subprocess=True)
+        # Warm, already logged-in browser for this account when one is pooled
+        with acquire_driver(username, password, kind="uc") as driver:
+            if not _submit_with_driver(driver, assignment_url, file_path, username, password):
+                # Leave no half-filled form behind in a pooled browser
+                raise RuntimeError("Submission did not complete; discarding browser.")
 
-        print("   Navigating to assignment page...")
-        driver.get(assignment_url)
-        time.sleep(3)
-
-        page_source = driver.page_source.lower()
-        needs_login = (
-            "login" in driver.current_url.lower() or
-            "guests cannot access" in page_source or
-            "please log in" in page_source or
-            "you are currently using guest access" in page_source
-        )
-
-        if needs_login:
-            print("   Login required, attempting to log in...")
+    except Exception as e:
+        print(f"   ❌ Error during homework submission: {e}")
+        traceback.print_exc()
+    finally:
+        # Clean up the temporary file
+        if os.path.exists(file_path):
             try:
-                continue_button = driver.find_element(By.XPATH, "//button[contains(text(), 'Continue')]")
-                if continue_button:
-                    print("   Found 'Continue' button, clicking...")
-                    driver.execute_script("arguments[0].click();", continue_button)
-                    time.sleep(2)
-            except:
-                pass # No 'Continue' button, fine
-
-            # --- [CALL HELPER] ---
-            success = _perform_login(driver, username, password)
-            if not success:
-                print("   ❌ ERROR: Failed to log in to LMS")
-                return # End thread
-
-            print("   Navigating back to assignment page after login...")
-            driver.get(assignment_url)
-            time.sleep(3)
+                os.remove(file_path)
+                print(f"   🧹 Cleaned up temp file: {file_path}")
+            except Exception as del_e:
+                print(f"   ⚠️ Failed to delete temp file {file_path}: {del_e}")
+        
+        print("   ✅ Automated homework submission thread finished.")
 
-            page_source_after = driver.page_source.lower()
-            if "guests cannot access" in page_source_after or "please log in" in page_source_after:
-                print("   ❌ ERROR: Still showing guest access after login")
-                return # End thread
 
-        print("   Looking for submission button...")
-        # --- [CALL HELPER] ---
-        submit_button = _find_submission_button(driver)
-        if submit_button:
-            button_text = submit_button.text
-            print(f"   ✅ Found '{button_text}' button, clicking...")
-            driver.execute_script("arguments[0].click();", submit_button)
-            time.sleep(3)
-        else:
-            print("   ⚠️ Submission button not found, checking if already on submission page...")
+def _submit_with_driver(driver, assignment_url: str, file_path: str, username: str, password: str) -> bool:
+    """Runs the submission steps on a logged-in driver. Returns True if the submission was verified."""
+    print("   Navigating to assignment page...")
+    driver.get(assignment_url)
+    time.sleep(3)
+
+    page_source = driver.page_source.lower()
+    needs_login = (
+        "login" in driver.current_url.lower() or
+        "guests cannot access" in page_source or
+        "please log in" in page_source or
+        "you are currently using guest access" in page_source
+    )
+
+    if needs_login:
+        print("   Login required, attempting to log in...")
+        try:
+            continue_button = driver.find_element(By.XPATH, "//button[contains(text(), 'Continue')]")
+            if continue_button:
+                print("   Found 'Continue' button, clicking...")
+                driver.execute_script("arguments[0].click();", continue_button)
+                time.sleep(2)
+        except:
+            pass # No 'Continue' button, fine
 
-        print("   Looking for 'Thêm...' (Add) button...")
         # --- [CALL HELPER] ---
-        add_file_button = _find_add_file_button(driver)
-        if not add_file_button:
-            print("   ⚠️ Could not find 'Thêm...' button. Trying direct upload (fallback)...")
-            # --- [CALL HELPER] ---
-            result = _try_direct_file_upload(driver, file_path, assignment_url)
-            print(f"   Fallback result: {result.get('message') or result.get('error')}")
-            return # End thread
-
-        print("   ✅ Found 'Thêm...' button, clicking...")
-        driver.execute_script("arguments[0].click();", add_file_button)
-        time.sleep(2)
+        success = _perform_login(driver, username, password)
+        if not success:
+            print("   ❌ ERROR: Failed to log in to LMS")
+            return False
 
-        print("   Looking for file input in file picker...")
-        # --- [CALL HELPER] ---
-        file_input = _find_file_picker_input(driver)
-        if not file_input:
-            print("   ❌ ERROR: Could not find file input in file picker dialog")
-            return
+        print("   Navigating back to assignment page after login...")
+        driver.get(assignment_url)
+        time.sleep(3)
 
-        print(f"   ✅ Found file input, uploading file: {file_path}")
-        file_input.send_keys(file_path)
-        time.sleep(2)
+        page_source_after = driver.page_source.lower()
+        if "guests cannot access" in page_source_after or "please log in" in page_source_after:
+            print("   ❌ ERROR: Still showing guest access after login")
+            return False
 
-        print("   Looking for 'Đăng tải tệp này' (Upload this file) button...")
+    print("   Looking for submission button...")
+    # --- [CALL HELPER] ---
+    submit_button = _find_submission_button(driver)
+    if submit_button:
+        button_text = submit_button.text
+        print(f"   ✅ Found '{button_text}' button, clicking...")
+        driver.execute_script("arguments[0].click();", submit_button)
+        time.sleep(3)
+    else:
+        print("   ⚠️ Submission button not found, checking if already on submission page...")
+
+    print("   Looking for 'Thêm...' (Add) button...")
+    # --- [CALL HELPER] ---
+    add_file_button = _find_add_file_button(driver)
+    if not add_file_button:
+        print("   ⚠️ Could not find 'Thêm...' button. Trying direct upload (fallback)...")
         # --- [CALL HELPER] ---
-        upload_button = _find_upload_file_button(driver)
-        if not upload_button:
-            print("   ❌ ERROR: Could not find 'Upload this file' button")
-            return
+        result = _try_direct_file_upload(driver, file_path, assignment_url)
+        print(f"   Fallback result: {result.get('message') or result.get('error')}")
+        return result.get("success", False)
+
+    print("   ✅ Found 'Thêm...' button, clicking...")
+    driver.execute_script("arguments[0].click();", add_file_button)
+    time.sleep(2)
+
+    print("   Looking for file input in file picker...")
+    # --- [CALL HELPER] ---
+    file_input = _find_file_picker_input(driver)
+    if not file_input:
+        print("   ❌ ERROR: Could not find file input in file picker dialog")
+        return False
 
-        print("   ✅ Found upload button, clicking...")
-        driver.execute_script("arguments[0].click();", upload_button)
-        time.sleep(3)
+    print(f"   ✅ Found file input, uploading file: {file_path}")
+    file_input.send_keys(file_path)
+    time.sleep(2)
 
-        print("   Looking for 'Lưu những thay đổi' (Save changes) button...")
-        # --- [CALL HELPER] ---
-        save_button = _find_save_button(driver)
-        if not save_button:
-            print("   ❌ ERROR: Could not find 'Save changes' button")
-            return
+    print("   Looking for 'Đăng tải tệp này' (Upload this file) button...")
+    # --- [CALL HELPER] ---
+    upload_button = _find_upload_file_button(driver)
+    if not upload_button:
+        print("   ❌ ERROR: Could not find 'Upload this file' button")
+        return False
 
-        print("   ✅ Found 'Save changes' button, clicking...")
-        driver.execute_script("arguments[0].click();", save_button)
-        time.sleep(4)
+    print("   ✅ Found upload button, clicking...")
+    driver.execute_script("arguments[0].click();", upload_button)
+    time.sleep(3)
 
-        print("   Verifying submission...")
-        # --- [CALL HELPER] ---
-        if _verify_submission_success(driver):
-            print("   ✅ Homework submitted successfully!")
-            # [TODO] Here you could email the user:
-            # from scraper_service import send_email_notification
-            # send_email_notification(f"Homework Submitted: {os.path.basename(file_path)}", "Your bot successfully submitted your homework.")
-        else:
-            print("   ❌ ERROR: Submission may have failed - please check manually")
+    print("   Looking for 'Lưu những thay đổi' (Save changes) button...")
+    # --- [CALL HELPER] ---
+    save_button = _find_save_button(driver)
+    if not save_button:
+        print("   ❌ ERROR: Could not find 'Save changes' button")
+        return False
 
-    except Exception as e:
-        print(f"   ❌ Error during homework submission: {e}")
-        traceback.print_exc()
-    finally:
-        if driver:
-            print("   Closing browser...")
-            try:
-                driver.quit()
-            except:
-                pass
-        
-        # Clean up the temporary file
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                print(f"   🧹 Cleaned up temp file: {file_path}")
-            except Exception as del_e:
-                print(f"   ⚠️ Failed to delete temp file {file_path}: {del_e}")
-        
-        print("   ✅ Automated homework submission thread finished.")
+    print("   ✅ Found 'Save changes' button, clicking...")
+    driver.execute_script("arguments[0].click();", save_button)
+    time.sleep(4)
+
+    print("   Verifying submission...")
+    # --- [CALL HELPER] ---
+    if _verify_submission_success(driver):
+        print("   ✅ Homework submitted successfully!")
+        # [TODO] Here you could email the user:
+        # from scraper_service import send_email_notification
+        # send_email_notification(f"Homework Submitted: {os.path.basename(file_path)}", "Your bot successfully submitted your homework.")
+        return True
+    print("   ❌ ERROR: Submission may have failed - please check manually")
+    return False
 
 
 def _perform_login(driver, username: str, password: str) -> bool:
@@ -0,0 +1,87 @@
+# index_maintenance_service.py
+import time
+import threading
+from datetime import datetime
+
+from config import (
+    INDEX_MAINTENANCE_WINDOW, INDEX_MAINTENANCE_IDLE_MINUTES, INDEX_VERIFY_REPAIR
+)
+from search_service import (
+    indexed_user_ids, index_stats, optimize_user_index, verify_user_index,
+    seconds_since_last_search, search_latency_stats
+)
+from scrape_scheduler import get_user_job
+
+# --- Search index maintenance ---
+# Scheduled from app.py. Every run logs segment/size stats of each user
+# index. Inside the low-traffic window (INDEX_MAINTENANCE_WINDOW, and no
+# search for INDEX_MAINTENANCE_IDLE_MINUTES) it also optimizes every index
+# with more than one segment or with deleted documents, after checking it
+# against the .txt sidecars. Users with a scrape in progress are left for the next run.
+
+_run_lock = threading.Lock()
+_last_report = {}
+
+def _in_window(now=None) -> bool:
+    if not INDEX_MAINTENANCE_WINDOW.strip(): return True
+    start, _, end = INDEX_MAINTENANCE_WINDOW.partition("-")
+    start, end = int(start), int(end or start)
+    hour = (now or datetime.now()).hour
+    return start <= hour < end if start <= end else (hour >= start or hour < end) # "22-4" wraps midnight
+
+def low_traffic() -> bool:
+    return _in_window() and seconds_since_last_search() >= INDEX_MAINTENANCE_IDLE_MINUTES * 60
+
+def _scrape_active(user_id) -> bool:
+    # Jobs are keyed by the integer users.id (routes.py); index folders give it as a string
+    if not str(user_id).isdigit(): return False
+    job = get_user_job(int(user_id))
+    return bool(job and job.is_active)
+
+def run_index_maintenance(force=False) -> dict:
+    """
+    One maintenance pass over every user index. force=True optimizes and
+    verifies regardless of the traffic window. Returns (and keeps) the report.
+    """
+    if not _run_lock.acquire(blocking=False):
+        print(" ⏭️ [Maintenance] Previous run still in progress, skipping.")
+        return _last_report
+    try:
+        started = time.perf_counter()
+        deep = force or low_traffic()
+        users = {}
+        for user_id in indexed_user_ids():
+            try:
+                entry = {"before": index_stats(user_id)}
+                if deep and not _scrape_active(user_id):
+                    # Verified first, so the documents a repair replaces are purged by the optimize
+                    entry["verify"] = verify_user_index(user_id, repair=INDEX_VERIFY_REPAIR)
+                    stats = index_stats(user_id)
+                    if stats["segments"] > 1 or stats["deleted"]:
+                        entry["optimize"] = optimize_user_index(user_id) # None: busy, retried next run
+                    entry["after"] = index_stats(user_id)
+                users[user_id] = entry
+            except Exception as e:
+                print(f" ⚠️ [Maintenance] User {user_id} index maintenance failed: {e}")
+                users[user_id] = {"error": str(e)}
+
+        current = [entry.get("after") or entry.get("before") for entry in users.values() if "error" not in entry]
+        report = {
+            "finished_at": datetime.now().isoformat(timespec="seconds"), "deep": deep,
+            "seconds": round(time.perf_counter() - started, 2), "indexes": len(users),
+            "segments": sum(stats["segments"] for stats in current),
+            "deleted": sum(stats["deleted"] for stats in current),
+            "size_bytes": sum(stats["size_bytes"] for stats in current),
+            "search_latency": search_latency_stats(), "users": users,
+        }
+        _last_report.clear(); _last_report.update(report)
+        print(f" 🧹 [Maintenance] {report['indexes']} index(es): {report['segments']} segment(s), "
+              f"{report['deleted']} deleted doc(s), {report['size_bytes'] / 1048576:.1f} MB, "
+              f"search p95 {report['search_latency']['p95_ms']} ms"
+              f"{' (optimized + verified)' if deep else ''} in {report['seconds']}s")
+        return report
+    finally:
+        _run_lock.release()
+
+def last_maintenance_report() -> dict:
+    return dict(_last_report)
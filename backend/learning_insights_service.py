@@ -11,6 +11,7 @@ import traceback
 from datetime import datetime, timedelta, date
 from database import get_db
 from ai_service import ai_client  # Import Gemini client
+import ai_gateway
 
 # ===== FEATURE 1: TRACK PROGRESS & ALERT DELAYS =====
 
@@ -604,8 +605,7 @@ Generate recommendations as a JSON array with objects containing 'title', 'descr
 Return ONLY the JSON array, no other text."""
 
             try:
-                response = ai_client.generate_content(prompt)
-                response_text = response.text
+                response_text = ai_gateway.run(lambda: ai_client.generate_content(prompt).text, label="Learning Insights")
                 
                 import json
                 # Try to extract JSON from response
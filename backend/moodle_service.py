@@ -0,0 +1,96 @@
+# moodle_service.py
+import re
+import json
+import urllib.parse
+from datetime import datetime
+
+from config import LMS_BASE_URL, REQUESTS_TIMEOUT
+
+# --- Moodle web services over the session's AJAX endpoint ---
+# lib/ajax/service.php accepts the logged-in browser session (cookies +
+# sesskey), so no WS token is needed. Functions not enabled for AJAX on the
+# site return an error, and callers fall back to crawling HTML.
+
+AJAX_HEADERS = {"accept": "application/json, text/javascript, */*; q=0.01", "content-type": "application/json",
+                "x-requested-with": "XMLHttpRequest"}
+
+def call_ajax(session, sesskey: str, methodname: str, args: dict):
+    """Calls one Moodle WS function through lib/ajax/service.php. Raises ValueError on a WS error."""
+    url = f"{LMS_BASE_URL}/lib/ajax/service.php?sesskey={sesskey}&info={methodname}"
+    payload = [{"index": 0, "methodname": methodname, "args": args}]
+    response = session.post(url, headers=AJAX_HEADERS, json=payload, timeout=REQUESTS_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    if isinstance(data, dict) and data.get("error"): # Whole request rejected (e.g. bad sesskey)
+        raise ValueError(f"{methodname}: {data.get('error')}")
+    if not data or not isinstance(data[0], dict) or data[0].get("error"):
+        exc = (data[0].get("exception") or {}) if data and isinstance(data[0], dict) else {}
+        raise ValueError(f"{methodname}: {exc.get('message') or exc.get('errorcode') or data}")
+    return data[0].get("data")
+
+_CFG_RE = re.compile(r'M\.cfg\s*=\s*(\{.*?\});', re.DOTALL)
+_SESSKEY_RE = re.compile(r'"sesskey"\s*:\s*"([^"]+)"')
+
+def extract_sesskey(page_source: str) -> str | None:
+    """Pulls the sesskey out of a logged-in page's M.cfg block."""
+    m = _CFG_RE.search(page_source)
+    if m:
+        try: return json.loads(m.group(1)).get("sesskey")
+        except json.JSONDecodeError: pass
+    m = _SESSKEY_RE.search(page_source)
+    return m.group(1) if m else None
+
+def session_file_url(fileurl: str) -> str:
+    """WS file URLs point at webservice/pluginfile.php (token auth); the session needs plain pluginfile.php."""
+    return fileurl.replace("/webservice/pluginfile.php", "/pluginfile.php", 1)
+
+def get_course_links(session, sesskey: str, course_id: int) -> list:
+    """
+    core_course_get_contents -> [(href, link_text), ...] in the same shape as
+    the HTML crawler: module files become direct pluginfile links, every other
+    module with a page becomes a subpage link.
+    """
+    sections = call_ajax(session, sesskey, "core_course_get_contents", {"courseid": course_id}) or []
+    links = []; seen = set()
+    for section in sections:
+        for module in section.get("modules", []):
+            if module.get("uservisible") is False: continue
+            files = [c for c in module.get("contents") or [] if c.get("type") == "file" and c.get("fileurl")]
+            if module.get("modname") in ("resource", "folder") and files:
+                for content in files:
+                    href = session_file_url(content["fileurl"])
+                    if href not in seen:
+                        seen.add(href); links.append((href, content.get("filename") or module.get("name", "")))
+            elif module.get("url") and module["url"] not in seen:
+                seen.add(module["url"]); links.append((module["url"], module.get("name", "")))
+    return links
+
+def get_assignments(session, sesskey: str, course_ids: list) -> dict:
+    """
+    mod_assign_get_assignments for all courses in one call.
+    Returns {assignment view URL: {"title", "duedate", "files"}}.
+    """
+    data = call_ajax(session, sesskey, "mod_assign_get_assignments", {"courseids": list(course_ids)}) or {}
+    assignments = {}
+    for course in data.get("courses", []):
+        for assign in course.get("assignments", []):
+            url = f"{LMS_BASE_URL}/mod/assign/view.php?id={assign.get('cmid')}"
+            files = [(session_file_url(f["fileurl"]), f.get("filename", ""))
+                     for f in assign.get("introattachments") or [] if f.get("fileurl")]
+            assignments[url] = {"title": assign.get("name"), "duedate": assign.get("duedate") or 0, "files": files}
+    return assignments
+
+def assignment_deadline(assignment: dict) -> tuple | None:
+    """(status, original_time_str, iso_timestamp) like the HTML deadline parser, from the WS duedate."""
+    if not assignment.get("duedate"): return None
+    due = datetime.fromtimestamp(assignment["duedate"])
+    status = "Due" if due >= datetime.now() else "Overdue"
+    return status, due.strftime("%A, %d %B %Y, %I:%M %p"), due.isoformat()
+
+def normalize_url(url: str) -> str:
+    """Canonical form used to match crawled links against WS assignment URLs."""
+    parsed = urllib.parse.urlparse(url)
+    query = urllib.parse.parse_qs(parsed.query)
+    if parsed.path.endswith("/mod/assign/view.php") and "id" in query:
+        return f"{LMS_BASE_URL}/mod/assign/view.php?id={query['id'][0]}"
+    return url
@@ -0,0 +1,34 @@
+# rebuild_search_index.py
+# Rebuilds one user's search index (and vectors) from the .txt sidecars in
+# courses_data, outside the server. Courses with INDEX_BULK_MIN_DOCS or more
+# chunks are indexed by INDEX_WRITER_PROCS processes: a fork is safe in this
+# single-threaded script, unlike in the multithreaded Flask process, which
+# always writes with one. Stop the server (or its scrapes) first.
+#
+#   python rebuild_search_index.py USER_ID [--procs N]
+
+import sys
+import time
+import argparse
+
+from config import INDEX_WRITER_PROCS
+from search_service import clear_search_index, sidecar_course_documents, apply_index_ops, index_segment_count
+
+def rebuild(user_id, procs=INDEX_WRITER_PROCS):
+    started = time.perf_counter(); docs = commits = 0
+    clear_search_index(user_id)
+    for course_docs in sidecar_course_documents(user_id):
+        op_stats = apply_index_ops(user_id, [("add", doc) for doc in course_docs], procs=procs)
+        docs += op_stats["docs"]; commits += 1
+        print(f"   Indexed {op_stats['docs']} chunk(s) in {op_stats['seconds']:.2f}s with {op_stats['procs']} process(es).")
+    print(f"✅ User {user_id}: {docs} chunk(s) from {commits} course(s) in {time.perf_counter() - started:.1f}s; "
+          f"index has {index_segment_count(user_id)} segment(s).")
+    return docs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild a user's search index from the saved sidecars.")
+    parser.add_argument("user_id")
+    parser.add_argument("--procs", type=int, default=INDEX_WRITER_PROCS)
+    args = parser.parse_args()
+    rebuild(args.user_id, max(1, args.procs))
+    sys.exit(0)
@@ -27,24 +27,32 @@ from learning_insights_service import (
     generate_personalized_recommendations, get_active_recommendations
 )
 # Import services and helpers
-import state
 import schedule # For the meet scheduler
 from database import get_db
 from config import (
     UPLOAD_FOLDER, MEET_RECORDING_DIR, SAVE_DIR, ALLOWED_EXTENSIONS,
-    MAX_TEXT_LENGTH_FOR_SUMMARY, SECRET_KEY, GOOGLE_CALENDAR_ID, GOOGLE_CALENDAR_TIMEZONE, LMS_USERNAME, LMS_PASSWORD, GOOGLE_SERVICE_ACCOUNT_FILE
-)
-from scraper_service import (
-    perform_full_scrape, read_pdf, read_docx, read_pptx, read_txt
+    MAX_TEXT_LENGTH_FOR_SUMMARY, SECRET_KEY, GOOGLE_CALENDAR_ID, GOOGLE_CALENDAR_TIMEZONE, LMS_USERNAME, LMS_PASSWORD, GOOGLE_SERVICE_ACCOUNT_FILE,
+    SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE, SEMANTIC_SEARCH_ENABLED, SUGGEST_LIMIT
 )
+from scrape_scheduler import submit_scrape, get_user_job, scheduler_status
+from extraction_service import extract_text, lifetime_stats
 from ai_service import (
     ai_client, analyze_document_with_ai, generate_multiple_choice_ai,
     generate_hint_with_ai, generate_flashcards_ai, grade_homework_with_ai
 )
 from meeting_service import join_meet_automated_and_record
+from semantic_service import vector_count
 from search_service import (
-    SimpleFormatter, open_dir, exists_in, INDEX_DIR
+    user_index_exists, user_index_is_current, user_has_sidecars, index_build_status, search_user_index,
+    start_vector_build, vectors_current, suggest_terms, start_index_migration, SEARCH_MODES,
+    index_stats, search_latency_stats
 )
+from search_cache_service import search_cache_stats
+from suggest_service import suggestion_stats
+from ai_gateway import gateway_stats
+from ai_cache_service import ai_cache_stats
+from text_cache_service import cache_stats as text_cache_stats
+from index_maintenance_service import last_maintenance_report
 from calendar_service import (_event_key, _is_done, timedelta, sync_all_deadlines )
 from homework_service import submit_homework_to_lms
 from chat_service import (
@@ -138,11 +146,17 @@ def token_required(f):
         return f(*args, **kwargs)
     return decorated
 
+def _ai_cache_bypass() -> bool:
+    """refresh=1 (query string, form or JSON body) asks for a fresh AI answer instead of the cached one."""
+    value = request.values.get('refresh') or (request.get_json(silent=True) or {}).get('refresh')
+    return str(value).lower() in ('1', 'true', 'yes')
+
 # --- API Endpoints ---
 @bp.route('/')
 def home():
     """Serves the main API endpoint list."""
-    status = "Scraping in progress..." if state.IS_SCRAPING else "Idle"
+    jobs = scheduler_status()
+    status = f"{jobs['running']} scrape(s) running, {jobs['queued']} queued" if jobs['running'] or jobs['queued'] else "Idle"
     return render_template_string("""
     <h1>LMS Scraper Backend</h1>
     <p>Status: <strong>{{ status }}</strong></p>
@@ -156,8 +170,11 @@ def home():
         <li><b>GET /api/course/&lt;course_id&gt;/content</b> - Get all AI content for a course.</li>
         <li><b>GET /api/course/&lt;course_id&gt;/files</b> - Get all scraped files for a course.</li>
         <li><b>GET /api/get_file/&lt;course_id&gt;/&lt;filename&gt;</b> - Download a specific file.</li>
-        <li><b>GET /api/search?q=&lt;query&gt;</b> - Search indexed files.</li>
-        <li><b>POST /api/summarize_upload</b> - Upload file+ID for summary.</li>
+        <li><b>GET /api/search?q=&lt;query&gt;[&amp;page=&amp;page_size=&amp;course_id=&amp;file_type=&amp;mode=keyword|semantic|hybrid]</b> - Search indexed files (paged, with facets).</li>
+        <li><b>GET /api/search/suggest?q=&lt;partial query&gt;</b> - Autocomplete the last word.</li>
+        <li><b>GET /api/search/metrics</b> - Index size/segments, search p95, last maintenance run.</li>
+        <li><b>GET /api/ai/stats</b> - AI gateway and AI response cache counters.</li>
+        <li><b>POST /api/summarize_upload</b> - Upload file+ID for summary (AI endpoints take refresh=1 to skip the AI cache).</li>
         <li><b>POST /api/generate_questions</b> - Upload file+ID for quiz.</li>
         <li><b>POST /api/get_hint</b> - Upload file+ID+question for hint.</li>
         <li><b>POST /api/schedule_meet</b> - Schedule a Meet recording.</li>
@@ -288,9 +305,6 @@ def trigger_scrape():
     - Gets the 'user_id' (who to save to) from the auth token.
     - Gets the 'lms_username' and 'lms_password' (what to scrape) from the JSON body.
     """
-    if state.IS_SCRAPING:
-        return jsonify({"status": "Scrape already in progress."}), 409
-
     # --- [THE FIX] ---
     
     # 2. Get the logged-in user's ID from the token
@@ -311,24 +325,25 @@ def trigger_scrape():
 
     print(f"API: Received scrape request for user_id {user_id} (scraping account: {lms_user})...")
 
-    # 4. Pass all 3 arguments to the scrape thread
-    scraping_thread = threading.Thread(
-        target=perform_full_scrape, 
-        args=(user_id, lms_user, lms_pass), # (who to save for, what to scrape)
-        daemon=True
-    )
-    scraping_thread.start()
+    # 4. Queue a job for this user (who to save for, what to scrape).
+    # Only this user's own active job blocks a new one; other users run in parallel.
+    job, created = submit_scrape(user_id, lms_user, lms_pass)
+    if not created:
+        return jsonify({"status": "Scrape already in progress.", "job": job.to_dict()}), 409
     
-    return jsonify({"status": "Scrape initiated in background."}), 202
+    return jsonify({"status": "Scrape initiated in background.", "job": job.to_dict()}), 202
 
 @bp.route('/api/scrape/status', methods=['GET'])
+@token_required
 def get_scrape_status():
-    """Checks the global 'is_scraping' flag and the last result."""
+    """Reports the caller's own scrape job (progress while active, result once finished)."""
+    job = get_user_job(g.current_user['id'])
+    if job is None:
+        return jsonify({"status": "idle", "result": None, "job": None})
     return jsonify({
-        "status": "scraping" if state.IS_SCRAPING else "idle",
-        # --- [FIX] Send the result to the frontend ---
-        "result": state.LAST_SCRAPE_RESULT 
-        # --- [END FIX] ---
+        "status": {"queued": "queued", "running": "scraping"}.get(job.status, "idle"),
+        "result": None if job.is_active else job.result,
+        "job": job.to_dict()
     })
 
 @bp.route('/api/courses', methods=['GET']) # <-- [FIX] Removed <user_id> from URL
@@ -463,16 +478,9 @@ def generate_flashcards_endpoint(course_db_id, filename):
         file_type = "File"
         extracted_text = ""
         
-        if file_ext.lower() == '.pdf': 
-            file_type="PDF"; extracted_text=read_pdf(file_path)
-        elif file_ext.lower() == '.docx': 
-            file_type="Word"; extracted_text=read_docx(file_path)
-        elif file_ext.lower() == '.pptx': 
-            file_type="PowerPoint"; extracted_text=read_pptx(file_path)
-        elif file_ext.lower() == '.txt': 
-            file_type="Text"; extracted_text=read_txt(file_path)
-        else: 
+        if file_ext.lower() not in ALLOWED_EXTENSIONS:
             return jsonify({"error": f"Unsupported file type: {file_ext}"}), 400
+        file_type, extracted_text = extract_text(file_path)
 
         if not extracted_text: 
             return jsonify({"error": f"Failed to extract text from '{filename}'."}), 500
@@ -481,7 +489,7 @@ def generate_flashcards_endpoint(course_db_id, filename):
             extracted_text = extracted_text[:MAX_TEXT_LENGTH_FOR_SUMMARY]
 
         # 6. Generate flashcards using AI
-        flashcards_data = generate_flashcards_ai(extracted_text, file_type)
+        flashcards_data = generate_flashcards_ai(extracted_text, file_type, use_cache=not _ai_cache_bypass())
 
         if flashcards_data:
             flashcards_data["source_file"] = filename
@@ -608,42 +616,98 @@ def get_scraped_file(course_db_id, filename):
 @bp.route('/api/search', methods=['GET'])
 @token_required
 def search_index():
-    """Searches the Whoosh index for the query parameter 'q'."""
+    """
+    Searches the current user's Whoosh index for the query parameter 'q'.
+    Optional: page, page_size, course_id and file_type filters, and
+    mode=keyword (default) | semantic | hybrid.
+    Returns {query, mode, total, page, page_size, pages, results, facets}.
+    """
     query_str = request.args.get('q')
     if not query_str:
         return jsonify({"error": "Missing query parameter 'q'."}), 400
-    if not exists_in(INDEX_DIR):
-        return jsonify({"error": "Search index not found. Run a scrape first."}), 404
+    page = request.args.get('page', 1, type=int)
+    page_size = request.args.get('page_size', SEARCH_PAGE_SIZE, type=int)
+    if page < 1 or not 1 <= page_size <= SEARCH_MAX_PAGE_SIZE:
+        return jsonify({"error": f"'page' must be >= 1 and 'page_size' between 1 and {SEARCH_MAX_PAGE_SIZE}."}), 400
+    mode = request.args.get('mode', 'keyword')
+    if mode not in SEARCH_MODES or (mode != "keyword" and not SEMANTIC_SEARCH_ENABLED):
+        return jsonify({"error": f"Unsupported search mode '{mode}'."}), 400
+    user_id = g.current_user['id']
+    # First search since the per-user split: the index is built from the scraped .txt files in the background
+    if not user_index_exists(user_id):
+        if not user_has_sidecars(user_id) or index_build_status(user_id) == "failed":
+            return jsonify({"error": "Search index not found. Run a scrape first."}), 404
+        start_index_migration(user_id)
+        return jsonify({"query": query_str, "status": "building",
+                        "message": "Your search index is being built. Try again in a moment."}), 202
+    elif not user_index_is_current(user_id):
+        start_index_migration(user_id) # Older schema: rebuilt in the background, served meanwhile
+    # Embeddings are built in the background on the first semantic/hybrid search
+    # (or after a model change); keyword results are served until they are ready
+    semantic_status = None
+    if mode != "keyword" and not vectors_current(user_id):
+        start_vector_build(user_id)
+        semantic_status, mode = "building", "keyword"
 
     try:
-        ix = open_dir(INDEX_DIR)
-        if ix.doc_count() == 0:
-            return jsonify({"error": "Search index is empty."}), 404
-        
-        results_list = []
-        with ix.searcher() as searcher:
-            parser = QueryParser("content", ix.schema)
-            try: query = parser.parse(query_str)
-            except Exception as qp_e: return jsonify({"error": f"Error parsing query: {qp_e}"}), 400
-
-            results = searcher.search(query, limit=10)
-            results.formatter = SimpleFormatter()
-            results.fragmenter = PinpointFragmenter(surround=50, maxchars=200) # Use Pinpoint
-
-            print(f"API: Search for '{query_str}' found {len(results)} hit(s).")
-            for hit in results:
-                snippet = hit.highlights("content")
-                if not snippet: snippet = (hit.get("content", "")[:200] + "...") if hit.get("content") else ""
-                results_list.append({
-                    "course_id": hit.get("course_id"), "course_name": hit.get("course_name"),
-                    "file_name": hit.get("file_name"), "file_type": hit.get("file_type"),
-                    "score": hit.score, "snippet": snippet
-                })
-        return jsonify(results_list)
+        response = search_user_index(user_id, query_str, page=page, page_size=page_size,
+                                     course_id=request.args.get('course_id'),
+                                     file_type=request.args.get('file_type'), mode=mode)
+        if semantic_status:
+            response = dict(response, requested_mode=request.args.get('mode'), semantic_status=semantic_status)
+        return jsonify(response)
+    except ValueError as qp_e:
+        return jsonify({"error": str(qp_e)}), 400
+    except LookupError as empty_e:
+        return jsonify({"error": str(empty_e)}), 404
     except Exception as e:
         print(f"API: Error during search: {e}"); traceback.print_exc()
         return jsonify({"error": f"An internal server error occurred: {e}"}), 500
 
+@bp.route('/api/search/suggest', methods=['GET'])
+@token_required
+def search_suggest():
+    """Completions for the word being typed in 'q' (accent-insensitive, typo-tolerant)."""
+    query_str = request.args.get('q', '')
+    limit = min(request.args.get('limit', SUGGEST_LIMIT, type=int), 20)
+    user_id = g.current_user['id']
+    if not query_str.strip() or not user_index_exists(user_id):
+        return jsonify({"query": query_str, "suggestions": []})
+    try:
+        return jsonify({"query": query_str, "suggestions": suggest_terms(user_id, query_str, limit)})
+    except Exception as e:
+        print(f"API: Error during search suggest: {e}"); traceback.print_exc()
+        return jsonify({"error": f"An internal server error occurred: {e}"}), 500
+
+@bp.route('/api/search/metrics', methods=['GET'])
+@token_required
+def search_metrics():
+    """Size/segments of the current user's index and vector store, search latency (p95) and the last maintenance run."""
+    user_id = g.current_user['id']
+    report = last_maintenance_report()
+    return jsonify({
+        "index": index_stats(user_id) if user_index_exists(user_id) else None,
+        "vectors": {"count": vector_count(user_id), "current": vectors_current(user_id)} if SEMANTIC_SEARCH_ENABLED else None,
+        "search_latency": search_latency_stats(),
+        "cache": search_cache_stats(),
+        "suggest": suggestion_stats(),
+        "maintenance": {key: report.get(key) for key in ("finished_at", "deep", "seconds", "indexes", "segments", "deleted", "size_bytes")}
+                       if report else None,
+        "maintenance_user": report.get("users", {}).get(str(user_id)) if report else None,
+    })
+
+@bp.route('/api/ai/stats', methods=['GET'])
+@token_required
+def ai_stats():
+    """Counters of the AI gateway (rate limiting/retries) and the AI response cache."""
+    return jsonify({"gateway": gateway_stats(), "cache": ai_cache_stats()})
+
+@bp.route('/api/extraction/stats', methods=['GET'])
+@token_required
+def extraction_stats():
+    """Size of the extracted-text cache (text_cache_service) and pages/sec of every extraction since start-up."""
+    return jsonify({"text_cache": text_cache_stats(), "extraction": lifetime_stats.summary()})
+
 @bp.route('/api/summarize_upload', methods=['POST'])
 @token_required
 def summarize_uploaded_file():
@@ -678,16 +742,13 @@ def summarize_uploaded_file():
         file.save(upload_path); local_path = upload_path
         print(f"API: Temp saved upload to {upload_path} for summary.")
         
-        if file_ext.lower() == '.pdf': file_type="PDF"; extracted_text=read_pdf(upload_path)
-        elif file_ext.lower() == '.docx': file_type="Word"; extracted_text=read_docx(upload_path)
-        elif file_ext.lower() == '.pptx': file_type="PowerPoint"; extracted_text=read_pptx(upload_path)
-        elif file_ext.lower() == '.txt': file_type="Text"; extracted_text=read_txt(upload_path)
+        file_type, extracted_text = extract_text(upload_path)
 
         if not extracted_text: return jsonify({"error": f"Failed to extract text from '{filename}'."}), 500
         if len(extracted_text) > MAX_TEXT_LENGTH_FOR_SUMMARY:
             return jsonify({"error": f"File content too long (>{MAX_TEXT_LENGTH_FOR_SUMMARY} chars)."}), 413
             
-        summary_data = analyze_document_with_ai(extracted_text, file_type)
+        summary_data = analyze_document_with_ai(extracted_text, file_type, use_cache=not _ai_cache_bypass())
         if summary_data:
             summary_data["source_file"] = filename
             try:
@@ -745,16 +806,13 @@ def generate_questions_endpoint():
         file.save(upload_path); local_path = upload_path
         print(f"API: Temp saved upload to {upload_path} for questions.")
         
-        if file_ext.lower() == '.pdf': file_type="PDF"; extracted_text=read_pdf(upload_path)
-        elif file_ext.lower() == '.docx': file_type="Word"; extracted_text=read_docx(upload_path)
-        elif file_ext.lower() == '.pptx': file_type="PowerPoint"; extracted_text=read_pptx(upload_path)
-        elif file_ext.lower() == '.txt': file_type="Text"; extracted_text=read_txt(upload_path)
+        file_type, extracted_text = extract_text(upload_path)
 
         if not extracted_text: return jsonify({"error": f"Failed to extract text from '{filename}'."}), 500
         if len(extracted_text) > MAX_TEXT_LENGTH_FOR_SUMMARY:
             return jsonify({"error": f"File content too long (>{MAX_TEXT_LENGTH_FOR_SUMMARY} chars)."}), 413
             
-        question_data = generate_multiple_choice_ai(extracted_text, file_type)
+        question_data = generate_multiple_choice_ai(extracted_text, file_type, use_cache=not _ai_cache_bypass())
         if question_data:
             question_data["source_file"] = filename
             try:
@@ -814,16 +872,13 @@ def get_hint_endpoint():
         file.save(upload_path); local_path = upload_path
         print(f"API: Temp saved upload to {upload_path} for hint.")
         
-        if file_ext.lower() == '.pdf': file_type="PDF"; extracted_text=read_pdf(upload_path)
-        elif file_ext.lower() == '.docx': file_type="Word"; extracted_text=read_docx(upload_path)
-        elif file_ext.lower() == '.pptx': file_type="PowerPoint"; extracted_text=read_pptx(upload_path)
-        elif file_ext.lower() == '.txt': file_type="Text"; extracted_text=read_txt(upload_path)
+        file_type, extracted_text = extract_text(upload_path)
         
         if not extracted_text: return jsonify({"error": f"Failed to extract text from '{filename}'."}), 500
         if len(extracted_text) > MAX_TEXT_LENGTH_FOR_SUMMARY:
             return jsonify({"error": f"File content too long (>{MAX_TEXT_LENGTH_FOR_SUMMARY} chars)."}), 413
             
-        hint_data = generate_hint_with_ai(extracted_text, file_type, user_question)
+        hint_data = generate_hint_with_ai(extracted_text, file_type, user_question, use_cache=not _ai_cache_bypass())
         if hint_data:
             hint_data["source_file"] = filename; hint_data["user_question"] = user_question
             try:
@@ -1334,12 +1389,9 @@ def grade_homework():
         
         # Read the original homework file
         file_ext = os.path.splitext(homework_filename)[1].lower()
-        if file_ext == '.pdf': question_text = read_pdf(homework_filepath)
-        elif file_ext == '.docx': question_text = read_docx(homework_filepath)
-        elif file_ext == '.pptx': question_text = read_pptx(homework_filepath)
-        elif file_ext == '.txt': question_text = read_txt(homework_filepath)
-        else:
+        if file_ext not in ALLOWED_EXTENSIONS:
             return jsonify({"error": f"Unsupported file type for homework: {file_ext}"}), 400
+        _, question_text = extract_text(homework_filepath)
         
         if not question_text:
             return jsonify({"error": "Could not extract text from the homework file."}), 500
@@ -1366,11 +1418,9 @@ def grade_homework():
             user_answer_file.save(temp_answer_path)
             print(f"API: Saved answer file for grading: {temp_answer_path}")
 
-            if file_ext == '.pdf': answer_content = read_pdf(temp_answer_path)
-            elif file_ext == '.docx': answer_content = read_docx(temp_answer_path)
-            elif file_ext == '.txt': answer_content = read_txt(temp_answer_path)
-            else:
+            if file_ext not in ('.pdf', '.docx', '.txt'):
                 return jsonify({"error": f"Unsupported file type for answer: {file_ext}"}), 400
+            _, answer_content = extract_text(temp_answer_path)
         else:
             answer_content = user_answer_text
     except Exception as e:
@@ -1384,7 +1434,7 @@ def grade_homework():
 
     # --- 6. Call AI Service for Grading ---
     try:
-        grading_result = grade_homework_with_ai(question_text, answer_content, file_type_for_ai)
+        grading_result = grade_homework_with_ai(question_text, answer_content, file_type_for_ai, use_cache=not _ai_cache_bypass())
         if not grading_result:
             return jsonify({"error": "AI service failed to grade the homework."}), 500
 
@@ -1517,16 +1567,13 @@ def generate_flashcards_endpoint_from_upload():
         file.save(upload_path); local_path = upload_path
         print(f"API: Temp saved upload to {upload_path} for flashcards.")
         
-        if file_ext.lower() == '.pdf': file_type="PDF"; extracted_text=read_pdf(upload_path)
-        elif file_ext.lower() == '.docx': file_type="Word"; extracted_text=read_docx(upload_path)
-        elif file_ext.lower() == '.pptx': file_type="PowerPoint"; extracted_text=read_pptx(upload_path)
-        elif file_ext.lower() == '.txt': file_type="Text"; extracted_text=read_txt(upload_path)
+        file_type, extracted_text = extract_text(upload_path)
 
         if not extracted_text: return jsonify({"error": f"Failed to extract text from '{filename}'."}), 500
         if len(extracted_text) > MAX_TEXT_LENGTH_FOR_SUMMARY:
             extracted_text = extracted_text[:MAX_TEXT_LENGTH_FOR_SUMMARY]
 
-        flashcards_data = generate_flashcards_ai(extracted_text, file_type)
+        flashcards_data = generate_flashcards_ai(extracted_text, file_type, use_cache=not _ai_cache_bypass())
         
         if flashcards_data:
             flashcards_data["source_file"] = filename
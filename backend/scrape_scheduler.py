@@ -0,0 +1,137 @@
+# scrape_scheduler.py
+import time
+import uuid
+import threading
+import traceback
+from collections import deque
+
+from config import SCRAPE_MAX_CONCURRENT_JOBS
+
+# --- Multi-tenant scrape scheduler ---
+# Replaces the old process-wide state.IS_SCRAPING flag. Every /api/scrape call
+# becomes a per-user job; a bounded set of worker threads
+# (SCRAPE_MAX_CONCURRENT_JOBS) runs queued jobs in FIFO order. A user has at
+# most one active job, so the FIFO queue is also fair-share across users.
+
+class ScrapeJob:
+    """One scrape run for one user, with live progress counters."""
+
+    def __init__(self, user_id, lms_user, lms_pass, incremental=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.user_id = user_id
+        self.lms_user = lms_user
+        self._lms_pass = lms_pass # Dropped as soon as the job finishes
+        self.incremental = incremental
+        self.status = "queued" # queued -> running -> succeeded | failed
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.progress = {"courses_total": 0, "courses_done": 0, "files_downloaded": 0,
+                         "files_unchanged": 0, "bytes": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def set_progress(self, **values):
+        with self._lock:
+            self.progress.update(values)
+
+    def add_progress(self, **deltas):
+        """Thread-safe counter increments (called from the scrape's worker threads)."""
+        with self._lock:
+            for key, value in deltas.items():
+                self.progress[key] = self.progress.get(key, 0) + value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            progress = dict(self.progress)
+        now = time.time()
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "lms_user": self.lms_user,
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_position": queue_position(self),
+            "elapsed_seconds": round((self.finished_at or now) - self.started_at, 1) if self.started_at else None,
+            "progress": progress,
+        }
+
+_lock = threading.Condition()
+_queue = deque()
+_jobs_by_user = {} # user_id -> latest ScrapeJob (active or last finished)
+_workers = []
+_running = 0
+
+def _run_job(job: ScrapeJob):
+    # Imported here: scraper_service pulls in Selenium and the AI client
+    from scraper_service import perform_full_scrape
+    try:
+        result = perform_full_scrape(job.user_id, job.lms_user, job._lms_pass, job.incremental, job=job)
+    except Exception as e:
+        traceback.print_exc()
+        result = {"success": False, "message": str(e)}
+    job.result = result or {"success": False, "message": "Scrape returned no result."}
+    job.status = "succeeded" if job.result.get("success") else "failed"
+
+def _worker_loop(worker_idx):
+    global _running
+    while True:
+        with _lock:
+            while not _queue:
+                _lock.wait()
+            job = _queue.popleft()
+            _running += 1
+        job.status = "running"; job.started_at = time.time()
+        print(f"[Scheduler] Worker {worker_idx} started job {job.job_id} for user {job.user_id}.")
+        try:
+            _run_job(job)
+        finally:
+            job.finished_at = time.time(); job._lms_pass = None
+            with _lock:
+                _running -= 1
+            print(f"[Scheduler] Job {job.job_id} for user {job.user_id} {job.status} "
+                  f"in {job.finished_at - job.started_at:.1f}s.")
+
+def _ensure_workers():
+    if _workers: return
+    for i in range(max(1, SCRAPE_MAX_CONCURRENT_JOBS)):
+        t = threading.Thread(target=_worker_loop, args=(i,), daemon=True, name=f"scrape-job-{i}")
+        t.start(); _workers.append(t)
+
+def submit_scrape(user_id, lms_user, lms_pass, incremental=None) -> tuple[ScrapeJob, bool]:
+    """
+    Queues a scrape for 'user_id'. Returns (job, created); if the user already
+    has a queued/running job that job is returned with created=False.
+    """
+    with _lock:
+        _ensure_workers()
+        existing = _jobs_by_user.get(user_id)
+        if existing and existing.is_active:
+            return existing, False
+        job = ScrapeJob(user_id, lms_user, lms_pass, incremental)
+        _jobs_by_user[user_id] = job
+        _queue.append(job)
+        _lock.notify()
+    print(f"[Scheduler] Queued job {job.job_id} for user {user_id} (position {queue_position(job)}).")
+    return job, True
+
+def get_user_job(user_id) -> ScrapeJob | None:
+    """The user's active job, or their most recently finished one."""
+    with _lock:
+        return _jobs_by_user.get(user_id)
+
+def queue_position(job: ScrapeJob) -> int | None:
+    """1-based position in the queue, or None if the job is not waiting."""
+    with _lock:
+        for idx, queued in enumerate(_queue, start=1):
+            if queued is job: return idx
+    return None
+
+def scheduler_status() -> dict:
+    with _lock:
+        return {"running": _running, "queued": len(_queue), "max_concurrent": max(1, SCRAPE_MAX_CONCURRENT_JOBS)}
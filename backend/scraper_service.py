@@ -3,90 +3,43 @@ import os
 import time
 import json
 import re
+import html
+import hashlib
+import threading
+import uuid
 import sqlite3
 import requests
 import urllib.parse
-from selenium import webdriver
 from datetime import timedelta
-import docx
-import subprocess
-import pptx
-import shutil
-import pdfplumber
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 # ... (all other imports needed for scraping: requests, bs4, docx, pptx, pdfplumber, etc.)
 from datetime import datetime
 from dateutil import parser as date_parser
 import traceback
 
 # Import from our new modules
-import state
 from config import (
     DATABASE_FILE, SAVE_DIR, LMS_USERNAME, LMS_PASSWORD, STATE_FILE,
-    REQUESTS_TIMEOUT, MAX_SUBPAGES, MAX_TEXT_LENGTH_FOR_SUMMARY
+    REQUESTS_TIMEOUT, MAX_SUBPAGES, MAX_TEXT_LENGTH_FOR_SUMMARY,
+    SCRAPE_PAGE_WORKERS, SCRAPE_DOWNLOAD_WORKERS, SCRAPE_INCREMENTAL, SCRAPE_RESUME_MAX_AGE_HOURS,
+    SCRAPE_CRAWLER_MODE, SCRAPE_SELENIUM_FALLBACK,
+    AI_DEADLINE_BATCH_PAGES, AI_DEADLINE_BATCH_TOKENS, AI_DEADLINE_PAGE_CHARS
 )
-from search_service import clear_search_index, get_index
+from conversion_service import enqueue_conversion, conversion_stats
+from moodle_service import call_ajax, get_course_links, get_assignments, assignment_deadline, normalize_url
+from browser_pool import acquire_driver, get_lms_session, invalidate_lms_session
+from download_service import create_session, download_file, DownloadStats
+from extraction_service import (
+    extract_text, ExtractionStats, split_pages, read_docx, read_txt, read_pptx, read_pdf # noqa: F401 (re-exported)
+)
+from search_service import apply_index_ops, index_segment_count, file_documents
+from database import ensure_scrape_tables
 # Note: AI functions are no longer called from here, so we don't import them.
 # Import the file-reading and deadline-parsing helpers
 # (Paste clean_file_text, parse_time_remaining, read_docx, read_pptx, read_pdf, download_file here)
 #
 # Example (paste your full function):
 
-# --- [MODIFIED] Helper to convert files to PDF ---
-def convert_to_pdf(file_path, output_dir):
-    """
-    Uses LibreOffice (soffice) to convert a document to PDF.
-    Returns the path to the new PDF if successful, else None.
-    """
-    print(f"   [Converter] Attempting to convert {os.path.basename(file_path)} to PDF...")
-    
-    # --- [THE FIX] ---
-    # We will hardcode the full path to soffice.com that we found earlier.
-    # The 'r' before the string handles the backslashes.
-    soffice_path = r'D:\New Folder\program\soffice.com'
-    # -----------------
-
-    try:
-        # 3. Use the full path variable
-        command = [
-            soffice_path,      # <--- Use the full path
-            '--headless',
-            '--convert-to', 'pdf',
-            '--outdir', output_dir, 
-            file_path
-        ]
-        
-        # Run the command with a 60-second timeout
-        result = subprocess.run(command, capture_output=True, text=True, timeout=60)
-
-        if result.returncode == 0:
-            base_name = os.path.splitext(os.path.basename(file_path))[0]
-            pdf_filename = f"{base_name}.pdf"
-            pdf_path = os.path.join(output_dir, pdf_filename)
-            
-            if os.path.exists(pdf_path):
-                print(f"   [Converter]  Successfully converted to {pdf_filename}")
-                return pdf_path
-            else:
-                print(f"   [Converter]  Conversion command ran, but output PDF not found.")
-                print(f"   [Converter] STDOUT: {result.stdout}")
-                print(f"   [Converter] STDERR: {result.stderr}")
-                return None
-        else:
-            print(f"   [Converter]  Conversion failed. Return code: {result.returncode}")
-            print(f"   [Converter] STDERR: {result.stderr}")
-            return None
-            
-    except subprocess.TimeoutExpired:
-        print(f"   [Converter]  ERROR: Conversion for {os.path.basename(file_path)} timed out.")
-        return None
-    except Exception as e:
-        print(f"   [Converter]  An unexpected error occurred during conversion: {e}")
-        return None
-# --- [END MODIFIED HELPER] ---
 
 def find_course_db_id(cursor, user_id, lms_course_id):
     """Finds the local primary key (id) of a course from its LMS ID."""
@@ -102,145 +55,6 @@ def find_course_db_id(cursor, user_id, lms_course_id):
         print(f"   [DB] ⚠️ Error finding course_db_id: {e}")
     return None
 
-def download_file(url, folder, cookies, headers, link_text="") -> str | None:
-    filename = None
-    local_path = None
-    print(f"         [Download Func] Attempting HEAD for: {url}") # DEBUG
-    try:
-        final_url = url
-        content_disposition = None
-        # Use HEAD first, follow redirect once if needed
-        # Disable redirects temporarily to inspect original headers
-        with requests.head(url, headers=headers, cookies=cookies, timeout=REQUESTS_TIMEOUT, allow_redirects=False) as r_head:
-            print(f"         [Download Func] HEAD status: {r_head.status_code}") # DEBUG
-            # If redirected, follow it once to get the final URL/headers
-            if 300 <= r_head.status_code < 400 and 'Location' in r_head.headers:
-                final_url = urllib.parse.urljoin(url, r_head.headers['Location'])
-                print(f"         [Download Func] Redirect detected. Following to: {final_url}") # DEBUG
-                # Make HEAD request to the final URL
-                with requests.head(final_url, headers=headers, cookies=cookies, timeout=REQUESTS_TIMEOUT) as r_final_head:
-                    print(f"         [Download Func] Final HEAD status: {r_final_head.status_code}") # DEBUG
-                    content_disposition = r_final_head.headers.get('content-disposition')
-                    # Raise error for the final URL if it fails
-                    r_final_head.raise_for_status()
-            else:
-                # Use headers from the original URL if no redirect
-                content_disposition = r_head.headers.get('content-disposition')
-                # Raise error for the original URL if it failed
-                r_head.raise_for_status()
-
-
-        url = final_url # Use final URL for the GET request
-        print(f"         [Download Func] Using final URL for download: {url}") # DEBUG
-
-
-        # --- Filename Determination ---
-        filename_source = "Unknown" # DEBUG
-        if content_disposition:
-            # More robust regex to handle filename*=UTF-8''... encoding
-            disp_match = re.search(r'filename\*?=(?:UTF-\d{1,2}\'\')?([^";\n]+)', content_disposition, re.IGNORECASE)
-            if disp_match:
-                filename = urllib.parse.unquote(disp_match.group(1)).strip('"')
-                filename_source = "Content-Disposition Header" # DEBUG
-                print(f"         [Download Func] Filename from header: {filename}")
-
-
-        # Fallback using URL path
-        if not filename:
-             parsed_url = urllib.parse.urlparse(url)
-             filename = os.path.basename(parsed_url.path)
-             if filename:
-                 filename_source = "URL Path" # DEBUG
-                 print(f"         [Download Func] Filename from URL path: {filename}")
-
-
-        # Fallback using link text if other methods fail or produce generic names
-        # Added empty string check for filename
-        if not filename or filename in ["pluginfile.php", "download", "content", "index.php", ""]:
-             if link_text and any(link_text.lower().endswith(ext) for ext in (".pdf", ".docx", ".pptx", ".zip", ".rar", ".xls", ".xlsx", ".txt", ".csv")):
-                  filename = re.sub(r'[\\/*?:"<>|]', "_", link_text).strip()
-                  filename_source = "Link Text" # DEBUG
-                  print(f"         [Download Func] Filename inferred from link text: {filename}")
-             else:
-                  # Last resort, generate a generic name
-                  filename_source = "Generic Fallback" # DEBUG
-                  generic_name = "downloaded_file"
-                  query = urllib.parse.urlparse(url).query.replace('&','_').replace('=','-')
-                  if query:
-                       safe_query = re.sub(r'[\\/*?:"<>|]', "_", query)[:50] # Limit length
-                       generic_name += "_" + safe_query
-                  else:
-                       # Add timestamp if no query to help uniqueness
-                       generic_name += f"_{int(time.time())}"
-
-
-                  # Try to guess extension based on link text or URL
-                  ext_match = re.search(r'\.(pdf|docx|pptx|zip|rar|xls|xlsx|txt|csv)$', link_text or url, re.IGNORECASE)
-                  if ext_match:
-                      generic_name += ext_match.group(0)
-
-
-                  filename = generic_name
-                  print(f"         [Download Func] Using generic filename: {filename}")
-
-
-        # Final sanitization and path creation
-        filename = re.sub(r'[\\/*?:"<>|\n\r\t]', "_", filename).strip()[:200] # Shorten long names too
-        local_path = os.path.join(folder, filename)
-        print(f"         [Download Func] Determined path (from {filename_source}): {local_path}") # DEBUG
-
-
-        # Perform the actual download using GET
-        print(f"         ⬇️ Starting GET request for download...") # DEBUG
-        with requests.get(url, headers=headers, cookies=cookies, timeout=REQUESTS_TIMEOUT*2, stream=True) as r_get: # Longer timeout for download
-            print(f"         [Download Func] GET request status: {r_get.status_code}") # DEBUG
-            r_get.raise_for_status() # Check for HTTP errors (4xx, 5xx)
-            print(f"         [Download Func] Writing to file...") # DEBUG
-            bytes_written = 0
-            with open(local_path, "wb") as f:
-                for chunk in r_get.iter_content(chunk_size=8192*4): # Slightly larger chunk
-                    if chunk: # filter out keep-alive new chunks
-                        f.write(chunk)
-                        bytes_written += len(chunk)
-            print(f"         [Download Func] Finished writing {bytes_written} bytes.") # DEBUG
-
-
-        # Check if file is empty, might indicate an issue despite 200 OK
-        if bytes_written == 0 and os.path.exists(local_path):
-             print(f"          WARNING: Downloaded file is empty: {local_path}")
-             # Optionally delete empty file: os.remove(local_path); return None
-
-
-        print(f"         📥 Download complete -> {local_path}")
-        return local_path
-
-
-    # --- Specific Exception Handling ---
-    except requests.exceptions.HTTPError as http_e:
-        print(f"          Failed download {url} (HTTP Error): {http_e.response.status_code} {http_e.response.reason}") # DEBUG
-        return None
-    except requests.exceptions.Timeout:
-        print(f"         Failed download {url} (Timeout after {REQUESTS_TIMEOUT}s or {REQUESTS_TIMEOUT*2}s)") # DEBUG
-        return None
-    except requests.exceptions.ConnectionError as conn_e:
-        print(f"          Failed download {url} (Connection Error): {conn_e}") # DEBUG
-        return None
-    except requests.exceptions.RequestException as req_e:
-        print(f"          Failed download {url} (General Request Error): {req_e}") # DEBUG
-        return None
-    except Exception as e:
-        print(f"          Failed download {url} (Other Error): {e}") # DEBUG
-        # Clean up partial file if it exists and path was determined
-        if local_path and os.path.exists(local_path):
-             try:
-                 # Check size before deleting, maybe small files are valid
-                 if os.path.getsize(local_path) == 0:
-                     os.remove(local_path)
-                     print(f"         🧹 Cleaned up empty/partial file: {local_path}")
-             except OSError: pass
-        return None
-
-
 def clean_file_text(text: str) -> str:
     """
 Recap of the Whoosh Search Implementation
@@ -298,16 +112,20 @@ This is what Postman is calling:
 * Return: It sends the JSON list back.
 
 The output you're seeing, with the "snippet" containing HTML-like <strong> tags, is the *intended and correct* behavior of this search setup. The frontend (like a web browser) will interpret <strong>...</strong> as "make this text bold," highlighting the search term for the user.
-    Removes common slide/text garbage like '---' and unicode artifacts."""
+    Removes common slide/text garbage like '---' and unicode artifacts.
+    Page/slide markers are kept, one page per line, so the indexer can chunk by page."""
     if not text:
         return ""
-    # Remove PowerPoint/PDF slide separators
-    text = re.sub(r'\n---\n', '\n', text) # Remove '---' separators on their own lines
-    # Remove unicode artifacts like \u000b (vertical tab)
-    text = text.replace('\u000b', ' ')
-    # Replace multiple newlines/spaces with a single space
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+    cleaned = []
+    for kind, number, page_text in split_pages(text):
+        # Remove PowerPoint/PDF slide separators
+        page_text = re.sub(r'\n---\n', '\n', page_text) # Remove '---' separators on their own lines
+        # Remove unicode artifacts like \u000b (vertical tab)
+        page_text = page_text.replace('\u000b', ' ')
+        # Replace multiple newlines/spaces with a single space
+        page_text = re.sub(r'\s+', ' ', page_text).strip()
+        if page_text: cleaned.append(f"--- {kind.title()} {number} --- {page_text}" if kind else page_text)
+    return "\n".join(cleaned)
 
 def parse_time_remaining(time_str: str) -> timedelta | None:
     """
@@ -342,187 +160,12 @@ def parse_time_remaining(time_str: str) -> timedelta | None:
         print(f"         [Parse Time] Error parsing '{time_str}': {e}")
         return None
 
-def read_docx(file_path: str) -> str:
-    # ... (Paste your full function code here) ...
-    try: doc = docx.Document(file_path); return "\n".join(p.text for p in doc.paragraphs if p.text)
-    except Exception as e: print(f" [DOCX Error] {os.path.basename(file_path)}: {e}"); return ""
-
-def read_txt(file_path: str) -> str:
-    """Extracts text from a plain .txt file, trying common encodings."""
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
-    except UnicodeDecodeError:
-        try: # Fallback for other common encodings
-            with open(file_path, "r", encoding="latin-1") as f:
-                return f.read()
-        except Exception as e:
-            print(f"         [TXT Error] Failed to read {os.path.basename(file_path)}: {e}")
-            return ""
-    except Exception as e:
-        print(f"         [TXT Error] Failed to read {os.path.basename(file_path)}: {e}")
-        return ""
-
-
-def read_pptx(file_path: str) -> str:
-    # ... (Paste your full function code here) ...
-    try:
-        prs = pptx.Presentation(file_path); full_text = []
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if not shape.has_text_frame: continue
-                para_text = "\n".join(p.text for p in shape.text_frame.paragraphs if p.text)
-                if para_text: full_text.append(para_text)
-        return "\n\n---\n\n".join(full_text)
-    except Exception as e: print(f" [PPTX Error] {os.path.basename(file_path)}: {e}"); return ""
-
-
-# --- [MODIFIED] File Reading Helper ---
-def read_pdf(file_path: str) -> str:
-    """Extracts all text from a .pdf file using pdfplumber."""
-    full_text = []
-    try:
-        with pdfplumber.open(file_path) as pdf:
-            # --- [FIX] ---
-            # Removed the 'if pdf.is_encrypted:' block, as that attribute
-            # does not exist for pdfplumber.
-            # We'll catch password errors in the 'except' block instead.
-            # --- [END FIX] ---
-
-            for i, page in enumerate(pdf.pages):
-                # extract_text can return None if page has no text
-                text = page.extract_text(x_tolerance=1, y_tolerance=1)
-                if text:
-                    full_text.append(f"--- Page {i+1} ---\n{text}")
-        return "\n\n".join(full_text)
-    
-    except pdfplumber.exceptions.PasswordRequired:
-         # Add a specific catch for password-protected files
-         print(f"         [PDF Error] Failed to read {os.path.basename(file_path)}: File is password-protected.")
-         return ""
-    except Exception as e:
-        # Catch other errors (e.g., corrupted file)
-        print(f"         [PDF Error] Failed to read {os.path.basename(file_path)}: {e}")
-        return ""
-
-
 # (Paste your AI-based deadline extractors here, as they are part of scraping)
-from ai_service import ai_client # Need the client
+from ai_service import ai_client, submit_deadlines_batch, collect_deadlines_batch # Need the client
 from bs4 import BeautifulSoup
-def extract_deadline_with_selectors(soup: BeautifulSoup) -> dict | None:
-    """
-    Tries to get deadline data using specific selectors and basic text pattern matching.
-    """
-    try:
-        # 1. Try Specific Table Cells (Most Reliable if Present)
-        selectors = [
-            "td.submissionstatustable_duedate", # Specific class for due date cell?
-            "td.submissionstatustable_timeremaining", # Specific class for time remaining?
-            ".submissionstatustable td.c2", # Value cell in submission status table
-            "td.timeremaining", # General time remaining cells
-            "td.overdue",       # General overdue cells
-            ".timeremaining",   # Div/Span with class timeremaining
-            ".overdue"          # Div/Span with class overdue
-            ]
-        for sel in selectors:
-            element = soup.select_one(sel)
-            if element:
-                text = element.get_text(strip=True)
-                if not text: continue # Skip empty elements
-
-
-                # Determine status based on selector or content
-                status = "Unknown"
-                if "duedate" in sel or "Due date" in element.find_previous_sibling(class_="c1").get_text() if element.find_previous_sibling(class_="c1") else False:
-                     status = "Due"
-                elif "overdue" in sel or "overdue" in text.lower() or "quá hạn" in text.lower():
-                     status = "Overdue"
-                elif "timeremaining" in sel or "remaining" in text.lower() or "còn lại" in text.lower():
-                     status = "Time Remaining"
-                elif re.search(r'\d{1,2}\s+\w+\s+\d{4},\s+\d{1,2}:\d{2}\s+(?:AM|PM)', text): # Basic check for absolute date format
-                     status = "Due" # Assume absolute dates mean 'Due'
-
-
-                if status != "Unknown":
-                    print(f"         [Selector] Found deadline via selector '{sel}': {status} - {text}")
-                    return {"status": status, "time": text}
-
-
-        # 2. Look in Activity Introduction/Description Areas
-        # These selectors might need adjustment based on your Moodle theme
-        intro_selectors = ["#intro.box.generalbox", ".activity-description", ".no-overflow"]
-        for sel in intro_selectors:
-            intro_box = soup.select_one(sel)
-            if intro_box:
-                intro_text = intro_box.get_text(" ", strip=True) # Get text content
-                # Use Regex to find potential deadlines (Vietnamese/English keywords)
-                # Look for patterns like "Deadline:", "Hạn nộp:", followed by a date/time
-                # Example: (\b(?:Deadline|Hạn nộp)\b[:\s]*)             # Keyword + separator
-                #          (.*?(?:\d{1,2}/\d{1,2}/\d{4}|\w+\s+\d{1,2})) # Date part (dd/mm/yyyy or Month dd)
-                #          (?:.*?(\d{1,2}:\d{2}\s*(?:AM|PM)?))?        # Optional time part
-                deadline_pattern = r'(?i)(\b(?:Deadline|Hạn nộp|Due date|Hết hạn)\b[:\s]*)(.*?((?:Mon|Tue|Wed|Thu|Fri|Sat|Sun|Thứ)\s*\d+.*?\d{4}.*?\d{1,2}:\d{2}\s*(?:AM|PM)?|\d{1,2}[/-]\d{1,2}[/-]\d{2,4}.*?\d{1,2}:\d{2}\s*(?:AM|PM)?|\d+\s+(?:days|ngày|hours|giờ|minutes|phút)\b))'
-                match = re.search(deadline_pattern, intro_text)
-                if match:
-                    status_keyword = match.group(1).strip(": ")
-                    time_str = match.group(2).strip()
-                    status = "Due" # Assume found date patterns mean 'Due'
-                    # Refine status based on keyword if needed (though Due is likely)
-                    if "Hạn nộp" in status_keyword or "Due" in status_keyword: status = "Due"
-
-
-                    print(f"         [Selector/Regex] Found deadline via intro text pattern: {status} - {time_str}")
-                    return {"status": status, "time": time_str}
-
-
-        # 3. If nothing found by selectors or regex
-        return None
-
-
-    except Exception as e:
-        print(f"         [Selector WARN] Error during advanced selector search: {e}")
-        return None
-
-def extract_deadline_with_ai(html_content: str) -> dict | None:
-    # ... (Paste your full function code with rate limit handling here) ...
-    if not ai_client: return None
-    print("         [AI Fallback] Trying Gemini for deadline...")
-    try:
-        soup_for_ai = BeautifulSoup(html_content, 'html.parser')
-        main_content = soup_for_ai.select_one("#region-main")
-        html_to_send = str(main_content) if main_content else html_content
-    except Exception: html_to_send = html_content
-    if len(html_to_send) > 100000: html_to_send = html_to_send[:100000] + "...(truncated)"
-    prompt = f"""Analyze Moodle HTML. Find due dates/deadlines/time remaining. Extract 'status' & 'time'. If none, return JSON: {{"status": "Not Found", "time": null}}. Return ONLY valid JSON. HTML: {html_to_send}"""
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            response = ai_client.generate_content(prompt)
-            data = json.loads(response.text)
-            if data.get("status") == "Not Found": return None
-            print(f"         [AI Fallback] Extracted deadline: {data}")
-            return data
-        except Exception as e:
-            error_str = str(e); is_rate_limit = "429" in error_str
-            wait_time = 60
-            if is_rate_limit:
-                match = re.search(r'(?:retry(?:_delay)?|Please retry in)\s*(?:{\s*seconds:\s*|\s*)(\d+)', error_str, re.IGNORECASE)
-                if match: wait_time = int(match.group(1)) + 2
-                print(f"         [AI Fallback] Rate Limit (429). Wait {wait_time}s (Attempt {attempt+1}/{max_retries})...")
-            else: print(f"         [AI Fallback] Failed (Attempt {attempt+1}/{max_retries}): {e}")
-            if attempt + 1 < max_retries and is_rate_limit: time.sleep(wait_time)
-            elif attempt + 1 >= max_retries: print("         [AI Fallback] Max retries reached."); return None
-    return None
-
-def get_deadline_info(html_content: str) -> dict | None:
-    # ... (Paste your full function code here) ...
-    try: soup = BeautifulSoup(html_content, 'lxml')
-    except ImportError: soup = BeautifulSoup(html_content, 'html.parser')
-    except Exception: return None
-    data = extract_deadline_with_selectors(soup)
-    if data: data["method"] = "selector"; return data
-    data = extract_deadline_with_ai(html_content)
-    if data: data["method"] = "ai"; return data
-    return None
+from deadline_extractor import (
+    extract_deadline, main_region, main_region_text, extract_deadline_with_selectors # noqa: F401 (re-exported)
+)
 
 # (Paste the email notification helper)
 import smtplib, ssl
@@ -554,22 +197,442 @@ def send_email_notification(subject, body):
         print(f"   [Email]  Failed to send email: {e}")
 
 
-def perform_full_scrape(user_id, lms_user, lms_pass):
+# --- Pipelined scrape helpers ---
+# Selenium is only used to log in and capture the sesskey/cookies. Everything
+# after that goes through a shared requests.Session so course pages, subpages
+# and downloads can run on bounded worker pools instead of one browser tab.
+# In "ws" crawler mode course contents and assignments come from Moodle web
+# services (moodle_service), so most activity pages are never fetched at all.
+# A headless browser is only started if a page can't be loaded over HTTP.
+
+FILE_EXTENSIONS = (".pdf", ".docx", ".pptx", ".zip", ".rar", ".xls", ".xlsx")
+
+class _BrowserFallback:
+    """
+    Pooled, logged-in headless Chrome (browser_pool), checked out lazily the
+    first time plain HTTP fails and returned when the scrape ends. One tab,
+    so page loads are serialized. Created for every scrape (it also drops the
+    cached LMS session when it expires); 'enabled' is SCRAPE_SELENIUM_FALLBACK.
+    """
+
+    def __init__(self, lms_user: str, lms_pass: str, enabled=True):
+        self.lms_user = lms_user
+        self.lms_pass = lms_pass
+        self.enabled = enabled
+        self.driver = None
+        self._lease = None
+        self._lock = threading.Lock()
+        self._session_dropped = False
+
+    def session_expired(self):
+        """The LMS bounced this scrape's session to the login page: don't hand the cached session out again."""
+        with self._lock:
+            if self._session_dropped: return
+            self._session_dropped = True
+        invalidate_lms_session(self.lms_user, self.lms_pass)
+        print("      [Session] LMS session expired; the next scrape logs in again.")
+
+    def get_page_source(self, url) -> str:
+        with self._lock:
+            if self.driver is None:
+                print("      [Fallback] Using a pooled browser for pages HTTP could not load...")
+                self._lease = acquire_driver(self.lms_user, self.lms_pass)
+                self.driver = self._lease.__enter__()
+            try:
+                self.driver.get(url)
+                time.sleep(1)
+                if "/login/index.php" in self.driver.current_url:
+                    raise ValueError(f"Browser fallback redirected to login while loading {url}")
+                return self.driver.page_source
+            except Exception as e:
+                # Like acquire_driver: a driver in an unknown state is discarded, not returned to the pool
+                lease, self._lease, self.driver = self._lease, None, None
+                lease.__exit__(type(e), e, e.__traceback__)
+                raise
+
+    def close(self):
+        if self._lease:
+            self._lease.__exit__(None, None, None)
+            self._lease = None; self.driver = None
+
+def _fetch_html(session, url, browser=None) -> str:
+    """
+    GETs an LMS page as HTML. Raises if the session was bounced back to the
+    login page, unless a browser fallback is given and can load it instead.
+    """
+    try:
+        response = session.get(url, headers={"accept": "text/html,application/xhtml+xml"}, timeout=REQUESTS_TIMEOUT)
+        response.raise_for_status()
+        if "/login/index.php" in response.url:
+            if browser is not None: browser.session_expired()
+            raise ValueError(f"Session redirected to login while loading {url}")
+        return response.text
+    except (ValueError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as http_e:
+        if browser is None or not browser.enabled: raise
+        print(f"      [Fallback] HTTP failed for {url} ({http_e}); loading it in the browser.")
+        return browser.get_page_source(url)
+
+def _link_text(anchor) -> str:
+    """Visible text of an <a>, falling back to Moodle's file-name span."""
+    for hidden in anchor.select(".accesshide, .sr-only"):
+        hidden.decompose()
+    text = anchor.get_text(" ", strip=True)
+    if not text:
+        fn_span = anchor.select_one("span.fp-filename")
+        text = fn_span.get_text(strip=True) if fn_span else ""
+    return text
+
+def _is_direct_file(href, link_text) -> bool:
+    return "pluginfile.php" in href or \
+           any(href.lower().endswith(ext) for ext in FILE_EXTENSIONS) or \
+           bool(link_text and any(link_text.lower().endswith(ext) for ext in FILE_EXTENSIONS))
+
+def _collect_course_links(page_source, course_url) -> list:
+    """Stage 1: returns [(href, link_text), ...] for every same-site link in #region-main."""
+    soup = BeautifulSoup(page_source, 'html.parser')
+    anchors = soup.select("#region-main a[href]") or soup.select("a[href]")
+    links = []; visited_hrefs = set(); parsed_course_netloc = urllib.parse.urlparse(course_url).netloc
+    for a in anchors:
+        href = urllib.parse.urljoin(course_url, a.get("href", "")).split("#")[0]
+        if not href or href in visited_hrefs or href == course_url: continue
+        if href.lower().startswith(("javascript:", "mailto:", "tel:")): continue
+        parsed_href_netloc = urllib.parse.urlparse(href).netloc
+        if parsed_href_netloc and parsed_href_netloc != parsed_course_netloc: continue
+        links.append((href, _link_text(a))); visited_hrefs.add(href)
+    return links
+
+def _fetch_course_page(session, course_url, course_folder, browser=None) -> list:
+    """Page-pool task: loads a course's main page, saves it and returns its sub-links."""
+    main_page_source = _fetch_html(session, course_url, browser)
+    main_filename = os.path.join(course_folder, "main_page.html")
+    with open(main_filename, "w", encoding="utf-8") as fh: fh.write(main_page_source)
+    print(f"      💾 Saved main HTML -> {main_filename}")
+    return _collect_course_links(main_page_source, course_url)
+
+def _fetch_course_links(session, sesskey, lms_course_id, course_url, course_folder, browser=None) -> list:
+    """
+    Page-pool task (stage 1): the course's links from core_course_get_contents
+    in "ws" mode, or from its HTML page ("html" mode, or if the WS call fails).
+    """
+    if SCRAPE_CRAWLER_MODE == "ws":
+        try:
+            links = get_course_links(session, sesskey, lms_course_id)
+            print(f"      [WS] core_course_get_contents: {len(links)} link(s) for course {lms_course_id}.")
+            return links
+        except Exception as ws_e:
+            print(f"      [WS] ⚠️ core_course_get_contents failed for course {lms_course_id} ({ws_e}); crawling HTML.")
+    return _fetch_course_page(session, course_url, course_folder, browser)
+
+def _assignment_result(assignment: dict) -> dict:
+    """A _scrape_subpage()-shaped result built from mod_assign_get_assignments data."""
+    return {"nested_files": list(assignment["files"]), "assignment": assignment["title"],
+            "deadline": assignment_deadline(assignment), "deadline_pending": None}
+
+def _parse_deadline_time(deadline_info) -> tuple:
+    """Turns an extract_deadline() result (or one page of an AI batch answer) into (status, original_time_str, iso_timestamp)."""
+    original_time_str = deadline_info.get("time")
+    iso_timestamp = None
+    clean_time_str = original_time_str.strip() if original_time_str else None
+    status = deadline_info.get("status")
+
+    if clean_time_str and status == "Due":
+        try:
+            parsed_datetime = date_parser.parse(clean_time_str, dayfirst=True)
+            iso_timestamp = parsed_datetime.isoformat()
+        except Exception as parse_e:
+            print(f"               ⚠️ Could not parse 'Due' date string '{original_time_str}': {parse_e}")
+
+    elif clean_time_str and status == "Overdue":
+        try:
+            time_delta = parse_time_remaining(clean_time_str)
+            if time_delta:
+                iso_timestamp = (datetime.now() - time_delta).isoformat()
+            else:
+                print(f"               ⚠️ Could not calculate relative 'Overdue' time: '{original_time_str}'")
+        except Exception as parse_e:
+            print(f"               ⚠️ Error parsing 'Overdue' date string '{original_time_str}': {parse_e}")
+
+    elif clean_time_str and status == "Time Remaining":
+        try:
+            time_delta = parse_time_remaining(clean_time_str)
+            if time_delta:
+                iso_timestamp = (datetime.now() + time_delta).isoformat()
+            else:
+                print(f"               ⚠️ Could not calculate relative time: '{original_time_str}'")
+        except Exception as parse_e:
+             print(f"               ⚠️ Error parsing 'Time Remaining': {parse_e}")
+
+    return status, original_time_str, iso_timestamp
+
+_TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+def _extract_assignment_title(soup, page_source, course_name, link_text, href) -> str:
+    assignment_title = None
+    h2_tag = soup.find('h2')
+    if h2_tag:
+        assignment_title = h2_tag.get_text(strip=True)
+    if not assignment_title:
+        # <title> is outside #region-main, so it is read from the raw HTML
+        title_match = _TITLE_RE.search(page_source)
+        if title_match:
+            assignment_title = " ".join(html.unescape(title_match.group(1)).split())
+    if assignment_title and course_name in assignment_title:
+        assignment_title = assignment_title.replace(course_name, '', 1).strip()
+        assignment_title = re.sub(r'^[\s:\-]+', '', assignment_title)
+    if not assignment_title or assignment_title == course_name:
+        assignment_title = link_text or href
+    return assignment_title
+
+def _scrape_subpage(session, href, link_text, idx, course_folder, course_name, browser=None) -> dict:
+    """
+    Page-pool task: fetches one activity/resource page over HTTP, saves it and
+    returns its nested pluginfile links plus any assignment/deadline found on it.
+    """
+    print(f"\n         👉 [{idx}] Visiting: {href}")
+    current_page_source = _fetch_html(session, href, browser)
+
+    safe_subname=re.sub(r'[\\/*?:"<>|]', "_", f"{idx}_{urllib.parse.quote_plus(href)}")[:200]
+    sub_filename=os.path.join(course_folder, f"{safe_subname}.html")
+    try:
+        with open(sub_filename, "w", encoding="utf-8") as fh: fh.write(current_page_source)
+        print(f"            💾 Saved HTML -> {sub_filename}")
+    except Exception as save_html_e: print(f"            ⚠️ Failed to save HTML: {save_html_e}")
+
+    result = {"nested_files": [], "assignment": None, "deadline": None, "deadline_pending": None}
+    # Parsed once, #region-main only (the activity body, where its files and deadline are),
+    # and shared by the file scan, the title and the deadline engine
+    soup = main_region(current_page_source)
+
+    # --- Nested file links (server-rendered, so no need to wait for them) ---
+    unique_nested_hrefs = set()
+    for file_link in soup.select("a[href*='pluginfile.php']"):
+        f_href = urllib.parse.urljoin(href, file_link.get("href", "")).split("#")[0]
+        if not f_href or f_href in unique_nested_hrefs: continue
+        unique_nested_hrefs.add(f_href)
+        f_link_text = _link_text(file_link) or os.path.basename(urllib.parse.urlparse(f_href).path)
+        result["nested_files"].append((f_href, f_link_text))
+    if unique_nested_hrefs:
+        print(f"         🔎 Found {len(unique_nested_hrefs)} nested file link(s) on {href}")
+
+    # --- Assignments and deadlines ---
+    if "mod/assign/" in href:
+        try:
+            result["assignment"] = _extract_assignment_title(soup, current_page_source, course_name, link_text, href)
+            print(f"            📋 Assignment Found: {result['assignment']}")
+        except Exception as title_e:
+            print(f"            ⚠️ Error extracting assignment title: {title_e}")
+
+    if "mod/assign/" in href or "mod/quiz/" in href:
+        deadline_info = extract_deadline(current_page_source, soup)
+        if deadline_info:
+            result["deadline"] = _parse_deadline_time(deadline_info)
+            print(f"            🎯 Deadline Found (Method: selector)")
+        else:
+            # Left for the batched AI stage after the crawl; only the trimmed text is kept
+            result["deadline_pending"] = main_region_text(current_page_source, soup, AI_DEADLINE_PAGE_CHARS) or None
+            if result["deadline_pending"]: print(f"            🕓 No deadline via selectors; queued for AI fallback.")
+
+    return result
+
+def _download_and_extract(session, href, course_folder, link_text, manifest_entry=None, stats=None,
+                          extract_stats=None) -> dict | None:
+    """
+    Download-pool task: downloads one file, converts Office documents to PDF,
+    extracts and cleans its text and writes the .txt sidecar.
+    With a manifest entry (incremental mode) an unchanged file is neither
+    re-extracted nor re-indexed. Returns None if the download failed.
+    """
+    file_info = dict(manifest_entry) if manifest_entry is not None else None
+    local_path = download_file(session, href, course_folder, link_text, file_info=file_info, stats=stats)
+    if not local_path:
+        print(f"            ❌ Download FAILED for {href}.")
+        return None
+    if file_info and file_info.get("not_modified"):
+        print(f"            ⏭️ Unchanged since last scrape: {os.path.basename(local_path)}")
+        return {"local_path": local_path, "file_type": file_info.get("file_type"), "cleaned_text": None,
+                "unchanged": True, "file_info": file_info}
+
+    extracted_text=None; file_type="Unknown"; file_ext_lower=os.path.splitext(local_path)[1].lower()
+    if file_ext_lower in (".docx", ".pptx", ".pdf"):
+        # Parsing runs in the extraction process pool; this thread just waits on it
+        file_type, extracted_text = extract_text(local_path, stats=extract_stats,
+                                                 sha256=(file_info or {}).get("sha256"))
+        # PDF conversion is batched per folder by the background soffice worker
+        if extracted_text and file_ext_lower != ".pdf": enqueue_conversion(local_path, course_folder)
+
+    cleaned_text = None
+    if extracted_text:
+        cleaned_text = clean_file_text(extracted_text)
+        txt_fname = f"{os.path.splitext(os.path.basename(local_path))[0]}.txt"
+        txt_fpath = os.path.join(course_folder, txt_fname)
+        with open(txt_fpath, "w", encoding="utf-8") as f: f.write(cleaned_text)
+        print(f"            💾 Saved cleaned text -> {txt_fpath}")
+    else:
+        print(f"            ➖ Skipping {os.path.basename(local_path)} (no text/unsupported/archive).")
+
+    if file_info is not None: file_info["file_type"] = file_type
+    return {"local_path": local_path, "file_type": file_type, "cleaned_text": cleaned_text,
+            "unchanged": False, "file_info": file_info}
+
+def _course_fingerprint(ctx) -> str:
+    """Hash of everything a course scrape writes, used to skip rewriting unchanged courses."""
+    payload = json.dumps({
+        "deadlines": sorted([d[2:] for d in ctx["deadlines"]], key=str),
+        "assignments": sorted([a[2:] for a in ctx["assignments"]], key=str),
+        "files": sorted(ctx["file_hashes"], key=str),
+        "ai_pending": sorted((url, hashlib.sha256(text.encode("utf-8")).hexdigest()) for url, text in ctx["ai_pending"]),
+    }, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _start_or_resume_run(cursor, user_id) -> tuple:
+    """
+    Resumes the user's last run if it never completed (crash, LMS timeout)
+    and is younger than SCRAPE_RESUME_MAX_AGE_HOURS, else starts a new one.
+    Returns (run_id, completed lms_course_ids, {subpage url: parsed result}).
+    """
+    row = cursor.execute("SELECT run_id, status, started_at FROM scrape_runs WHERE user_id = ?", (user_id,)).fetchone()
+    now = datetime.now()
+    if row and row['status'] != 'completed' and isinstance(row['started_at'], datetime) \
+            and now - row['started_at'] < timedelta(hours=SCRAPE_RESUME_MAX_AGE_HOURS):
+        run_id = row['run_id']
+        done_courses = {r['lms_course_id'] for r in cursor.execute(
+            "SELECT lms_course_id FROM scrape_checkpoints WHERE user_id = ? AND run_id = ?", (user_id, run_id)).fetchall()}
+        subpage_results = {}
+        for r in cursor.execute("SELECT url, result_json FROM scrape_subpage_checkpoints WHERE user_id = ? AND run_id = ?",
+                                (user_id, run_id)).fetchall():
+            data = json.loads(r['result_json'])
+            subpage_results[r['url']] = {"nested_files": [tuple(f) for f in data["nested_files"]],
+                                         "assignment": data["assignment"],
+                                         "deadline": tuple(data["deadline"]) if data["deadline"] else None,
+                                         "deadline_pending": data.get("deadline_pending")}
+        cursor.execute("UPDATE scrape_runs SET status = 'running', updated_at = ? WHERE user_id = ?", (now, user_id))
+        print(f"   [Checkpoint] Resuming run {run_id}: {len(done_courses)} course(s) and "
+              f"{len(subpage_results)} subpage(s) already done.")
+        return run_id, done_courses, subpage_results
+
+    run_id = uuid.uuid4().hex[:12]
+    cursor.execute("DELETE FROM scrape_checkpoints WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM scrape_subpage_checkpoints WHERE user_id = ?", (user_id,))
+    cursor.execute("INSERT OR REPLACE INTO scrape_runs (user_id, run_id, status, started_at, updated_at) VALUES (?, ?, 'running', ?, ?)",
+                   (user_id, run_id, now, now))
+    print(f"   [Checkpoint] Starting new run {run_id}.")
+    return run_id, set(), {}
+
+# --- Batched AI deadline stage ---
+# Pages the selectors couldn't parse are queued during the crawl (trimmed
+# #region-main text only) and sent to Gemini AI_DEADLINE_BATCH_PAGES at a time,
+# within AI_DEADLINE_BATCH_TOKENS, on a background thread once the crawl has
+# committed. Every batch is submitted to ai_gateway up front and collected in
+# order, so they share the rate limit instead of waiting for each other.
+# A 429 then only delays this stage, never the scrape itself.
+
+_ai_stage_locks = {} # user_id -> Lock, so a user's stages never overlap
+_ai_stage_locks_guard = threading.Lock()
+
+def _ai_deadline_batches(items):
+    budget_chars = AI_DEADLINE_BATCH_TOKENS * 4
+    batch, size = [], 0
+    for item in items:
+        if batch and (len(batch) >= AI_DEADLINE_BATCH_PAGES or size + len(item["text"]) > budget_chars):
+            yield batch
+            batch, size = [], 0
+        batch.append(item); size += len(item["text"])
+    if batch: yield batch
+
+def _run_ai_deadline_stage(user_id, items, user_state_file):
+    with _ai_stage_locks_guard:
+        lock = _ai_stage_locks.setdefault(user_id, threading.Lock())
+    with lock:
+        print(f"\n   [AI Deadlines] Resolving {len(items)} page(s) for user {user_id} in batches...")
+        started = time.perf_counter()
+        found_urls = set()
+        db = sqlite3.connect(DATABASE_FILE, detect_types=sqlite3.PARSE_DECLTYPES, timeout=10)
+        try:
+            db.execute("PRAGMA foreign_keys = ON")
+            pending = [(batch, submit_deadlines_batch([(str(idx), item["text"]) for idx, item in enumerate(batch)]))
+                       for batch in _ai_deadline_batches(items)]
+            for batch, future in pending:
+                found = collect_deadlines_batch(future, len(batch))
+                for idx, item in enumerate(batch):
+                    if str(idx) not in found: continue
+                    status, original_time_str, iso_timestamp = _parse_deadline_time(found[str(idx)])
+                    try:
+                        db.execute("DELETE FROM deadlines WHERE user_id = ? AND course_db_id = ? AND url = ?",
+                                   (user_id, item["course_db_id"], item["url"]))
+                        db.execute('INSERT INTO deadlines (user_id, course_db_id, status, time_string, parsed_iso_date, url, is_completed) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   (user_id, item["course_db_id"], status, original_time_str, iso_timestamp, item["url"], item["is_completed"]))
+                        found_urls.add(item["url"])
+                    except sqlite3.IntegrityError: # Course removed by a newer scrape meanwhile
+                        pass
+                db.commit() # Each batch lands on its own
+        except Exception as e:
+            print(f"   [AI Deadlines] ❌ Stage failed: {e}")
+            traceback.print_exc()
+        finally:
+            db.close()
+        print(f"   [AI Deadlines] {len(found_urls)}/{len(items)} deadline(s) found in {time.perf_counter() - started:.1f}s.")
+
+        if not found_urls: return
+        try:
+            with open(user_state_file, 'r', encoding='utf-8') as f: state = json.load(f)
+        except (OSError, ValueError):
+            state = {"deadlines": [], "files": []}
+        new_deadlines = found_urls - set(state.get("deadlines", []))
+        state["deadlines"] = sorted(set(state.get("deadlines", [])) | found_urls)
+        with open(user_state_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=4)
+        if new_deadlines:
+            send_email_notification(f"LMS Assistant: {len(new_deadlines)} New Deadlines!",
+                                    "Your LMS Assistant found the following new deadline pages:\n\n"
+                                    + "\n".join(f"- {url}" for url in sorted(new_deadlines)))
+
+def start_ai_deadline_stage(user_id, items, user_state_file):
+    """Runs the batched AI deadline fallback for 'items' on a background thread."""
+    if not ai_client:
+        print(f"   [AI Deadlines] AI disabled; {len(items)} page(s) left without a deadline.")
+        return None
+    thread = threading.Thread(target=_run_ai_deadline_stage, args=(user_id, items, user_state_file),
+                              daemon=True, name=f"ai-deadlines-{user_id}")
+    thread.start()
+    return thread
+
+def perform_full_scrape(user_id, lms_user, lms_pass, incremental=None, job=None):
     """
     The main scraping process, modified to run for a *specific user*.
+
+    Pipelined: Selenium logs in once, then course pages and subpages are
+    fetched on a page worker pool and files are downloaded/extracted on a
+    separate download pool. Only this thread touches the DB and index writer.
+
+    Incremental (default, see SCRAPE_INCREMENTAL): files are fetched with
+    conditional requests against the file_manifest table, unchanged files are
+    not re-extracted or re-indexed, and only courses whose content changed get
+    their deadline/assignment rows replaced.
+
+    Normally run by scrape_scheduler, which passes its ScrapeJob as 'job' so
+    progress (courses done, files, bytes) can be reported while it runs.
+    Returns the result dict (success, message, stats).
+
+    Checkpointed: each course's DB rows and index documents are committed as
+    soon as the course finishes (one short index writer session, so concurrent
+    scrapes don't block on the index lock), and parsed subpages are saved as
+    they arrive. If the run dies, the next scrape resumes it: completed
+    courses are skipped and saved subpages are not fetched again.
     """
-    if state.IS_SCRAPING:
-        print("Scrape already in progress.")
-        return
-    
-    state.IS_SCRAPING = True
-    state.LAST_SCRAPE_RESULT = None
+    if incremental is None:
+        incremental = SCRAPE_INCREMENTAL
+    add_progress = job.add_progress if job else (lambda **_: None)
+    scrape_result = None
+    scrape_started = time.perf_counter()
     print(f"\n🚀 Starting full scrape for user {lms_user} (ID: {user_id})...")
     
-    driver = None
     db = None 
     cursor = None
-    index_writer = None
+    session = None
+    browser = None
+    page_pool = None
+    download_pool = None
     
     # --- [MODIFIED] User-specific state file ---
     user_state_file = f"{os.path.splitext(STATE_FILE)[0]}_{user_id}.json"
@@ -593,140 +656,183 @@ def perform_full_scrape(user_id, lms_user, lms_pass):
         print("   [DB] Scrape thread connecting to database...")
         db = sqlite3.connect(DATABASE_FILE, detect_types=sqlite3.PARSE_DECLTYPES, timeout=10)
         db.row_factory = sqlite3.Row
+        db.execute("PRAGMA foreign_keys = ON") # So removed courses cascade to their rows
+        ensure_scrape_tables(db)
         cursor = db.cursor()
         print("   [DB] Scrape thread connected.")
 
-        print(f"   [DB] Clearing old assignments for user_id {user_id}...")
-        cursor.execute("DELETE FROM assignments WHERE user_id = ?", (user_id,))
+        # Manifest of previously downloaded files (url -> validators/hash)
+        manifest = {row['url']: dict(row) for row in cursor.execute(
+            "SELECT * FROM file_manifest WHERE user_id = ?", (user_id,)).fetchall()}
+        print(f"   [Incremental] {'On' if incremental else 'Off'}; manifest has {len(manifest)} file(s).")
+        course_hashes = {row['lms_course_id']: row['content_hash'] for row in cursor.execute(
+            "SELECT lms_course_id, content_hash FROM course_scrape_state WHERE user_id = ?", (user_id,)).fetchall()}
+        run_id, done_courses, subpage_results = _start_or_resume_run(cursor, user_id)
+        db.commit()
         # -----------------------------------------------------
 
-        # --- 2. Setup Selenium ---
-        print("   Setting up WebDriver...")
-        options = webdriver.ChromeOptions()
-        options.add_argument("--headless")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--window-size=1920,1080")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument(f'user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.0.0 Safari/537.36')
-        driver = webdriver.Chrome(options=options)
-        driver.implicitly_wait(10)
-        print("   WebDriver initialized (headless).")
-
-        # --- 3. Login and Confirm ---
-        print(f"   Attempting login...")
-        driver.get("https://lms.fit.hanu.vn/login/index.php")
-        try:
-            username_field = WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.ID, "username")))
-            username_field.send_keys(lms_user)
-            password_field = driver.find_element(By.ID, "password")
-            login_button = driver.find_element(By.ID, "loginbtn")
-            password_field.send_keys(lms_pass)
-            login_button.click()
-            print("   Login form submitted.")
-            print("   Waiting for login result...")
-            WebDriverWait(driver, 25).until(
-                EC.any_of(
-                    EC.presence_of_element_located((By.ID, "loggedin-user")),
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "div.alert.alert-danger"))
-                )
-            )
-            
-            # Check which element appeared
-            try:
-                driver.find_element(By.ID, "loggedin-user")
-                print("   ✅ Login successful (Found 'loggedin-user' ID).")
-
-                # --- 4. Extract Sesskey & Cookies ---
-                print("      Extracting session key & cookies...")
-                driver.get("https://lms.fit.hanu.vn/my/courses.php")
-                time.sleep(2)
-                page_source = driver.page_source
-
-                sesskey = None
-                m = re.search(r'M\.cfg\s*=\s*(\{.*?\});', page_source, re.DOTALL)
-                if m:
-                    cfg_json = m.group(1)
-                    try: sesskey = json.loads(cfg_json).get("sesskey")
-                    except json.JSONDecodeError:
-                         m2 = re.search(r'"sesskey"\s*:\s*"([^"]+)"', cfg_json); sesskey = m2.group(1) if m2 else None
-                if not sesskey:
-                    m3 = re.search(r'"sesskey"\s*:\s*"([^"]+)"', page_source); sesskey = m3.group(1) if m3 else None
-
-                if not sesskey:
-                    print("      Failed to extract sesskey from /my/courses.php.")
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    try:
-                         driver.save_screenshot(f"sesskey_fail_screenshot_{timestamp}.png")
-                         with open(f"sesskey_fail_source_{timestamp}.html", "w", encoding="utf-8") as f: f.write(page_source)
-                         print(f"         Saved debug info for sesskey failure.")
-                    except Exception as save_e: print(f"         Could not save debug info: {save_e}")
-                    raise ValueError("Sesskey not found post-login")
-
-                print(f"      🔑 Sesskey: {sesskey}")
-                
-                selenium_cookies = driver.get_cookies()
-                cookies_dict = {c['name']: c['value'] for c in selenium_cookies}
-                headers = {"accept": "application/json, text/javascript, */*; q=0.01", "content-type": "application/json",
-                           "origin": "https://lms.fit.hanu.vn", "referer": "https://lms.fit.hanu.vn/my/courses.php",
-                           "user-agent": driver.execute_script("return navigator.userAgent;"), "x-requested-with": "XMLHttpRequest",}
-
-            except NoSuchElementException: # Login failed
-                error_message = "Unknown login error"
-                try: error_message = driver.find_element(By.CSS_SELECTOR, "div.alert.alert-danger").text
-                except NoSuchElementException: pass
-                print(f"   ❌ Login failed: {error_message}")
-                raise Exception(f"Login failed: {error_message}")
-
-        except TimeoutException:
-            print("   ❌ Login failed: Timeout waiting for success/failure element.")
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S"); driver.save_screenshot(f"login_timeout_{timestamp}.png")
-            raise
-        except Exception as login_e:
-            print(f"   ❌ Login failed: {login_e}")
-            raise
+        # --- 2. Login (cached session or pooled browser) + Sesskey & Cookies ---
+        lms_session = get_lms_session(lms_user, lms_pass)
+        sesskey = lms_session["sesskey"]; cookies_dict = lms_session["cookies"]; user_agent = lms_session["user_agent"]
+
+        session = create_session(cookies_dict, user_agent)
+        browser = _BrowserFallback(lms_user, lms_pass, enabled=SCRAPE_SELENIUM_FALLBACK)
+        download_stats = DownloadStats()
+        extract_stats = ExtractionStats()
 
         # --- 5. Fetch Course List (AJAX) ---
         print("   Fetching course list...")
-        ajax_url = f"https://lms.fit.hanu.vn/lib/ajax/service.php?sesskey={sesskey}&info=core_course_get_enrolled_courses_by_timeline_classification"
-        payload = [{"index": 0, "methodname": "core_course_get_enrolled_courses_by_timeline_classification",
-                    "args": {"offset": 0, "limit": 999, "classification": "all", "sort": "fullname"}}]
-        response = requests.post(ajax_url, headers=headers, cookies=cookies_dict, json=payload, timeout=REQUESTS_TIMEOUT)
-        response.raise_for_status(); json_data = response.json()
-        simplified_courses = []
-        if json_data and isinstance(json_data[0], dict) and json_data[0].get("error") is False:
-            simplified_courses = [{"id": c.get("id"), "name": c.get("fullname"), "url": c.get("viewurl")}
-                                  for c in json_data[0].get("data", {}).get("courses", [])]
-        else: print(f"   ❌ AJAX error: {json_data}"); raise ValueError("Course fetch failed")
-
-        # --- 6. [DB-MODIFIED] Clear old data FOR THIS USER and insert new courses ---
-        print(f"   [DB] Clearing old courses and associated data for user_id {user_id}...")
-        # "ON DELETE CASCADE" in the schema will auto-delete related deadlines/content
-        cursor.execute("DELETE FROM courses WHERE user_id = ?", (user_id,))
-        
-        print(f"   [DB] Inserting {len(simplified_courses)} new courses for user_id {user_id}...")
-        course_id_map = {} # Map LMS ID -> new local DB ID
+        try:
+            course_data = call_ajax(session, sesskey, "core_course_get_enrolled_courses_by_timeline_classification",
+                                    {"offset": 0, "limit": 999, "classification": "all", "sort": "fullname"})
+        except ValueError as ajax_e:
+            print(f"   ❌ AJAX error: {ajax_e}"); raise ValueError("Course fetch failed")
+        simplified_courses = [{"id": c.get("id"), "name": c.get("fullname"), "url": c.get("viewurl")}
+                              for c in (course_data or {}).get("courses", [])]
+        if job: job.set_progress(courses_total=len(simplified_courses))
+
+        # Assignment titles/due dates/attachments for every course in one WS call
+        ws_assignments = {}
+        if SCRAPE_CRAWLER_MODE == "ws":
+            try:
+                ws_assignments = get_assignments(session, sesskey, [c["id"] for c in simplified_courses])
+                print(f"   [WS] mod_assign_get_assignments: {len(ws_assignments)} assignment(s).")
+            except Exception as ws_e:
+                print(f"   [WS] ⚠️ mod_assign_get_assignments failed ({ws_e}); assignment pages will be crawled.")
+
+        # --- 6. [DB-MODIFIED] Upsert courses FOR THIS USER ---
+        # Existing courses keep their local id, so saved summaries/flashcards/progress
+        # (which reference courses.id) survive a re-scrape.
+        existing_courses = {row['lms_course_id']: row['id'] for row in cursor.execute(
+            "SELECT id, lms_course_id FROM courses WHERE user_id = ?", (user_id,)).fetchall()}
+        course_id_map = {} # Map LMS ID -> local DB ID
         for course in simplified_courses:
              lms_course_id = course.get('id')
-             cursor.execute(
-                 'INSERT INTO courses (lms_course_id, user_id, name, url) VALUES (?, ?, ?, ?)',
-                 (lms_course_id, user_id, course.get('name'), course.get('url'))
-             )
-             course_id_map[lms_course_id] = cursor.lastrowid # Get the new local 'id' (from courses.id)
+             if lms_course_id in existing_courses:
+                 cursor.execute('UPDATE courses SET name = ?, url = ? WHERE id = ?',
+                                (course.get('name'), course.get('url'), existing_courses[lms_course_id]))
+                 course_id_map[lms_course_id] = existing_courses[lms_course_id]
+             else:
+                 cursor.execute(
+                     'INSERT INTO courses (lms_course_id, user_id, name, url) VALUES (?, ?, ?, ?)',
+                     (lms_course_id, user_id, course.get('name'), course.get('url'))
+                 )
+                 course_id_map[lms_course_id] = cursor.lastrowid # Get the new local 'id' (from courses.id)
+
+        dropped_courses = {lms_id: db_id for lms_id, db_id in existing_courses.items() if lms_id not in course_id_map}
+        if dropped_courses:
+            print(f"   [DB] Removing {len(dropped_courses)} course(s) no longer on the LMS...")
+            # "ON DELETE CASCADE" in the schema removes their deadlines/content
+            cursor.executemany("DELETE FROM courses WHERE id = ?", [(db_id,) for db_id in dropped_courses.values()])
+            cursor.executemany("DELETE FROM file_manifest WHERE user_id = ? AND lms_course_id = ?",
+                               [(user_id, lms_id) for lms_id in dropped_courses])
+            apply_index_ops(user_id, [("delete_course", (lms_id,)) for lms_id in dropped_courses])
+        # Committed now so the per-course checkpoints below only carry that course's rows
+        db.commit()
         print(f"   📝 Saved {len(simplified_courses)} courses to database.")
         # --- [END DB-MODIFIED] ---
 
-        # --- 7. [Whoosh-MODIFIED] Prepare Search Index ---
-        print("   [Search] Opening index writer...")
-        search_index = get_index() # Get the index (defined in search_service.py)
-        index_writer = search_index.writer()
-        
-        # Delete old documents for *this user* only
-        print(f"   [Search] Deleting old index entries for user_id {user_id}...")
-        index_writer.delete_by_term('user_id', str(user_id))
+        # --- 7. [Whoosh-MODIFIED] Search Index ---
+        # Index changes are buffered per course and committed with that course's
+        # checkpoint. Full mode replaces each course's documents (for *this user*
+        # only); incremental mode replaces per file.
         # --- [END Whoosh-MODIFIED] ---
 
-        # --- 8. Course Processing Loop ---
+        # --- 8. Pipelined Course Processing ---
+        # Stage 1 (page pool): course main pages -> links
+        # Stage 2 (page pool): HTML subpages -> nested files, assignments, deadlines
+        # Stage 3 (download pool): downloads + text extraction
+        # Results are consumed here, on the scrape thread, which owns the DB cursor and index buffers.
+        print(f"   [Pipeline] {SCRAPE_PAGE_WORKERS} page worker(s), {SCRAPE_DOWNLOAD_WORKERS} download worker(s).")
+        page_pool = ThreadPoolExecutor(max_workers=SCRAPE_PAGE_WORKERS, thread_name_prefix="scrape-page")
+        download_pool = ThreadPoolExecutor(max_workers=SCRAPE_DOWNLOAD_WORKERS, thread_name_prefix="scrape-dl")
+        pending = {} # future -> (kind, course_ctx, task_info)
+        scheduled_downloads = set() # Never fetch the same file twice in one run
+        unchanged_files = 0; unchanged_courses = 0
+        ai_deadline_queue = [] # Pages for the batched AI deadline stage (only courses whose rows were rewritten)
+        ai_pending_urls = set()
+        index_stats = {"docs": 0, "commits": 0, "seconds": 0.0}
+
+        def submit_download(ctx, f_href, f_link_text):
+            ctx["seen_urls"].add(f_href)
+            if f_href in scheduled_downloads: return
+            scheduled_downloads.add(f_href)
+            # Full mode still records hashes so the next incremental run has a baseline
+            manifest_entry = manifest.get(f_href, {"url": f_href}) if incremental else {"url": f_href}
+            future = download_pool.submit(_download_and_extract, session, f_href, ctx["folder"],
+                                          f_link_text, manifest_entry, download_stats, extract_stats)
+            pending[future] = ("file", ctx, f_href); ctx["outstanding"] += 1
+
+        def update_course_rows(ctx):
+            """Rewrites the course's rows. Returns the URLs the user had marked completed, or None if unchanged."""
+            nonlocal unchanged_courses
+            # --- Files that disappeared from the course since the last scrape ---
+            for url, entry in list(manifest.items()):
+                if entry["lms_course_id"] != ctx["lms_course_id"] or url in ctx["seen_urls"]: continue
+                print(f"      [Incremental] File removed from LMS: {url}")
+                if entry.get("local_path"):
+                    ctx["index_ops"].append(("delete_file", (ctx["lms_course_id"], os.path.basename(entry["local_path"]))))
+                cursor.execute("DELETE FROM file_manifest WHERE user_id = ? AND url = ?", (user_id, url))
+                del manifest[url]
+
+            fingerprint = _course_fingerprint(ctx)
+            if incremental and course_hashes.get(ctx["lms_course_id"]) == fingerprint:
+                unchanged_courses += 1
+                print(f"   ⏭️ Course {ctx['lms_course_id']} unchanged; keeping its rows.")
+                return None
+
+            # --- Replace deadlines and assignments for this course only ---
+            completed_urls = {row['url'] for row in cursor.execute(
+                "SELECT url FROM deadlines WHERE course_db_id = ? AND is_completed = 1", (ctx["course_db_id"],)).fetchall()}
+            cursor.execute("DELETE FROM deadlines WHERE user_id = ? AND course_db_id = ?", (user_id, ctx["course_db_id"]))
+            cursor.execute("DELETE FROM assignments WHERE user_id = ? AND course_db_id = ?", (user_id, ctx["course_db_id"]))
+            if ctx["deadlines"]:
+                print(f"      [DB] Inserting {len(ctx['deadlines'])} deadlines for course {ctx['lms_course_id']}...")
+                cursor.executemany(
+                    'INSERT INTO deadlines (user_id, course_db_id, status, time_string, parsed_iso_date, url, is_completed) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [row + (1 if row[5] in completed_urls else 0,) for row in ctx["deadlines"]]
+                )
+            if ctx["assignments"]:
+                print(f"      [DB] Inserting {len(ctx['assignments'])} assignments for course {ctx['lms_course_id']}...")
+                # INSERT OR IGNORE will skip any duplicates based on the 'url' UNIQUE constraint
+                cursor.executemany(
+                    'INSERT OR IGNORE INTO assignments (user_id, course_db_id, title, url) VALUES (?, ?, ?, ?)',
+                    ctx["assignments"]
+                )
+            cursor.execute(
+                "INSERT OR REPLACE INTO course_scrape_state (user_id, lms_course_id, content_hash, scraped_at) VALUES (?, ?, ?, ?)",
+                (user_id, ctx["lms_course_id"], fingerprint, datetime.now())
+            )
+            print(f"   ✅ Finished course {ctx['lms_course_id']} - {ctx['course_name']}")
+            return completed_urls
+
+        def finish_course(ctx):
+            if not ctx["loaded"]:
+                # Not checkpointed, so a resumed run retries it
+                print(f"   ⚠️ Course {ctx['lms_course_id']} page failed to load; keeping its previous data.")
+                return
+            completed_urls = update_course_rows(ctx)
+            if completed_urls is not None:
+                ai_deadline_queue.extend({"course_db_id": ctx["course_db_id"], "url": url, "text": text,
+                                          "is_completed": 1 if url in completed_urls else 0}
+                                         for url, text in ctx["ai_pending"])
+            # --- Checkpoint: this course's manifest rows, index docs and DB rows land together ---
+            if ctx["manifest_rows"]:
+                cursor.executemany(
+                    """INSERT OR REPLACE INTO file_manifest
+                       (user_id, lms_course_id, url, local_path, file_type, etag, last_modified, size, sha256, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    ctx["manifest_rows"]
+                )
+            if ctx["index_ops"]:
+                print(f"      [Search] Committing {len(ctx['index_ops'])} index change(s) for course {ctx['lms_course_id']}...")
+                op_stats = apply_index_ops(user_id, ctx["index_ops"])
+                index_stats["docs"] += op_stats["docs"]; index_stats["commits"] += 1
+                index_stats["seconds"] += op_stats["seconds"]
+            cursor.execute("INSERT OR REPLACE INTO scrape_checkpoints (user_id, run_id, lms_course_id, completed_at) VALUES (?, ?, ?, ?)",
+                           (user_id, run_id, ctx["lms_course_id"], datetime.now()))
+            db.commit()
+
         for course in simplified_courses:
             lms_course_id = course.get("id") # This is the ID from Moodle (e.g., 473)
             course_db_id = course_id_map.get(lms_course_id) # This is the local DB primary key (e.g., 1)
@@ -734,294 +840,113 @@ def perform_full_scrape(user_id, lms_user, lms_pass):
             
             if not course_url or not course_db_id:
                 print(f"   [DB] ⚠️ Error mapping course ID {lms_course_id}, skipping."); continue
+            if lms_course_id in done_courses:
+                print(f"   ⏭️ Course {lms_course_id} already committed by run {run_id}; skipping.")
+                add_progress(courses_done=1); continue
 
             safe_course_name = re.sub(r'[\\/*?:"<>|]', "_", course_name).strip()[:150]
             # [MODIFIED] Folder name is now user-specific
             user_specific_folder = os.path.join(SAVE_DIR, f"user_{user_id}", f"{lms_course_id}_{safe_course_name}")
             os.makedirs(user_specific_folder, exist_ok=True)
-            print(f"\n   📘 Processing course {lms_course_id} - {course_name}")
-
-            try:
-                driver.get(course_url)
-                WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.ID, "region-main")))
-            except Exception as e: print(f"      ⚠️ Failed load main page: {e}"); continue
-
-            main_page_source = driver.page_source
-            main_filename = os.path.join(user_specific_folder, "main_page.html")
-            with open(main_filename, "w", encoding="utf-8") as fh: fh.write(main_page_source)
-            print(f"      💾 Saved main HTML -> {main_filename}")
-
-            # Collect sub-links
-            links_to_visit = []; visited_hrefs = set(); parsed_course_netloc = urllib.parse.urlparse(course_url).netloc
-            try: anchor_elements = driver.find_elements(By.CSS_SELECTOR, "#region-main a[href]")
-            except Exception: anchor_elements = driver.find_elements(By.CSS_SELECTOR, "a[href]")
-
-            for a in anchor_elements:
+            print(f"\n   📘 Queueing course {lms_course_id} - {course_name}")
+
+            ctx = {"lms_course_id": lms_course_id, "course_db_id": course_db_id, "course_name": course_name,
+                   "folder": user_specific_folder, "outstanding": 1, "deadlines": [], "assignments": [], "ai_pending": [],
+                   "loaded": False, "seen_urls": set(), "file_hashes": [], "manifest_rows": [],
+                   "index_ops": [] if incremental else [("delete_course", (lms_course_id,))]}
+            future = page_pool.submit(_fetch_course_links, session, sesskey, lms_course_id, course_url,
+                                      user_specific_folder, browser)
+            pending[future] = ("course", ctx, course_url)
+
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, ctx, task_info = pending.pop(future)
+                ctx["outstanding"] -= 1
                 try:
-                    href_raw = a.get_attribute("href")
-                    if not href_raw: continue
-                    href = urllib.parse.urljoin(course_url, href_raw).split("#")[0]
-                    if not href or href in visited_hrefs or href == course_url: continue
-                    if href.lower().startswith(("javascript:", "mailto:", "tel:")): continue
-                    parsed_href_netloc = urllib.parse.urlparse(href).netloc
-                    if parsed_href_netloc and parsed_href_netloc != parsed_course_netloc: continue
-                    link_text = a.text.strip()
-                    if not link_text:
-                        try: fn_span = a.find_element(By.CSS_SELECTOR, "span.fp-filename"); link_text = fn_span.text.strip()
-                        except: link_text = ""
-                    links_to_visit.append((href, link_text)); visited_hrefs.add(href)
-                except Exception: continue
-
-            total_to_visit = len(links_to_visit) if (MAX_SUBPAGES is None) else min(len(links_to_visit), MAX_SUBPAGES)
-            print(f"      🔗 Found {len(links_to_visit)} links, processing {total_to_visit}...")
-            if total_to_visit == 0: continue
-
-            deadlines_to_add = [] # List to hold deadlines for this course
-
-            assignments_to_add = [] # List to hold assignments for this course
-
-            # --- [STATE] Initialize tracking sets ---
-            all_found_deadline_urls = set()
-
-            # --- 9. Visit Subpages Loop ---
-            for idx, (href, link_text) in enumerate(links_to_visit[:total_to_visit], start=1):
-                print(f"\n         👉 [{idx}/{total_to_visit}] Visiting: {href}")
-                if link_text: print(f"            Link Text: '{link_text}'")
-
-                file_extensions = (".pdf", ".docx", ".pptx", ".zip", ".rar", ".xls", ".xlsx")
-                is_direct_file = "pluginfile.php" in href or \
-                                 any(href.lower().endswith(ext) for ext in file_extensions) or \
-                                 (link_text and any(link_text.lower().endswith(ext) for ext in file_extensions))
-
-                if is_direct_file:
-                    local_path = download_file(href, user_specific_folder, cookies_dict, headers, link_text)
-                    if local_path:
-                        all_found_file_names.add(os.path.basename(local_path))
-                        extracted_text=None; file_type="Unknown"; file_ext_lower=os.path.splitext(local_path)[1].lower()
-
-                        if file_ext_lower == ".docx":
-                            file_type="Word"; extracted_text=read_docx(local_path)
-                            if extracted_text: # Only convert if we can read it
-                                try: driver.current_url # Keep-alive ping
-                                except Exception: pass # Ignore if driver connection is lost
-                                convert_to_pdf(local_path, user_specific_folder) 
-                        elif file_ext_lower == ".pptx":
-                            file_type="PowerPoint"; extracted_text=read_pptx(local_path)
-                            if extracted_text: # Only convert if we can read it
-                                try: driver.current_url # Keep-alive ping
-                                except Exception: pass
-                                convert_to_pdf(local_path, user_specific_folder)
-                        elif file_ext_lower == ".pdf":
-                            file_type="PDF"; extracted_text=read_pdf(local_path)
-                        
-                        if extracted_text:
-                            cleaned_text = clean_file_text(extracted_text)
-                            txt_fname = f"{os.path.splitext(os.path.basename(local_path))[0]}.txt"
-                            txt_fpath = os.path.join(user_specific_folder, txt_fname)
-                            with open(txt_fpath, "w", encoding="utf-8") as f: f.write(cleaned_text)
-                            print(f"            💾 Saved cleaned text -> {txt_fpath}")
-
-                            print(f"            [Search] Indexing {os.path.basename(local_path)}...")
-                            index_writer.add_document(
-                                user_id=str(user_id), # [MODIFIED]
-                                course_id=str(lms_course_id), # Use LMS ID for search consistency
-                                course_name=course_name,
-                                file_name=os.path.basename(local_path),
-                                file_type=file_type, content=cleaned_text
-                            )
-                        elif not extracted_text: print("            ➖ Skipping (no text/unsupported/archive).")
-                    continue 
-
-                # --- Process as HTML Page ---
-                else:
-                    try:
-                        print("         📄 Visiting as HTML page...")
-                        driver.get(href)
-                        WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-                        time.sleep(1)
-                        current_page_source = driver.page_source
-                    except Exception as e:
-                        print(f"            ⚠️ Failed load page: {e}"); continue
-
-                    safe_subname=re.sub(r'[\\/*?:"<>|]', "_", f"{idx}_{urllib.parse.quote_plus(href)}")[:200]
-                    sub_filename=os.path.join(user_specific_folder, f"{safe_subname}.html")
-                    try:
-                        with open(sub_filename, "w", encoding="utf-8") as fh: fh.write(current_page_source)
-                        print(f"            💾 Saved HTML -> {sub_filename}")
-                    except Exception as save_html_e: print(f"            ⚠️ Failed to save HTML: {save_html_e}")
-
-                    # --- Find and Process Nested File Links ---
-                    try:
-                        print("         DEBUG: Waiting up to 10s for nested pluginfile links...")
-                        try:
-                            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, "a[href*='pluginfile.php']")))
-                            nested_links = driver.find_elements(By.CSS_SELECTOR, "a[href*='pluginfile.php']")
-                            print(f"         DEBUG: Found {len(nested_links)} potential nested links after wait.")
-                        except TimeoutException: nested_links = []
-
-                        unique_nested_hrefs = set()
-                        processed_nested_count = 0
-
-                        if nested_links:
-                            print(f"         🔎 Processing {len(nested_links)} potential nested file link(s)...")
-                            for file_link_element in nested_links:
-                                 try:
-                                     f_href_raw = file_link_element.get_attribute('href')
-                                     f_href = urllib.parse.urljoin(href, f_href_raw).split("#")[0]
-                                     if not f_href or f_href in unique_nested_hrefs: continue
-                                     unique_nested_hrefs.add(f_href); processed_nested_count += 1
-                                     
-                                     f_link_text = file_link_element.text.strip()
-                                     if not f_link_text:
-                                          try: f_link_text=file_link_element.find_element(By.CSS_SELECTOR, "span.fp-filename").text.strip()
-                                          except: f_link_text=os.path.basename(urllib.parse.urlparse(f_href).path)
-
-                                     print(f"            📂 Processing nested file: {f_href} (Text: '{f_link_text}')")
-                                     nested_local_path = download_file(f_href, user_specific_folder, cookies_dict, headers, f_link_text)
-                                     
-                                     if nested_local_path:
-                                          all_found_file_names.add(os.path.basename(nested_local_path))
-                                          extracted_text=None; file_type="Unknown"; file_ext_lower=os.path.splitext(nested_local_path)[1].lower()
-
-                                          if file_ext_lower == ".docx":
-                                              file_type="Word"; extracted_text=read_docx(nested_local_path)
-                                              if extracted_text: 
-                                                  try: driver.current_url # Ping
-                                                  except Exception: pass
-                                                  convert_to_pdf(nested_local_path, user_specific_folder)
-                                          elif file_ext_lower == ".pptx":
-                                              file_type="PowerPoint"; extracted_text=read_pptx(nested_local_path)
-                                              if extracted_text:
-                                                  try: driver.current_url # Ping
-                                                  except Exception: pass
-                                                  convert_to_pdf(nested_local_path, user_specific_folder)
-                                          elif file_ext_lower == ".pdf":
-                                              file_type="PDF"; extracted_text=read_pdf(nested_local_path)
-                                          
-                                          if extracted_text:
-                                               cleaned_text = clean_file_text(extracted_text)
-                                               txt_fname=f"{os.path.splitext(os.path.basename(nested_local_path))[0]}.txt"
-                                               txt_fpath=os.path.join(user_specific_folder, txt_fname)
-                                               with open(txt_fpath, "w", encoding="utf-8") as f: f.write(cleaned_text)
-                                               print(f"               💾 Saved cleaned text -> {txt_fpath}")
-
-                                               print(f"               [Search] Indexing {os.path.basename(nested_local_path)}...")
-                                               index_writer.add_document(
-                                                   user_id=str(user_id),
-                                                   course_id=str(lms_course_id),
-                                                   course_name=course_name,
-                                                   file_name=os.path.basename(nested_local_path),
-                                                   file_type=file_type, content=cleaned_text
-                                               )
-                                          elif not extracted_text: print("               ➖ Skipping nested analysis (no text/unsupported/archive).")
-                                     else: print(f"            ❌ Nested download FAILED for {f_href}.")
-                                 except Exception as nested_proc_e:
-                                     print(f"               ⚠️ Error processing nested link {f_href or 'unknown'}: {nested_proc_e}")
-                        
-                    except Exception as sub_e:
-                        print(f"            ⚠️ Error finding/processing nested links: {sub_e}")
-
-                    # --- Check Deadlines and Save Assignments ---
-                    if "mod/assign/" in href or "mod/quiz/" in href:
-                        
-                        # --- 1. Assignment Logic ---
-                        if "mod/assign/" in href:
-                            try:
-                                soup = BeautifulSoup(current_page_source, 'html.parser')
-                                assignment_title = None
-                                h2_tag = soup.find('h2')
-                                if h2_tag:
-                                    assignment_title = h2_tag.get_text(strip=True)
-                                if not assignment_title:
-                                    title_tag = soup.find('title')
-                                    if title_tag:
-                                        assignment_title = title_tag.get_text(strip=True)
-                                if assignment_title and course_name in assignment_title:
-                                    assignment_title = assignment_title.replace(course_name, '', 1).strip()
-                                    assignment_title = re.sub(r'^[\s:\-]+', '', assignment_title)
-                                if not assignment_title or assignment_title == course_name:
-                                    assignment_title = link_text or href
-                                if assignment_title and href:
-                                    assignments_to_add.append((user_id, course_db_id, assignment_title, href))
-                                    print(f"            📋 Assignment Found: {assignment_title}")
-                            except Exception as title_e:
-                                print(f"            ⚠️ Error extracting assignment title: {title_e}")
-                        
-                        # --- 2. Deadline Logic ---
-                        # [FIX] This block is now correctly indented
-                        deadline_info = get_deadline_info(current_page_source)
-                        if deadline_info:
-                            all_found_deadline_urls.add(href) 
-                            original_time_str = deadline_info.get("time")
-                            iso_timestamp = None
-                            clean_time_str = original_time_str.strip() if original_time_str else None
-                            status = deadline_info.get("status")
-
-                            if clean_time_str and status == "Due":
-                                try:
-                                    clean_time_str = original_time_str.strip() 
-                                    parsed_datetime = date_parser.parse(clean_time_str, dayfirst=True)
-                                    iso_timestamp = parsed_datetime.isoformat()
-                                except Exception as parse_e:
-                                    print(f"               ⚠️ Could not parse 'Due' date string '{original_time_str}': {parse_e}")
-                            
-                            elif clean_time_str and status == "Overdue":
-                                try:
-                                    time_delta = parse_time_remaining(clean_time_str)
-                                    if time_delta:
-                                        iso_timestamp = (datetime.now() - time_delta).isoformat()
-                                    else:
-                                        print(f"               ⚠️ Could not calculate relative 'Overdue' time: '{original_time_str}'")
-                                except Exception as parse_e:
-                                    print(f"               ⚠️ Error parsing 'Overdue' date string '{original_time_str}': {parse_e}")
-                            
-                            elif clean_time_str and status == "Time Remaining":
-                                try:
-                                    time_delta = parse_time_remaining(clean_time_str) 
-                                    if time_delta:
-                                        iso_timestamp = (datetime.now() + time_delta).isoformat()
-                                    else:
-                                        print(f"               ⚠️ Could not calculate relative time: '{original_time_str}'")
-                                except Exception as parse_e:
-                                     print(f"               ⚠️ Error parsing 'Time Remaining': {parse_e}")
-
-                            deadlines_to_add.append((
-                                user_id, 
-                                course_db_id,
-                                status,
-                                original_time_str,
-                                iso_timestamp,
-                                href
-                            ))
-                            print(f"            🎯 Deadline Found (Method: {deadline_info.get('method', 'N/A')})")
-            # --- End Subpage Loop ---
-
-            # --- Save deadlines for this course to DB ---
-            if deadlines_to_add:
-                print(f"      [DB] Inserting {len(deadlines_to_add)} deadlines for course {lms_course_id}...")
-                cursor.executemany(
-                    'INSERT INTO deadlines (user_id, course_db_id, status, time_string, parsed_iso_date, url) VALUES (?, ?, ?, ?, ?, ?)',
-                    deadlines_to_add
-                )
-
-           # --- Save assignments for this course to DB ---
-            if assignments_to_add:
-                print(f"      [DB] Inserting {len(assignments_to_add)} assignments for course {lms_course_id}...")
-                # Use executemany for efficiency and correct schema
-                # INSERT OR IGNORE will skip any duplicates based on the 'url' UNIQUE constraint
-                cursor.executemany(
-                    'INSERT OR IGNORE INTO assignments (user_id, course_db_id, title, url) VALUES (?, ?, ?, ?)',
-                    assignments_to_add
-                )
-                    
-        # --- End Course Loop ---
-
-        # --- 10. Commit all changes ---
-        print("\n   [Search] Committing index writer...")
-        index_writer.commit(); index_writer = None
-        print("   [Search] Index commit complete.")
-
-        print("\n   [DB] Committing all scrape data to database...")
+                    result = future.result()
+                except Exception as task_e:
+                    print(f"      ⚠️ {kind} task failed for {task_info}: {task_e}")
+                    result = None
+
+                if kind == "course" and result is not None:
+                    ctx["loaded"] = True
+                    links_to_visit = result
+                    total_to_visit = len(links_to_visit) if (MAX_SUBPAGES is None) else min(len(links_to_visit), MAX_SUBPAGES)
+                    print(f"      🔗 Course {ctx['lms_course_id']}: found {len(links_to_visit)} links, processing {total_to_visit}...")
+                    for idx, (href, link_text) in enumerate(links_to_visit[:total_to_visit], start=1):
+                        if _is_direct_file(href, link_text):
+                            submit_download(ctx, href, link_text)
+                        elif normalize_url(href) in ws_assignments:
+                            # The WS already gave its title, due date and attachments: no page fetch
+                            sub_future = Future(); sub_future.set_result(_assignment_result(ws_assignments[normalize_url(href)]))
+                            pending[sub_future] = ("page", ctx, href); ctx["outstanding"] += 1
+                        elif href in subpage_results:
+                            # Parsed by the interrupted run; replay it without fetching
+                            sub_future = Future(); sub_future.set_result(subpage_results[href])
+                            pending[sub_future] = ("page", ctx, href); ctx["outstanding"] += 1
+                        else:
+                            sub_future = page_pool.submit(_scrape_subpage, session, href, link_text, idx,
+                                                          ctx["folder"], ctx["course_name"], browser)
+                            pending[sub_future] = ("page", ctx, href); ctx["outstanding"] += 1
+
+                elif kind == "page" and result is not None:
+                    href = task_info
+                    if href not in subpage_results:
+                        subpage_results[href] = result
+                        cursor.execute(
+                            "INSERT OR REPLACE INTO scrape_subpage_checkpoints (user_id, run_id, url, result_json) VALUES (?, ?, ?, ?)",
+                            (user_id, run_id, href, json.dumps(result))
+                        )
+                        db.commit()
+                    for f_href, f_link_text in result["nested_files"]:
+                        submit_download(ctx, f_href, f_link_text)
+                    if result["assignment"]:
+                        ctx["assignments"].append((user_id, ctx["course_db_id"], result["assignment"], href))
+                    if result["deadline"]:
+                        all_found_deadline_urls.add(href)
+                        status, original_time_str, iso_timestamp = result["deadline"]
+                        ctx["deadlines"].append((user_id, ctx["course_db_id"], status, original_time_str, iso_timestamp, href))
+                    elif result.get("deadline_pending"):
+                        ctx["ai_pending"].append((href, result["deadline_pending"])); ai_pending_urls.add(href)
+
+                elif kind == "file" and result is not None:
+                    file_name = os.path.basename(result["local_path"])
+                    all_found_file_names.add(file_name)
+                    file_info = result["file_info"]
+                    if file_info is not None:
+                        ctx["file_hashes"].append((task_info, file_info.get("sha256")))
+                        manifest[task_info] = dict(file_info, lms_course_id=ctx["lms_course_id"])
+                        # Written with the course checkpoint, never before its index docs
+                        ctx["manifest_rows"].append(
+                            (user_id, ctx["lms_course_id"], task_info, file_info.get("local_path"), file_info.get("file_type"),
+                             file_info.get("etag"), file_info.get("last_modified"), file_info.get("size"),
+                             file_info.get("sha256"), datetime.now())
+                        )
+                    if result["unchanged"]:
+                        unchanged_files += 1; add_progress(files_unchanged=1)
+                    else:
+                        add_progress(files_downloaded=1, bytes=(file_info or {}).get("size") or 0)
+                    if not result["unchanged"] and result["cleaned_text"]:
+                        if incremental:
+                            ctx["index_ops"].append(("delete_file", (ctx["lms_course_id"], file_name)))
+                        print(f"            [Search] Queued {file_name} for indexing.")
+                        # One document per page/slide (see search_service.file_documents)
+                        ctx["index_ops"].extend(("add", doc) for doc in file_documents(
+                            user_id, ctx["lms_course_id"], ctx["course_name"], # LMS ID for search consistency
+                            file_name, result["file_type"], result["cleaned_text"]
+                        ))
+
+                if ctx["outstanding"] == 0:
+                    finish_course(ctx)
+                    add_progress(courses_done=1)
+        # --- End Pipeline ---
+
+        # --- 10. Finish the run (courses were committed as they completed) ---
+        print("\n   [DB] Marking run complete and clearing checkpoints...")
+        cursor.execute("UPDATE scrape_runs SET status = 'completed', updated_at = ? WHERE user_id = ?", (datetime.now(), user_id))
+        cursor.execute("DELETE FROM scrape_checkpoints WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM scrape_subpage_checkpoints WHERE user_id = ?", (user_id,))
         db.commit()
         
         # --- [MODIFIED] State comparison & notification ---
@@ -1052,39 +977,76 @@ def perform_full_scrape(user_id, lms_user, lms_pass):
             send_email_notification(email_subject, final_email_body)
         
         print(f"   [State] Saving current state to {user_state_file}...")
+        if done_courses:
+            # Courses skipped on resume found nothing this time; keep their previous entries
+            all_found_deadline_urls |= old_deadline_set; all_found_file_names |= old_file_set
+        # Deadlines the AI stage found last time are not re-announced while it re-checks them
+        all_found_deadline_urls |= ai_pending_urls & old_deadline_set
         new_state_data = {"deadlines": list(all_found_deadline_urls), "files": list(all_found_file_names)}
         with open(user_state_file, 'w', encoding='utf-8') as f:
             json.dump(new_state_data, f, indent=4)
         # --- [END MODIFIED] ---
-        
-        print("\n✅ Full scrape completed successfully.")
 
-        state.LAST_SCRAPE_RESULT = {
+        # --- 11. AI deadline fallback, off the crawl's critical path ---
+        if ai_deadline_queue:
+            start_ai_deadline_stage(user_id, ai_deadline_queue, user_state_file)
+        
+        elapsed = time.perf_counter() - scrape_started
+        print(f"\n✅ Full scrape completed successfully in {elapsed:.1f}s.")
+        print(f"   [Download] {download_stats.summary()}")
+        print(f"   [Extract] {extract_stats.summary()}")
+        index_stats["seconds"] = round(index_stats["seconds"], 2)
+        index_stats["segments"] = index_segment_count(user_id)
+        print(f"   [Search] {index_stats['docs']} doc(s) indexed in {index_stats['commits']} commit(s), "
+              f"{index_stats['seconds']}s; index has {index_stats['segments']} segment(s).")
+
+        scrape_result = {
             "success": True,
-            "message": "Scrape completed successfully."
+            "message": "Scrape completed successfully.",
+            "elapsed_seconds": round(elapsed, 1),
+            "courses": len(simplified_courses),
+            "files": len(all_found_file_names),
+            "incremental": incremental,
+            "run_id": run_id,
+            "resumed_courses": len(done_courses),
+            "unchanged_files": unchanged_files,
+            "unchanged_courses": unchanged_courses,
+            "ai_deadline_pages_queued": len(ai_deadline_queue),
+            "downloads": download_stats.summary(),
+            "extraction": extract_stats.summary(),
+            "index": index_stats,
+            "conversion": conversion_stats()
         }
 
     except Exception as scrape_e:
         print(f"\n❌ An error occurred during scraping: {scrape_e}")
         traceback.print_exc()
         if db:
-             print("   [DB] Rolling back database changes due to error.")
+             print("   [DB] Rolling back the unfinished course (completed courses stay committed).")
              db.rollback()
-        if index_writer:
-             print("   [Search] Cancelling index writer due to error.")
-             index_writer.cancel()
-
-             state.LAST_SCRAPE_RESULT = {
+             try:
+                 db.execute("UPDATE scrape_runs SET status = 'failed', updated_at = ? WHERE user_id = ? AND status = 'running'",
+                            (datetime.now(), user_id))
+                 db.commit()
+                 print("   [Checkpoint] Run marked failed; the next scrape will resume it.")
+             except sqlite3.Error as cp_e:
+                 print(f"   [Checkpoint] ⚠️ Could not mark run failed: {cp_e}")
+
+        scrape_result = {
             "success": False,
-            "message": str(scrape_e) 
+            "message": str(scrape_e),
+            "elapsed_seconds": round(time.perf_counter() - scrape_started, 1)
         }
     finally:
+        for pool in (page_pool, download_pool):
+            if pool: pool.shutdown(wait=True, cancel_futures=True)
+        if session:
+            session.close()
+        if browser:
+            browser.close()
         if db:
              print("   [DB] Closing database connection...")
              db.close()
-        if driver:
-            print("   Closing WebDriver...")
-            driver.quit()
-        state.IS_SCRAPING = False # Reset flag
-        print("   Scrape function finished. State reset to Idle.")
-# ==============================================================================
\ No newline at end of file
+        print("   Scrape function finished.")
+    return scrape_result
+# ==============================================================================
@@ -0,0 +1,62 @@
+# search_cache_service.py
+import time
+import threading
+from collections import OrderedDict
+
+from config import SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_TTL_SECONDS
+
+# --- Per-user search result cache ---
+# /api/search results keyed by (user, normalized query, filters, index
+# generation). A commit to a user's index moves it to a new generation, so old
+# entries can never be served again; search_service also drops them right
+# away so they don't sit in memory until LRU eviction or the TTL.
+
+_lock = threading.Lock()
+_entries = OrderedDict() # key -> (expires_at, results)
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidated": 0}
+
+def normalize_query(query: str) -> str:
+    # Whitespace only: Whoosh operators (AND/OR/NOT) are case-sensitive
+    return " ".join(query.split())
+
+def _key(user_id, query, filters, generation):
+    return (str(user_id), normalize_query(query), tuple(sorted((filters or {}).items())), generation)
+
+def get_cached_results(user_id, query, filters, generation):
+    """Cached result list, or None on a miss/expired entry."""
+    key = _key(user_id, query, filters, generation)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        if entry[0] < now:
+            del _entries[key]; _stats["expired"] += 1; _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return entry[1]
+
+def put_cached_results(user_id, query, filters, generation, results):
+    key = _key(user_id, query, filters, generation)
+    with _lock:
+        _entries[key] = (time.monotonic() + SEARCH_CACHE_TTL_SECONDS, results)
+        _entries.move_to_end(key)
+        while len(_entries) > SEARCH_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False); _stats["evictions"] += 1
+
+def invalidate_user(user_id):
+    """Drops every cached result for one user (their index got a new generation)."""
+    user_id = str(user_id)
+    with _lock:
+        stale = [key for key in _entries if key[0] == user_id]
+        for key in stale: del _entries[key]
+        _stats["invalidated"] += len(stale)
+
+def search_cache_stats() -> dict:
+    with _lock:
+        stats = dict(_stats); stats["entries"] = len(_entries)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
@@ -1,130 +1,859 @@
 import os
+import time
 import shutil
-from whoosh.index import create_in, open_dir, exists_in
-from whoosh.fields import Schema, ID, TEXT, STORED
+import glob
+import threading
+import contextlib
+from functools import lru_cache
+from collections import OrderedDict, Counter, deque
+from whoosh.index import create_in, open_dir, exists_in, LockError
+from whoosh.fields import Schema, ID, TEXT, STORED, NUMERIC
 from whoosh.qparser import QueryParser # <-- We import it from Whoosh here
-from whoosh.highlight import Formatter, ContextFragmenter
+from whoosh.query import And, Term
+from whoosh.highlight import Formatter, PinpointFragmenter, get_text
+from whoosh.sorting import FieldFacet, Count
+from whoosh.util.filelock import try_for
 import docx
 import pptx
 import pdfplumber
-from config import INDEX_DIR # Import from config
+from config import ( # Import from config
+    INDEX_DIR, SAVE_DIR, INDEX_WRITER_TIMEOUT, INDEX_WRITER_LIMITMB, INDEX_BULK_MIN_DOCS,
+    INDEX_MAX_SEGMENTS, SEARCHER_MAX_OPEN, SEARCH_PAGE_SIZE, INDEX_CHUNK_CHARS,
+    INDEX_STORE_CONTENT, SEMANTIC_SEARCH_ENABLED, SEMANTIC_CANDIDATES, SUGGEST_LIMIT, SEARCH_LATENCY_SAMPLES
+)
+from extraction_service import FILE_TYPES, split_pages
+from text_analysis import vietnamese_analyzer, surface_analyzer, normalize_text
+from search_cache_service import get_cached_results, put_cached_results, invalidate_user
+from semantic_service import (
+    apply_vector_ops, clear_user_vectors, finish_user_vectors, load_model, vectors_current, semantic_search
+)
+from suggest_service import get_lexicon, load_lexicon, lexicon_loaded, note_commit, drop_lexicon, complete_word
 
 # --- Schema Definition (from your code) ---
 
-def get_search_schema():
-    """Defines the schema for the search index."""
+def get_search_schema(store_content=INDEX_STORE_CONTENT):
+    """
+    Defines the schema for the search index. With store_content=False the
+    chunk text is only indexed; snippets are then built from the .txt sidecars.
+    """
     return Schema(
+        user_id=ID(stored=True),
         course_id=ID(stored=True), 
         course_name=TEXT(stored=True),
         file_name=ID(stored=True), 
-        file_type=STORED(),
-        content=TEXT(stored=True, phrase=True) # Text content of the file
+        file_type=ID(stored=True), # Indexed for the file-type filter/facet
+        page=NUMERIC(stored=True), # PDF page / PPTX slide number of this chunk
+        location=STORED(), # "p.17" / "slide 4", shown next to the file name
+        chunk=NUMERIC(stored=True), # Piece of the page, to find the text again in the sidecar
+        # Text of one page/slide (or part of it); accent-folded, Vietnamese stopwords (text_analysis)
+        content=TEXT(analyzer=vietnamese_analyzer(), stored=store_content, phrase=True),
+        # The same words unfolded ('mạng', 'măng'), only read as the suggest lexicon
+        terms=TEXT(analyzer=surface_analyzer(), phrase=False)
     )
 
+# Bumped whenever get_search_schema() or its analysis changes: older indexes are
+# rebuilt in the background (start_index_migration) and keep serving meanwhile.
+# 1: per-page chunks with file_type/page/chunk fields, 2: Vietnamese analyzer,
+# 3: "không" no longer a stopword, 4: unfolded 'terms' field for suggestions
+SCHEMA_VERSION = 4
+
+# --- Chunking ---
+# A file is indexed as one document per PDF page / PPTX slide (DOCX and TXT,
+# which have no pages, as INDEX_CHUNK_CHARS pieces), so a hit points at
+# "Lecture3.pdf p.17" and highlighting scans one page instead of the whole file.
+
+def _chunk_text(text: str, size: int) -> list[str]:
+    """Splits text into pieces of at most 'size' chars, at word boundaries."""
+    chunks = []
+    while len(text) > size:
+        cut = text.rfind(" ", 0, size)
+        if cut <= size // 2: cut = size # One very long 'word'
+        chunks.append(text[:cut].strip()); text = text[cut:].strip()
+    if text: chunks.append(text)
+    return chunks
+
+def _page_chunks(page_text: str) -> list[str]:
+    return _chunk_text(" ".join(normalize_text(page_text).split()), INDEX_CHUNK_CHARS)
+
+def file_documents(user_id, course_id, course_name, file_name, file_type, text) -> list[dict]:
+    """The index documents (fields for add_document) for one file's cleaned text."""
+    docs = []
+    for kind, number, page_text in split_pages(text):
+        location = {"page": f"p.{number}", "slide": f"slide {number}"}.get(kind)
+        for chunk_no, chunk in enumerate(_page_chunks(page_text)):
+            doc = dict(user_id=str(user_id), course_id=str(course_id), course_name=str(course_name),
+                       file_name=str(file_name), file_type=str(file_type), chunk=chunk_no, content=chunk, terms=chunk)
+            if number is not None: doc.update(page=number, location=location)
+            docs.append(doc)
+    return docs
+
 # --- Index Management ---
+# Every user has their own index in INDEX_DIR/user_<id>: a search, a scrape
+# commit or a rebuild only touches that user's segments and write lock, so
+# its cost doesn't grow with the number of users. The old shared index at
+# INDEX_DIR itself is no longer read; a missing user index is built in the
+# background (start_index_migration) from the .txt sidecars the scraper saved.
+
+def user_index_dir(user_id) -> str:
+    return os.path.join(INDEX_DIR, f"user_{user_id}")
+
+def user_index_exists(user_id) -> bool:
+    return exists_in(user_index_dir(user_id))
+
+def indexed_user_ids() -> list[str]:
+    """Users with an index in INDEX_DIR (skipping user_<id>.building/.old directories)."""
+    if not os.path.isdir(INDEX_DIR): return []
+    return [name[len("user_"):] for name in sorted(os.listdir(INDEX_DIR))
+            if name.startswith("user_") and "." not in name and exists_in(os.path.join(INDEX_DIR, name))]
+
+_current_users = set() # Indexes already checked by user_index_is_current
+_create_lock = threading.Lock() # A new index vs. a background build moving its copy into place
+
+def _create_index(index_dir):
+    """A new, empty index with the current schema, tagged with SCHEMA_VERSION."""
+    os.makedirs(index_dir, exist_ok=True)
+    ix = create_in(index_dir, get_search_schema())
+    with open(os.path.join(index_dir, "schema_version"), "w") as f: f.write(str(SCHEMA_VERSION))
+    return ix
+
+def index_schema_version(index_dir) -> int:
+    """SCHEMA_VERSION the index was created with (0 for indexes from before versioning)."""
+    try:
+        with open(os.path.join(index_dir, "schema_version"), "r") as f: return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def user_index_is_current(user_id) -> bool:
+    """False for an index built with an older schema or analyzer (see SCHEMA_VERSION)."""
+    if str(user_id) in _current_users: return True
+    current = index_schema_version(user_index_dir(user_id)) >= SCHEMA_VERSION
+    if current: _current_users.add(str(user_id))
+    return current
 
-def get_index():
+def get_index(user_id):
     """
-    Opens the existing Whoosh index or creates a new one if it doesn't exist.
+    Opens the user's Whoosh index or creates a new one if it doesn't exist.
     """
-    if not exists_in(INDEX_DIR):
-        print(f" 🌀 [Search] Index not found at {INDEX_DIR}. Creating new index...")
-        os.makedirs(INDEX_DIR, exist_ok=True)
-        ix = create_in(INDEX_DIR, get_search_schema())
-    else:
-        # print(f" 🔍 [Search] Opening existing index at {INDEX_DIR}...")
-        ix = open_dir(INDEX_DIR)
-    return ix
+    index_dir = user_index_dir(user_id)
+    if not exists_in(index_dir):
+        with _create_lock:
+            if not exists_in(index_dir):
+                print(f" 🌀 [Search] Index not found at {index_dir}. Creating new index...")
+                return _create_index(index_dir)
+    return open_dir(index_dir)
+
+# --- Index generations ---
+# Every commit to a user's index (scrape, rebuild, merge) writes a new TOC
+# generation. The search result cache is keyed by it, so a commit made here
+# is picked up without re-opening the index on each search.
+
+_generation_lock = threading.Lock()
+_generations = {} # user_id -> latest committed generation
+
+def index_generation(user_id) -> int:
+    user_id = str(user_id)
+    with _generation_lock:
+        if user_id in _generations: return _generations[user_id]
+    generation = get_index(user_id).latest_generation()
+    with _generation_lock:
+        return _generations.setdefault(user_id, generation)
+
+def _bump_generation(user_id):
+    """Records the user's new index generation and drops their cached search results."""
+    try: generation = get_index(user_id).latest_generation()
+    except Exception: generation = None
+    with _generation_lock:
+        if generation is None: _generations.pop(str(user_id), None)
+        else: _generations[str(user_id)] = generation
+    invalidate_user(user_id)
+    return generation
+
+# --- Shared searchers ---
+# One long-lived searcher per user index instead of open_dir() + ix.searcher()
+# on every query. It is refreshed (only the changed segments are re-opened)
+# when the user's generation moves, and used by one request thread at a time.
+# At most SEARCHER_MAX_OPEN users keep a searcher open (LRU).
+
+class _SearcherHandle:
+    def __init__(self, user_id, generation):
+        self.lock = threading.Lock()
+        self.searcher = get_index(user_id).searcher()
+        self.generation = generation # Read before opening, so never newer than the searcher
+
+    def close(self):
+        try: self.searcher.close()
+        except Exception: pass
+
+_handles_lock = threading.Lock()
+_handles = OrderedDict() # user_id -> _SearcherHandle
+
+@contextlib.contextmanager
+def user_searcher(user_id):
+    """Yields the user's shared searcher, current as of their latest commit."""
+    user_id = str(user_id)
+    generation = index_generation(user_id)
+    evicted = []
+    with _handles_lock:
+        handle = _handles.get(user_id)
+        if handle is None:
+            handle = _handles[user_id] = _SearcherHandle(user_id, generation)
+        _handles.move_to_end(user_id)
+        while len(_handles) > SEARCHER_MAX_OPEN:
+            evicted.append(_handles.popitem(last=False)[1])
+    for old in evicted:
+        with old.lock: old.close() # Waits for a search still using it
+    with handle.lock:
+        if handle.generation != generation:
+            handle.searcher = handle.searcher.refresh() # Shares unchanged segment readers
+            handle.generation = generation
+        yield handle.searcher
+
+def close_user_searcher(user_id):
+    """Closes the user's shared searcher (before their index directory is removed)."""
+    with _handles_lock:
+        handle = _handles.pop(str(user_id), None)
+    if handle is not None:
+        with handle.lock: handle.close()
+
+def open_index_writer(user_id, timeout=INDEX_WRITER_TIMEOUT, bulk_docs=0, procs=1):
+    """
+    Opens a writer on the user's index, retrying the write lock for up to
+    'timeout' seconds (a merge or the AI stage may be committing) instead of failing.
+    With procs > 1 and 'bulk_docs' >= INDEX_BULK_MIN_DOCS the documents are
+    indexed by that many processes, each adding its own segment (multisegment).
+    Whoosh forks them, so only single-threaded offline tools
+    (rebuild_search_index.py) ask for it; the Flask process always uses one.
+    """
+    ix = get_index(user_id)
+    if procs > 1 and bulk_docs >= INDEX_BULK_MIN_DOCS:
+        batchsize = max(10, -(-bulk_docs // procs)) # One job file per process
+        return ix.writer(procs=procs, multisegment=True, batchsize=batchsize,
+                         limitmb=INDEX_WRITER_LIMITMB, timeout=timeout, delay=0.5)
+    return ix.writer(limitmb=INDEX_WRITER_LIMITMB, timeout=timeout, delay=0.5)
 
-def clear_search_index():
+def clear_search_index(user_id):
     """
-    Completely removes the existing index directory and creates a new, empty one.
+    Removes the user's index directory and creates a new, empty one.
     """
-    print(f" 🗑️ [Search] Clearing existing index at {INDEX_DIR}...")
+    index_dir = user_index_dir(user_id)
+    print(f" 🗑️ [Search] Clearing existing index at {index_dir}...")
+    close_user_searcher(user_id) # New index restarts at generation 0
     try:
-        if os.path.exists(INDEX_DIR):
-            shutil.rmtree(INDEX_DIR) # Remove the entire directory
-        
-        # Ensure the directory exists for the new index
-        os.makedirs(INDEX_DIR, exist_ok=True) 
-        
-        schema = get_search_schema()
-        ix = create_in(INDEX_DIR, schema)
+        if os.path.exists(index_dir):
+            shutil.rmtree(index_dir) # Remove the user's index only
+
+        ix = _create_index(index_dir)
+        _bump_generation(user_id)
+        if SEMANTIC_SEARCH_ENABLED: clear_user_vectors(user_id) # Refilled by the same ops
+        drop_lexicon(user_id)
         print(" ❇️ [Search] Index cleared and re-created.")
         return ix
     except Exception as e:
         print(f" ⚠️ [Search] Failed to clear/create index: {e}")
         raise
 
-def add_document_to_index(ix, course_id, course_name, file_name, file_type, content):
+def _course_sidecars(user_id):
+    """
+    Yields (lms_course_id, course_name, [(file_name, file_type, sidecar path)])
+    for each course folder in SAVE_DIR/user_<id>/.
+    """
+    user_folder = os.path.join(SAVE_DIR, f"user_{user_id}")
+    if not os.path.isdir(user_folder): return
+    for course_dir in sorted(os.listdir(user_folder)):
+        course_path = os.path.join(user_folder, course_dir)
+        if not os.path.isdir(course_path): continue
+        lms_course_id, _, course_name = course_dir.partition("_")
+        by_stem = {}
+        for name in os.listdir(course_path):
+            stem, ext = os.path.splitext(name)
+            by_stem.setdefault(stem, {})[ext.lower()] = name
+        files = []
+        for stem, names in sorted(by_stem.items()):
+            if ".txt" not in names: continue
+            # The original download; a .pdf next to a .docx/.pptx is its converted copy
+            source_ext = next((e for e in (".docx", ".pptx", ".pdf") if e in names), None)
+            if not source_ext: continue # A plain .txt download, not a sidecar
+            files.append((names[source_ext], FILE_TYPES[source_ext], os.path.join(course_path, names[".txt"])))
+        yield lms_course_id, course_name, files
+
+def _read_sidecar(path) -> str:
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return f.read()
+
+def sidecar_course_documents(user_id):
     """
-    Adds a single document to the search index.
+    Yields the index documents of each course folder in SAVE_DIR/user_<id>/,
+    built from the cleaned .txt sidecars saved next to each extracted file.
     """
+    for lms_course_id, course_name, files in _course_sidecars(user_id):
+        docs = []
+        for file_name, file_type, path in files:
+            content = _read_sidecar(path)
+            if content.strip():
+                docs.extend(file_documents(user_id, lms_course_id, course_name, file_name, file_type, content))
+        yield docs
+
+def user_has_sidecars(user_id) -> bool:
+    """True if a scrape saved text the user's index can be built from."""
+    return any(files for _, _, files in _course_sidecars(user_id))
+
+# --- Schema migration ---
+# An index older than SCHEMA_VERSION is rebuilt from the sidecars into
+# INDEX_DIR/user_<id>.building by a background thread while searches keep using
+# the old one. The finished index replaces the live directory while holding
+# the live index's write lock, and only if no scrape committed meanwhile
+# (otherwise it is built again). Vectors don't depend on the schema and are kept.
+# A missing index (first search) is built the same way; searches get a
+# "building" answer until it is moved into place.
+
+_migration_lock = threading.Lock() # One rebuild at a time
+_migrations_lock = threading.Lock()
+_migrations = {} # user_id -> "running" | "failed"
+MIGRATION_ATTEMPTS = 3
+
+def _build_index_copy(user_id, build_dir) -> int:
+    if os.path.exists(build_dir): shutil.rmtree(build_dir) # Left over by an interrupted run
+    ix = _create_index(build_dir)
+    writer = ix.writer(limitmb=INDEX_WRITER_LIMITMB)
+    total = 0
     try:
-        writer = ix.writer()
-        writer.add_document(
-            course_id=str(course_id),
-            course_name=str(course_name),
-            file_name=str(file_name),
-            file_type=str(file_type),
-            content=str(content)
-        )
+        for docs in sidecar_course_documents(user_id):
+            for doc in docs: writer.add_document(**doc)
+            total += len(docs)
         writer.commit()
+    except Exception:
+        writer.cancel()
+        raise
+    return total
+
+def _swap_in_index(user_id, build_dir, generation) -> bool:
+    """
+    Replaces the live index with build_dir unless it was written after
+    'generation' (None: there was no index, and a scrape must not have created one).
+    """
+    index_dir = user_index_dir(user_id)
+    if generation is None:
+        with _create_lock:
+            if exists_in(index_dir): return False
+            shutil.rmtree(index_dir, ignore_errors=True) # An empty folder, e.g. from an interrupted create
+            os.replace(build_dir, index_dir)
+        close_user_searcher(user_id)
+        return True
+    ix = get_index(user_id)
+    writelock = ix.lock("WRITELOCK") # Held off scrapes wait, then write to the new index
+    if not try_for(writelock.acquire, timeout=INDEX_WRITER_TIMEOUT, delay=0.5): raise LockError
+    try:
+        if ix.latest_generation() != generation: return False
+        close_user_searcher(user_id)
+        old_dir = index_dir + ".old"
+        if os.path.exists(old_dir): shutil.rmtree(old_dir)
+        os.replace(index_dir, old_dir)
+        try: os.replace(build_dir, index_dir)
+        except OSError:
+            os.replace(old_dir, index_dir); raise
+    finally:
+        writelock.release()
+    close_user_searcher(user_id) # In case a search re-opened the old index meanwhile
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return True
+
+def _migrate_user_index(user_id):
+    user_id = str(user_id)
+    build_dir = user_index_dir(user_id) + ".building"
+    started = time.perf_counter()
+    try:
+        with _migration_lock:
+            for attempt in range(MIGRATION_ATTEMPTS):
+                exists = user_index_exists(user_id)
+                generation = get_index(user_id).latest_generation() if exists else None
+                old_docs = get_index(user_id).doc_count() if exists else 0
+                total = _build_index_copy(user_id, build_dir)
+                if not total and old_docs:
+                    raise RuntimeError(f"no sidecar text found, keeping the {old_docs} indexed chunk(s)")
+                if _swap_in_index(user_id, build_dir, generation): break
+                print(f" 🔁 [Search] User {user_id} index changed during migration, rebuilding...")
+            else:
+                raise RuntimeError(f"index kept changing ({MIGRATION_ATTEMPTS} attempts)")
+        _current_users.discard(user_id)
+        _bump_generation(user_id)
+        drop_lexicon(user_id) # Terms are analyzed differently now
+        if generation is None and SEMANTIC_SEARCH_ENABLED:
+            clear_user_vectors(user_id, building=True) # Left from an older index: rebuilt on the next semantic search
+        with _migrations_lock: _migrations.pop(user_id, None)
+        print(f" ❇️ [Search] {'Built' if generation is None else 'Migrated'} index for user {user_id} "
+              f"(schema v{SCHEMA_VERSION}): {total} document(s) in {time.perf_counter() - started:.1f}s.")
     except Exception as e:
-        print(f" ⚠️ [Search] Failed to add document {file_name}: {e}")
+        shutil.rmtree(build_dir, ignore_errors=True)
+        with _migrations_lock: _migrations[user_id] = "failed"
+        print(f" ⚠️ [Search] Index migration failed for user {user_id}: {e}")
+
+def start_index_migration(user_id) -> bool:
+    """
+    Builds a missing or outdated user index in a background thread (no-op if
+    one is running or already failed in this process). Returns True if a thread was started.
+    """
+    user_id = str(user_id)
+    with _migrations_lock:
+        if user_id in _migrations: return False
+        _migrations[user_id] = "running"
+    threading.Thread(target=_migrate_user_index, args=(user_id,), daemon=True,
+                     name=f"index-migrate-{user_id}").start()
+    return True
+
+def index_build_status(user_id) -> str | None:
+    """"running" or "failed" while/after a background build of the user's index, else None."""
+    with _migrations_lock: return _migrations.get(str(user_id))
+
+def migrate_stale_indexes():
+    """Startup job: migrates every user index in INDEX_DIR older than SCHEMA_VERSION, one after another."""
+    stale = [user_id for user_id in indexed_user_ids()
+             if index_schema_version(user_index_dir(user_id)) < SCHEMA_VERSION]
+    if stale: print(f" 🌀 [Search] {len(stale)} index(es) older than schema v{SCHEMA_VERSION}, migrating in the background...")
+    for user_id in stale:
+        with _migrations_lock:
+            if user_id in _migrations: continue
+            _migrations[user_id] = "running"
+        _migrate_user_index(user_id)
+
+# --- Vector builds ---
+# The first semantic/hybrid search (or a new embedding model) re-embeds the
+# user's sidecars in a background thread; searches get keyword results until
+# it is done. The store is marked "building" meanwhile, so scrape commits skip
+# it, and the build starts over if the index got a commit while it ran.
+
+_vector_builds_lock = threading.Lock()
+_vector_builds = set() # Users whose vectors are being built
+
+def rebuild_user_vectors(user_id) -> int:
+    """Re-embeds every chunk of the user's sidecars, in the caller's thread. Returns the number of vectors."""
+    started = time.perf_counter()
+    load_model() # Before the manifest is written: a model that fails to load means hashed vectors
+    for attempt in range(MIGRATION_ATTEMPTS):
+        generation = get_index(user_id).latest_generation() # On disk: committed before its vector update
+        clear_user_vectors(user_id, building=True)
+        total = 0
+        for docs in sidecar_course_documents(user_id):
+            total += apply_vector_ops(user_id, [("add", doc) for doc in docs], building=True)
+        if finish_user_vectors(user_id, lambda: get_index(user_id).latest_generation() == generation): break
+        print(f" 🔁 [Semantic] User {user_id} index changed while embedding, starting over...")
+    else:
+        print(f" ⚠️ [Semantic] User {user_id} index kept changing; vectors left for the next search to rebuild.")
+    invalidate_user(user_id)
+    print(f" 🧠 [Semantic] Embedded {total} chunk(s) for user {user_id} in {time.perf_counter() - started:.1f}s.")
+    return total
+
+def _build_user_vectors(user_id):
+    try:
+        rebuild_user_vectors(user_id)
+    except Exception as e:
+        print(f" ⚠️ [Semantic] Embedding failed for user {user_id}: {e}")
+    finally:
+        with _vector_builds_lock: _vector_builds.discard(str(user_id))
+
+def start_vector_build(user_id) -> bool:
+    """Builds the user's vectors in a background thread unless a build is already running."""
+    with _vector_builds_lock:
+        if str(user_id) in _vector_builds: return False
+        _vector_builds.add(str(user_id))
+    threading.Thread(target=_build_user_vectors, args=(user_id,), daemon=True,
+                     name=f"vector-build-{user_id}").start()
+    return True
+
+def delete_file_from_index(writer, user_id, course_id, file_name):
+    """
+    Removes every indexed document for one scraped file, so an incremental
+    scrape can replace a changed file (or drop a deleted one) without
+    rebuilding the rest of the user's index.
+    """
+    terms = [Term("course_id", str(course_id)), Term("file_name", str(file_name))]
+    if "user_id" in writer.schema:
+        terms.append(Term("user_id", str(user_id)))
+    writer.delete_by_query(And(terms))
+
+def apply_index_ops(user_id, ops, procs=1) -> dict:
+    """
+    Applies buffered scrape changes in one short writer session and commits.
+    ops: ("add", fields_dict) | ("delete_file", (course_id, file_name)) | ("delete_course", (course_id,))
+    The commit doesn't merge segments (see merge_index_segments). 'procs': see open_index_writer.
+    Returns {"docs", "seconds", "procs"} for build-time reporting.
+    """
+    if not ops: return {"docs": 0, "seconds": 0.0, "procs": 0}
+    started = time.perf_counter()
+    adds = sum(1 for op, _ in ops if op == "add")
+    writer = open_index_writer(user_id, bulk_docs=adds, procs=procs) # Waits if a merge is committing
+    procs = getattr(writer, "procs", 1)
+    lexicon_field = _lexicon_field(writer.schema)
+    analyzer = writer.schema[lexicon_field].analyzer
+    try:
+        for op, args in ops:
+            if op == "add": # An index waiting for its migration may lack newer fields ('terms')
+                writer.add_document(**{name: value for name, value in args.items() if name in writer.schema})
+            elif op == "delete_file": delete_file_from_index(writer, user_id, *args)
+            elif op == "delete_course":
+                terms = [Term("course_id", str(args[0]))]
+                if "user_id" in writer.schema: terms.append(Term("user_id", str(user_id)))
+                writer.delete_by_query(And(terms))
+        writer.commit(merge=False)
+    except Exception:
+        writer.cancel()
+        raise
+    if SEMANTIC_SEARCH_ENABLED: # Before the generation bump, so cached semantic results can't outlive it
+        try: apply_vector_ops(user_id, ops)
+        except Exception as e: print(f" ⚠️ [Semantic] Vector update failed for user {user_id}: {e}")
+    generation = _bump_generation(user_id)
+    if lexicon_loaded(user_id): # Keep /api/search/suggest's term dictionary in step
+        added_terms = {}
+        for op, args in ops:
+            if op != "add": continue
+            for term in {token.text for token in analyzer(args.get(lexicon_field, ""))}:
+                added_terms[term] = added_terms.get(term, 0) + 1
+        note_commit(user_id, generation, added_terms, removed=any(op != "add" for op, _ in ops))
+    with _merge_lock:
+        _dirty_users.add(str(user_id))
+    return {"docs": adds, "seconds": time.perf_counter() - started, "procs": procs}
+
+# --- Segment maintenance ---
+
+_merge_lock = threading.Lock()
+_dirty_users = set() # Users whose index got commits since their last merge
+
+def index_segment_count(user_id) -> int:
+    try:
+        return len(get_index(user_id)._segments())
+    except Exception:
+        return 0
+
+def _merge_user_segments(user_id, timeout, optimize=None) -> dict | None:
+    """
+    MERGE_SMALL merge of one user's index, or an optimize to one segment once
+    it has more than INDEX_MAX_SEGMENTS or over 20% of its documents are
+    deleted (MERGE_SMALL never reclaims replaced courses/files).
+    optimize=True forces the optimize. Returns None if the index is busy.
+    """
+    segments = get_index(user_id)._segments()
+    before = len(segments)
+    deleted = sum(seg.deleted_count() for seg in segments)
+    total = sum(seg.doc_count_all() for seg in segments) or 1
+    if before <= 1 and not deleted: return {"segments_before": before, "segments_after": before, "seconds": 0.0}
+    started = time.perf_counter()
+    if optimize is None: optimize = before > INDEX_MAX_SEGMENTS or deleted / total > 0.2
+    try:
+        writer = get_index(user_id).writer(limitmb=INDEX_WRITER_LIMITMB, timeout=timeout, delay=0.5)
+    except LockError:
+        return None
+    writer.commit(merge=True, optimize=optimize)
+    note_commit(user_id, _bump_generation(user_id)) # Purged deletions change the scores, not the terms
+    result = {"segments_before": before, "segments_after": index_segment_count(user_id),
+              "seconds": round(time.perf_counter() - started, 2), "optimized": optimize}
+    print(f" 🧱 [Search] User {user_id}: {'optimized' if optimize else 'merged'} index segments "
+          f"{result['segments_before']} -> {result['segments_after']} in {result['seconds']}s")
+    return result
+
+def merge_index_segments(timeout=5) -> dict:
+    """
+    Scheduled merge of every user index that was written since the last run.
+    An index that is busy (scrape committing) stays dirty and is retried next run.
+    """
+    with _merge_lock:
+        users = list(_dirty_users); _dirty_users.clear()
+    results = {}
+    for user_id in users:
+        try:
+            results[user_id] = _merge_user_segments(user_id, timeout)
+        except Exception as e:
+            print(f" ⚠️ [Search] Segment merge failed for user {user_id}: {e}")
+            results[user_id] = None
+        if results[user_id] is None:
+            with _merge_lock: _dirty_users.add(user_id)
+    return results
+
+def optimize_user_index(user_id, timeout=5) -> dict | None:
+    """Merges the user's index into one segment, purging deleted documents (None if it is busy)."""
+    return _merge_user_segments(str(user_id), timeout, optimize=True)
+
+def index_stats(user_id) -> dict:
+    """Segment, document and on-disk size figures of the user's index."""
+    index_dir = user_index_dir(user_id)
+    segments = get_index(user_id)._segments()
+    size = sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir)
+               if os.path.isfile(os.path.join(index_dir, name)))
+    return {"segments": len(segments), "docs": sum(seg.doc_count() for seg in segments),
+            "deleted": sum(seg.deleted_count() for seg in segments), "size_bytes": size,
+            "schema_version": index_schema_version(index_dir), "generation": index_generation(user_id)}
+
+def verify_user_index(user_id, repair=True) -> dict:
+    """
+    Checks the user's index against the .txt sidecars: files whose chunks are
+    missing, whose sidecar is gone (orphaned) or whose chunk count differs
+    from the sidecar's. With repair=True those files are re-indexed in one
+    commit, unless the index was written to while it was being checked.
+    """
+    user_id = str(user_id)
+    generation = index_generation(user_id)
+    expected = {} # (course_id, file_name) -> (chunk count, course_name, file_type, sidecar path)
+    for lms_course_id, course_name, files in _course_sidecars(user_id):
+        for file_name, file_type, path in files:
+            content = _read_sidecar(path)
+            if not content.strip(): continue
+            chunks = sum(len(_page_chunks(page_text)) for _, _, page_text in split_pages(content))
+            expected[(lms_course_id, file_name)] = (chunks, course_name, file_type, path)
+    with user_searcher(user_id) as searcher:
+        indexed = Counter((fields.get("course_id"), fields.get("file_name"))
+                          for fields in searcher.reader().all_stored_fields())
+
+    missing = [key for key in expected if key not in indexed]
+    orphaned = [key for key in indexed if key not in expected]
+    mismatched = [key for key, count in indexed.items() if key in expected and expected[key][0] != count]
+    report = {"files": len(expected), "chunks": sum(indexed.values()), "missing": len(missing),
+              "orphaned": len(orphaned), "mismatched": len(mismatched), "repaired": 0,
+              "examples": [f"{course_id}/{file_name}" for course_id, file_name in (missing + orphaned + mismatched)[:5]]}
+    if not repair or not (missing or orphaned or mismatched): return report
+    if index_generation(user_id) != generation:
+        print(f" ⏭️ [Search] User {user_id} index changed during verification; repair left for the next run.")
+        return report
+
+    ops = [("delete_file", key) for key in orphaned + mismatched]
+    for key in missing + mismatched:
+        chunks, course_name, file_type, path = expected[key]
+        ops.extend(("add", doc) for doc in file_documents(user_id, key[0], course_name, key[1], file_type, _read_sidecar(path)))
+    apply_index_ops(user_id, ops)
+    report["repaired"] = len(missing) + len(orphaned) + len(mismatched)
+    print(f" 🩹 [Search] User {user_id}: re-indexed {report['repaired']} file(s) that didn't match their sidecars "
+          f"({len(missing)} missing, {len(orphaned)} orphaned, {len(mismatched)} mismatched).")
+    return report
 
 # --- Custom Formatter (from your code) ---
 
 class SimpleFormatter(Formatter):
     """Wraps highlighted terms in <strong> tags."""
     def format_token(self, text, token, replace=False):
-        # The 'text' param is the original text of the token
-        return f"<strong>{text}</strong>"
+        # 'text' is the whole fragment; get_text() slices out this token
+        return f"<strong>{get_text(text, token, replace)}</strong>"
+
+class _PinpointFragmenter(PinpointFragmenter):
+    """
+    PinpointFragmenter that copies the matched tokens: when retokenizing,
+    Whoosh passes some of them on as the analyzer's reused Token object, so
+    the second of two adjacent matches ('han nop') was highlighted at the last token's place.
+    """
+    def fragment_tokens(self, text, tokens):
+        return self.fragment_matches(text, [t.copy() for t in tokens if t.matched])
 
 # --- Search Function ---
 
-def search_index(search_query: str):
+# Facets returned with every search; filterable by the same fields
+FACET_FIELDS = ("course_id", "file_type")
+
+def _search_filter(schema, filters):
+    terms = [Term(name, str(value)) for name, value in filters.items()
+             if value not in (None, "") and name in schema and schema[name].indexed]
+    return And(terms) if terms else None
+
+def _facet_counts(searcher, query, filter_q) -> dict:
+    """Match counts per course and file type, counted without scoring."""
+    fields = [name for name in FACET_FIELDS if name in searcher.schema and searcher.schema[name].indexed]
+    if not fields: return {}
+    results = searcher.search(query, limit=None, scored=False, filter=filter_q,
+                              groupedby={name: FieldFacet(name, maptype=Count) for name in fields})
+    facets = {}
+    for name in fields:
+        groups = sorted(results.groups(name).items(), key=lambda item: (-item[1], item[0]))
+        entries = [{name: key, "count": count} for key, count in groups]
+        if name == "course_id":
+            for entry in entries:
+                doc = searcher.document(course_id=entry["course_id"]) or {}
+                entry["course_name"] = doc.get("course_name")
+        facets[name] = entries
+    return facets
+
+# --- Snippets ---
+# Hits keep their text in the index unless INDEX_STORE_CONTENT is off; then
+# the chunk is cut again from the file's .txt sidecar, for the hits of the
+# returned page only.
+
+@lru_cache(maxsize=32)
+def _sidecar_pages(path, mtime):
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return split_pages(f.read())
+
+def _sidecar_chunk(user_id, course_id, file_name, page, chunk_no) -> str:
+    stem = os.path.splitext(file_name)[0]
+    for path in glob.glob(os.path.join(glob.escape(os.path.join(SAVE_DIR, f"user_{user_id}")), f"{course_id}_*", f"{glob.escape(stem)}.txt")):
+        try: pages = _sidecar_pages(path, os.path.getmtime(path))
+        except OSError: continue
+        for kind, number, page_text in pages:
+            if number == page:
+                chunks = _page_chunks(page_text)
+                return chunks[chunk_no] if chunk_no < len(chunks) else ""
+    return ""
+
+def hit_text(hit, user_id) -> str:
+    """The chunk text of a hit: stored in the index, or read back from its sidecar."""
+    if "content" in hit: return hit["content"]
+    return _sidecar_chunk(user_id, hit.get("course_id"), hit.get("file_name", ""), hit.get("page"), hit.get("chunk") or 0)
+
+def search_results_page(searcher, user_id, query, page, page_size, filter_q=None):
+    """One scored page of hits as result dicts with highlighted snippets. Returns (ResultsPage, results)."""
+    results_page = searcher.search_page(query, page, pagelen=page_size, filter=filter_q)
+    results_page.results.formatter = SimpleFormatter()
+    results_page.results.fragmenter = _PinpointFragmenter(surround=50, maxchars=200) # Use Pinpoint
+
+    results_list = []
+    for hit in results_page:
+        text = hit_text(hit, user_id)
+        snippet = hit.highlights("content", text=text) if text else ""
+        if not snippet: snippet = (text[:200] + "...") if text else ""
+        results_list.append({
+            "course_id": hit.get("course_id"), "course_name": hit.get("course_name"),
+            "file_name": hit.get("file_name"), "file_type": hit.get("file_type"),
+            "page": hit.get("page"), "location": hit.get("location"),
+            "score": hit.score, "snippet": snippet
+        })
+    return results_page, results_list
+
+# --- Semantic / hybrid ranking ---
+# "semantic" ranks chunks by embedding similarity only; "hybrid" fuses the
+# BM25 and vector rankings (top SEMANTIC_CANDIDATES of each) with reciprocal
+# rank fusion, so chunks found by both come first.
+
+SEARCH_MODES = ("keyword", "semantic", "hybrid")
+RRF_K = 60
+
+def _chunk_key(fields):
+    return (str(fields.get("course_id")), fields.get("file_name"), fields.get("page"), fields.get("chunk") or 0)
+
+def _ranked_search(searcher, user_id, query_str, query, mode, page, page_size, filters, filter_q):
+    fused = {}
+    if mode == "hybrid":
+        bm25 = searcher.search(query, limit=SEMANTIC_CANDIDATES, filter=filter_q)
+        bm25.formatter = SimpleFormatter()
+        bm25.fragmenter = _PinpointFragmenter(surround=50, maxchars=200)
+        for rank, hit in enumerate(bm25):
+            entry = fused.setdefault(_chunk_key(hit), {"fields": hit.fields(), "hit": hit, "score": 0.0})
+            entry["score"] += 1 / (RRF_K + rank + 1)
+    for rank, (row, similarity) in enumerate(semantic_search(user_id, query_str, SEMANTIC_CANDIDATES, **filters)):
+        entry = fused.setdefault(_chunk_key(row), {"fields": row, "score": 0.0})
+        entry["score"] += 1 / (RRF_K + rank + 1) if mode == "hybrid" else similarity
+
+    ranked = sorted(fused.values(), key=lambda entry: -entry["score"])
+    pages = -(-len(ranked) // page_size)
+    page = max(1, min(page, pages))
+    results_list = []
+    for entry in ranked[(page - 1) * page_size:page * page_size]:
+        fields = entry["fields"]; text = hit_text(entry.get("hit") or fields, user_id)
+        snippet = entry["hit"].highlights("content", text=text) if entry.get("hit") and text else ""
+        if not snippet: snippet = (text[:200] + "...") if text else ""
+        score = entry["score"] * (RRF_K + 1) / 2 if mode == "hybrid" else entry["score"] # Hybrid: 1.0 = top of both
+        results_list.append({
+            "course_id": fields.get("course_id"), "course_name": fields.get("course_name"),
+            "file_name": fields.get("file_name"), "file_type": fields.get("file_type"),
+            "page": fields.get("page"), "location": fields.get("location"),
+            "score": score, "snippet": snippet
+        })
+
+    facets = {}
+    for name in FACET_FIELDS:
+        counts = {}
+        for entry in ranked:
+            value = entry["fields"].get(name)
+            if value is not None: counts[value] = counts.get(value, 0) + 1
+        facets[name] = [{name: key, "count": count} for key, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+    names = {entry["fields"].get("course_id"): entry["fields"].get("course_name") for entry in ranked}
+    for facet in facets["course_id"]: facet["course_name"] = names.get(facet["course_id"])
+
+    return {"query": query_str, "mode": mode, "total": len(ranked), "page": page, "page_size": page_size,
+            "pages": pages, "results": results_list, "facets": facets}
+
+# --- Search metrics ---
+# Wall time of the last SEARCH_LATENCY_SAMPLES searches (cache hits included),
+# for the p95 in /api/search/metrics; the time of the last search tells the
+# maintenance job whether the server is idle.
+
+_latency_lock = threading.Lock()
+_latencies = deque(maxlen=SEARCH_LATENCY_SAMPLES) # milliseconds
+_last_search_at = 0.0
+
+def _record_search(ms):
+    global _last_search_at
+    with _latency_lock:
+        _latencies.append(ms); _last_search_at = time.time()
+
+def seconds_since_last_search() -> float:
+    with _latency_lock:
+        return time.time() - _last_search_at if _last_search_at else float("inf")
+
+def search_latency_stats() -> dict:
+    with _latency_lock: samples = sorted(_latencies)
+    if not samples: return {"samples": 0, "p50_ms": None, "p95_ms": None, "max_ms": None}
+    def percentile(p): return round(samples[min(len(samples) - 1, int(p * len(samples)))], 2)
+    return {"samples": len(samples), "p50_ms": percentile(0.5), "p95_ms": percentile(0.95), "max_ms": round(samples[-1], 2)}
+
+def search_user_index(user_id, query_str: str, page=1, page_size=SEARCH_PAGE_SIZE,
+                      course_id=None, file_type=None, mode="keyword") -> dict:
     """
-    Searches the index for the given query string.
-    Returns a list of result dictionaries, including highlighted snippets.
+    /api/search: one page of hits in the user's index with highlighted
+    snippets, optionally filtered by course/file type, plus facet counts.
+    search_page() only scores the documents up to the requested page; facets
+    are counted once per query + filters and reused while paging.
+    mode "semantic"/"hybrid" ranks by chunk embeddings (see _ranked_search).
+    Results are cached per index generation (search_cache_service).
+    Raises ValueError if the query can't be parsed, LookupError if the index is empty.
     """
-    results_list = []
+    started = time.perf_counter()
     try:
-        ix = get_index()
-        
-        # We use Whoosh's QueryParser *inside* this function
-        # It parses queries for the 'content' field
-        parser = QueryParser("content", schema=ix.schema)
-        
-        # Parse the user's search query
-        query = parser.parse(search_query)
-
-        with ix.searcher() as searcher:
-            results = searcher.search(query, limit=10)
-            
-            # Configure highlighting
-            results.formatter = SimpleFormatter() # Use our custom formatter
-            results.fragmenter = ContextFragmenter(maxchars=200, surround=50)
-
-            for hit in results:
-                # Get the highlighted snippet from the 'content' field
-                highlighted_content = hit.highlights("content")
-                
-                # Fallback if no highlight (e.g., searching by ID)
-                if not highlighted_content:
-                    highlighted_content = (hit['content'][:150] + '...') if len(hit['content']) > 150 else hit['content']
-
-                results_list.append({
-                    "score": hit.score,
-                    "course_id": hit.get("course_id"),
-                    "course_name": hit.get("course_name"),
-                    "file_name": hit.get("file_name"),
-                    "file_type": hit.get("file_type"),
-                    "content": highlighted_content
-                })
-                
-    except Exception as e:
-        print(f" ⚠️ [Search] Error during search for '{search_query}': {e}")
-        return [] # Return empty list on error
+        return _search_user_index(user_id, query_str, page, page_size, course_id, file_type, mode)
+    finally:
+        _record_search((time.perf_counter() - started) * 1000)
+
+def _search_user_index(user_id, query_str, page, page_size, course_id, file_type, mode) -> dict:
+    generation = index_generation(user_id)
+    filters = {"course_id": course_id, "file_type": file_type}
+    page_key = dict(filters, page=page, page_size=page_size, mode=mode)
+    cached = get_cached_results(user_id, query_str, page_key, generation)
+    if cached is not None: return cached
+
+    with user_searcher(user_id) as searcher:
+        if searcher.doc_count() == 0: raise LookupError("Search index is empty.")
+        try: query = QueryParser("content", searcher.schema).parse(normalize_text(query_str))
+        except Exception as qp_e: raise ValueError(f"Error parsing query: {qp_e}")
+        filter_q = _search_filter(searcher.schema, filters)
+
+        if mode != "keyword":
+            response = _ranked_search(searcher, user_id, query_str, query, mode, page, page_size, filters, filter_q)
+            print(f" 🔍 [Search] {mode} '{query_str}': {response['total']} chunk(s) for user {user_id}.")
+            put_cached_results(user_id, query_str, page_key, generation, response)
+            return response
 
-    return results_list
\ No newline at end of file
+        results_page, results_list = search_results_page(searcher, user_id, query, page, page_size, filter_q)
+        print(f" 🔍 [Search] '{query_str}' found {results_page.total} hit(s) for user {user_id} (page {results_page.pagenum}).")
+
+        facets = get_cached_results(user_id, query_str, dict(filters, facets=True), generation)
+        if facets is None:
+            facets = _facet_counts(searcher, query, filter_q)
+            put_cached_results(user_id, query_str, dict(filters, facets=True), generation, facets)
+
+    response = {"query": query_str, "mode": mode, "total": results_page.total, "page": results_page.pagenum,
+                "page_size": page_size, "pages": results_page.pagecount, "results": results_list, "facets": facets}
+    put_cached_results(user_id, query_str, page_key, generation, response)
+    return response
+
+# --- Suggestions ---
+
+def _lexicon_field(schema) -> str:
+    return "terms" if "terms" in schema else "content" # 'content' (folded) until the index is migrated
+
+def suggest_terms(user_id, text: str, limit=SUGGEST_LIMIT) -> list:
+    """
+    /api/search/suggest: completions of the last word of 'text' from the user's
+    term dictionary (suggest_service), accent-insensitive and typo-tolerant.
+    """
+    words = text.split()
+    if not words or text[-1:].isspace(): return []
+    head = " ".join(words[:-1])
+    generation = index_generation(user_id)
+    lexicon = get_lexicon(user_id, generation)
+    if lexicon is None:
+        with user_searcher(user_id) as searcher:
+            lexicon = load_lexicon(user_id, generation, searcher.reader(), _lexicon_field(searcher.schema))
+    return [{"text": f"{head} {term}".strip(), "term": term, "count": count, "fuzzy": fuzzy}
+            for term, count, fuzzy in complete_word(lexicon, words[-1], limit)]
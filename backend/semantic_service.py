@@ -0,0 +1,238 @@
+# semantic_service.py
+import os
+import re
+import json
+import zlib
+import threading
+import importlib.util
+from functools import lru_cache
+import numpy as np
+
+from config import SEMANTIC_DIR, SEMANTIC_MODEL, SEMANTIC_EMBED_BATCH, SEMANTIC_MIN_SCORE
+from text_analysis import fold_text
+
+# --- Embedding model ---
+# A local sentence-transformers model on CPU when the package is installed
+# (the default is multilingual, so Vietnamese material works). Without it,
+# vectors come from feature hashing of accent-folded words, word pairs and
+# character trigrams: no download, but only near-lexical matches.
+
+HASH_DIM = 512
+_model = None # None = not loaded yet, False = hashing fallback
+_model_lock = threading.Lock()
+
+def _get_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = False
+            if SEMANTIC_MODEL and SEMANTIC_MODEL != "hashing":
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    print(f" 🧠 [Semantic] Loading embedding model '{SEMANTIC_MODEL}' (CPU)...")
+                    _model = SentenceTransformer(SEMANTIC_MODEL, device="cpu")
+                except Exception as e:
+                    print(f" ⚠️ [Semantic] Embedding model unavailable ({e}); using hashed word vectors.")
+        return _model
+
+@lru_cache(maxsize=1)
+def _package_installed() -> bool:
+    return importlib.util.find_spec("sentence_transformers") is not None
+
+def load_model():
+    """Loads the embedding model now (a rebuild does this first, so its manifest names the right space)."""
+    _get_model()
+
+def model_name() -> str:
+    """
+    Identifies the vector space; a user's vectors are rebuilt when it changes.
+    Decided from the configuration without loading the model (only embed()
+    loads it); if loading then fails, the name switches to the hashing space.
+    """
+    if _model is None:
+        use_model = bool(SEMANTIC_MODEL and SEMANTIC_MODEL != "hashing"
+                         and _package_installed())
+    else:
+        use_model = _model is not False
+    return SEMANTIC_MODEL if use_model else f"hashing-{HASH_DIM}"
+
+_WORD_RE = re.compile(r"\w+")
+
+def _hash_vector(text: str) -> np.ndarray:
+    vector = np.zeros(HASH_DIM, dtype=np.float32)
+    words = _WORD_RE.findall(fold_text(text))
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    features += [f"#{w[i:i + 3]}" for w in words if len(w) > 3 for i in range(len(w) - 2)]
+    for feature in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % HASH_DIM] += 1.0 if h & 0x80000000 else -1.0
+    return vector
+
+def embed(texts: list[str]) -> np.ndarray:
+    """L2-normalized float32 vectors, one row per text."""
+    if not texts: return np.zeros((0, HASH_DIM), dtype=np.float32)
+    model = _get_model()
+    if model:
+        vectors = model.encode(texts, batch_size=SEMANTIC_EMBED_BATCH, convert_to_numpy=True).astype(np.float32)
+    else:
+        vectors = np.vstack([_hash_vector(t) for t in texts])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+# --- Per-user vector store ---
+# SEMANTIC_DIR/user_<id>/ holds vectors-<v>.f32 (a raw float32 matrix, read
+# through np.memmap) and manifest.json (model, dim, one metadata row per
+# vector, deleted row ids). New chunks are appended, deleted files are
+# tombstoned, and the matrix is compacted once a fifth of it is dead.
+# Search is an exact dot product over the user's matrix; per-user corpora
+# are thousands of chunks, so this stays in the low milliseconds.
+
+META_FIELDS = ("course_id", "course_name", "file_name", "file_type", "page", "location", "chunk")
+
+_locks_guard = threading.Lock()
+_locks = {}
+_loaded = {} # user_id -> loaded store (dropped on every write)
+
+def _user_lock(user_id) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(str(user_id), threading.Lock())
+
+def _user_dir(user_id) -> str:
+    return os.path.join(SEMANTIC_DIR, f"user_{user_id}")
+
+def _read_manifest(user_id) -> dict | None:
+    try:
+        with open(os.path.join(_user_dir(user_id), "manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_manifest(user_id, manifest):
+    path = os.path.join(_user_dir(user_id), "manifest.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f: json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+def _vector_path(user_id, manifest) -> str:
+    return os.path.join(_user_dir(user_id), f"vectors-{manifest['version']}.f32")
+
+def vectors_current(user_id) -> bool:
+    """True if the user has a complete set of vectors from the current embedding model."""
+    manifest = _read_manifest(user_id)
+    return bool(manifest) and manifest.get("model") == model_name() and not manifest.get("building")
+
+def clear_user_vectors(user_id, building=False):
+    """Empties the user's store; building=True keeps it out of use until finish_user_vectors()."""
+    with _user_lock(user_id):
+        _loaded.pop(str(user_id), None)
+        folder = _user_dir(user_id)
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                try: os.remove(os.path.join(folder, name))
+                except OSError: pass
+        os.makedirs(folder, exist_ok=True)
+        _write_manifest(user_id, {"model": model_name(), "dim": None, "version": 0, "rows": [], "deleted": [],
+                                  "building": building})
+
+def finish_user_vectors(user_id, still_valid=lambda: True) -> bool:
+    """
+    Marks a store filled by a rebuild as ready, if still_valid() (checked
+    under the store's lock, so no commit can slip between the check and the switch).
+    """
+    with _user_lock(user_id):
+        manifest = _read_manifest(user_id)
+        if not manifest or not still_valid(): return False
+        manifest["building"] = False
+        _write_manifest(user_id, manifest)
+        _loaded.pop(str(user_id), None)
+        return True
+
+def _compact(user_id, manifest):
+    deleted = set(manifest["deleted"])
+    keep = [i for i in range(len(manifest["rows"])) if i not in deleted]
+    old_path = _vector_path(user_id, manifest)
+    if manifest["dim"] and manifest["rows"]:
+        vectors = np.fromfile(old_path, dtype=np.float32).reshape(-1, manifest["dim"])[keep]
+    else:
+        vectors = None
+    manifest.update(version=manifest["version"] + 1, rows=[manifest["rows"][i] for i in keep], deleted=[])
+    if vectors is not None: vectors.tofile(_vector_path(user_id, manifest))
+    try: os.remove(old_path)
+    except OSError: pass # Still mapped by a reader (Windows); removed on a later compaction
+
+def _writable(manifest, building) -> bool:
+    return bool(manifest) and manifest.get("model") == model_name() and bool(manifest.get("building")) == building
+
+def apply_vector_ops(user_id, ops, building=False) -> int:
+    """
+    Mirrors one search-index commit (the same ops as search_service.apply_index_ops)
+    into the user's vector store. Returns the number of vectors added.
+    A user without a current store, or whose store is being rebuilt, is skipped:
+    the rebuild reads the sidecars (and starts over if the index changed meanwhile).
+    building=True is the rebuild itself writing.
+    """
+    if not _writable(_read_manifest(user_id), building): return 0
+    adds = [fields for op, fields in ops if op == "add" and fields.get("content")]
+    vectors = embed([fields["content"] for fields in adds]) # Outside the lock: the slow part
+    with _user_lock(user_id):
+        manifest = _read_manifest(user_id)
+        if not _writable(manifest, building): return 0 # Cleared or rebuilt meanwhile
+        deleted = set(manifest["deleted"])
+        for op, args in ops:
+            if op == "delete_file":
+                course_id, file_name = str(args[0]), str(args[1])
+                deleted.update(i for i, row in enumerate(manifest["rows"])
+                               if row["course_id"] == course_id and row["file_name"] == file_name)
+            elif op == "delete_course":
+                deleted.update(i for i, row in enumerate(manifest["rows"]) if row["course_id"] == str(args[0]))
+        manifest["deleted"] = sorted(deleted)
+        if len(vectors):
+            manifest["dim"] = manifest["dim"] or int(vectors.shape[1])
+            path = _vector_path(user_id, manifest)
+            offset = len(manifest["rows"]) * manifest["dim"] * 4
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.seek(offset); f.write(vectors.tobytes()); f.truncate()
+            manifest["rows"].extend({name: fields.get(name) for name in META_FIELDS} for fields in adds)
+        if len(manifest["deleted"]) > 100 and len(manifest["deleted"]) > len(manifest["rows"]) // 5:
+            _compact(user_id, manifest)
+        _write_manifest(user_id, manifest)
+        _loaded.pop(str(user_id), None)
+    return len(adds)
+
+def _load(user_id) -> dict | None:
+    user_id = str(user_id)
+    with _user_lock(user_id):
+        store = _loaded.get(user_id)
+        if store is not None: return store
+        manifest = _read_manifest(user_id)
+        if not manifest or not manifest["rows"] or not manifest["dim"]: return None
+        rows = manifest["rows"]
+        alive = np.ones(len(rows), dtype=bool); alive[manifest["deleted"]] = False
+        store = {
+            "rows": rows, "alive": alive,
+            "vectors": np.memmap(_vector_path(user_id, manifest), dtype=np.float32, mode="r",
+                                 shape=(len(rows), manifest["dim"])),
+            "course_id": np.array([row["course_id"] for row in rows]),
+            "file_type": np.array([row["file_type"] for row in rows]),
+        }
+        _loaded[user_id] = store
+        return store
+
+def semantic_search(user_id, query: str, limit: int, course_id=None, file_type=None,
+                    min_score=SEMANTIC_MIN_SCORE) -> list[tuple[dict, float]]:
+    """The 'limit' chunks closest to the query: [(metadata row, cosine similarity)], best first."""
+    store = _load(user_id)
+    if store is None or not query.strip(): return []
+    mask = store["alive"].copy()
+    if course_id: mask &= store["course_id"] == str(course_id)
+    if file_type: mask &= store["file_type"] == str(file_type)
+    candidates = np.flatnonzero(mask)
+    if not len(candidates): return []
+    scores = np.asarray(store["vectors"][candidates] @ embed([query])[0])
+    k = min(limit, len(candidates))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(store["rows"][candidates[i]], float(scores[i])) for i in top if scores[i] >= min_score]
+
+def vector_count(user_id) -> int:
+    manifest = _read_manifest(user_id)
+    return len(manifest["rows"]) - len(manifest["deleted"]) if manifest else 0
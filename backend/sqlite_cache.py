@@ -0,0 +1,129 @@
+# sqlite_cache.py
+import json
+import time
+import zlib
+import sqlite3
+import threading
+
+# --- Size-capped SQLite cache ---
+# Shared by text_cache_service (extracted text) and ai_cache_service (AI
+# answers); each keeps only its own key scheme. One table in its own SQLite
+# file (WAL), values stored as zlib-compressed JSON. Entries older than the
+# TTL (if any) are dropped, and the least recently used go once the stored
+# size exceeds the cap, trimming to 90% so an insert doesn't evict every time.
+
+MISS = object() # SQLiteCache.get() result when nothing usable is cached
+TOUCH_INTERVAL_SECONDS = 300 # Hits only bump last_access if it is older than this, to avoid a write per read
+
+class SQLiteCache:
+    def __init__(self, path, table, max_mb, ttl_hours=None, label="Cache", replaces=()):
+        """'replaces': tables of an older layout in the same file, dropped on first use."""
+        self.path = path
+        self.table = table
+        self.max_mb = max_mb
+        self.ttl_hours = ttl_hours
+        self.label = label
+        self.replaces = replaces
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._stats_lock = threading.Lock()
+        self._stats = {"expired": 0, "evictions": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript("PRAGMA journal_mode = WAL;" + "".join(
+                        f"DROP TABLE IF EXISTS {old};" for old in self.replaces) + f"""
+                    CREATE TABLE IF NOT EXISTS {self.table} (
+                      key TEXT PRIMARY KEY,
+                      value BLOB NOT NULL,
+                      size INTEGER NOT NULL,
+                      created_at REAL NOT NULL,
+                      last_access REAL NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_{self.table}_access ON {self.table}(last_access);
+                    CREATE INDEX IF NOT EXISTS idx_{self.table}_created ON {self.table}(created_at);
+                    """)
+                    self._initialized = True
+        return conn
+
+    def _count(self, name, delta=1):
+        with self._stats_lock: self._stats[name] += delta
+
+    def _expired(self, created_at, now) -> bool:
+        return bool(self.ttl_hours) and now - created_at > self.ttl_hours * 3600
+
+    def get(self, key: str):
+        """The cached value, or MISS (also on a read error)."""
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(f"SELECT value, created_at, last_access FROM {self.table} WHERE key = ?",
+                                   (key,)).fetchone()
+                if not row: return MISS
+                now = time.time()
+                if self._expired(row[1], now):
+                    conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,)); conn.commit()
+                    self._count("expired"); return MISS
+                if now - row[2] > TOUCH_INTERVAL_SECONDS:
+                    conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+                    conn.commit()
+                return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"         [{self.label}] Read failed: {e}")
+            return MISS
+
+    def put(self, key: str, value) -> bool:
+        """Stores a JSON-serializable value and evicts expired / least-recently-used entries. False on error."""
+        try:
+            blob = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), 6)
+            now = time.time()
+            conn = self._connect()
+            try:
+                conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, size, created_at, last_access) "
+                             "VALUES (?, ?, ?, ?, ?)", (key, blob, len(blob), now, now))
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+            return True
+        except Exception as e:
+            print(f"         [{self.label}] Write failed: {e}")
+            return False
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        expired = 0
+        if self.ttl_hours:
+            expired = conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?",
+                                   (now - self.ttl_hours * 3600,)).rowcount
+        max_bytes = self.max_mb * 1024 * 1024
+        total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        evicted = 0
+        if total > max_bytes:
+            target = int(max_bytes * 0.9)
+            for key, size in conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_access ASC").fetchall():
+                if total <= target: break
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                total -= size; evicted += 1
+        if expired or evicted:
+            self._count("expired", expired); self._count("evictions", evicted)
+            print(f"         [{self.label}] Dropped {expired} expired and {evicted} least-used entr(ies), {total / 1024 / 1024:.1f}MB kept.")
+
+    def stats(self) -> dict:
+        """Entry count and size on disk, plus the expired/evicted counters of this process."""
+        with self._stats_lock: stats = dict(self._stats)
+        try:
+            conn = self._connect()
+            try:
+                stats["entries"], stats["bytes"] = conn.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"         [{self.label}] Stats failed: {e}")
+        stats["max_bytes"] = self.max_mb * 1024 * 1024
+        return stats
@@ -1,8 +1,5 @@
 # state.py
 
-# Tracks if the process is running
-IS_SCRAPING = False
-
-# Tracks the result of the LAST run
-# Structure: { "success": bool, "message": str } or None
-LAST_SCRAPE_RESULT = None
\ No newline at end of file
+# Scrape status used to live here as process-wide globals (IS_SCRAPING,
+# LAST_SCRAPE_RESULT). Scrapes are now per-user jobs: see scrape_scheduler.py
+# (get_user_job / scheduler_status).
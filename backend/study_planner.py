@@ -18,6 +18,7 @@ from config import (
     SAVE_DIR
 )
 from ai_service import ai_client
+import ai_gateway
 
 # Setup Timezone
 tz = pytz.timezone(GOOGLE_CALENDAR_TIMEZONE)
@@ -173,8 +174,7 @@ def ai_estimate_difficulty(user_id, lms_course_id, course_name, title, url):
     }}
     """
     try:
-        response = ai_client.generate_content(prompt)
-        text = response.text.strip()
+        text = ai_gateway.run(lambda: ai_client.generate_content(prompt).text, label="Planner").strip()
         start = text.find('{')
         end = text.rfind('}') + 1
         return json.loads(text[start:end])
@@ -0,0 +1,136 @@
+# suggest_service.py
+import bisect
+import threading
+from itertools import chain
+from collections import OrderedDict, Counter
+
+from config import SUGGEST_MAX_USERS
+from text_analysis import fold_text
+
+# --- Per-user term dictionaries for /api/search/suggest ---
+# Built from the unfolded 'terms' field of the user's index ('content' holds
+# accent-folded terms): terms sorted by their accent-folded form, so 'mang'
+# completes to 'mạng', 'măng'... with a bisect,
+# plus a bigram index over term prefixes that narrows edit-distance (typo)
+# matching to the few terms sharing enough bigrams with the word. Commits that
+# only add documents are merged in (search_service tokenizes the new chunks);
+# a commit that deletes documents makes the next lookup reload the lexicon.
+
+GRAM_PREFIX_CHARS = 12 # Typos are matched against this much of each term
+
+def _bigrams(folded: str) -> set:
+    padded = "^" + folded[:GRAM_PREFIX_CHARS]
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+class _Lexicon:
+    def __init__(self, generation, term_counts):
+        self.generation = generation
+        self.df = {} # term -> number of chunks containing it
+        self.keys = [] # sorted (folded, term)
+        self.terms = [] # term id -> (folded, term)
+        self.grams = {} # bigram of a folded term prefix -> [term id]
+        self.add_terms(term_counts, sort=True)
+
+    def add_terms(self, term_counts, sort=False):
+        for term, count in term_counts.items():
+            if term in self.df:
+                self.df[term] += count; continue
+            self.df[term] = count
+            key = (fold_text(term), term)
+            if sort: self.keys.append(key)
+            else: bisect.insort(self.keys, key)
+            for gram in _bigrams(key[0]): self.grams.setdefault(gram, []).append(len(self.terms))
+            self.terms.append(key)
+        if sort: self.keys.sort()
+
+_lock = threading.Lock()
+_lexicons = OrderedDict() # user_id -> _Lexicon
+
+def get_lexicon(user_id, generation):
+    """The user's lexicon if it is loaded and current as of 'generation', else None."""
+    with _lock:
+        lexicon = _lexicons.get(str(user_id))
+        if lexicon is None or lexicon.generation != generation: return None
+        _lexicons.move_to_end(str(user_id))
+        return lexicon
+
+def load_lexicon(user_id, generation, reader, fieldname="terms"):
+    """Builds the user's lexicon from an index reader (every term of 'fieldname' with its doc frequency)."""
+    counts = {}
+    for term_bytes, info in reader.iter_field(fieldname):
+        counts[term_bytes.decode("utf-8") if isinstance(term_bytes, bytes) else term_bytes] = info.doc_frequency()
+    lexicon = _Lexicon(generation, counts)
+    with _lock:
+        _lexicons[str(user_id)] = lexicon
+        _lexicons.move_to_end(str(user_id))
+        while len(_lexicons) > SUGGEST_MAX_USERS: _lexicons.popitem(last=False)
+    return lexicon
+
+def note_commit(user_id, generation, added_terms=None, removed=False):
+    """
+    Keeps a loaded lexicon in step with a commit: 'added_terms' ({term: chunks})
+    is merged in; removed=True drops the lexicon so it is reloaded.
+    """
+    with _lock:
+        lexicon = _lexicons.get(str(user_id))
+        if lexicon is None: return
+        if removed:
+            del _lexicons[str(user_id)]; return
+        if added_terms: lexicon.add_terms(added_terms)
+        lexicon.generation = generation
+
+def lexicon_loaded(user_id) -> bool:
+    with _lock: return str(user_id) in _lexicons
+
+def drop_lexicon(user_id):
+    with _lock: _lexicons.pop(str(user_id), None)
+
+def _prefix_distance(word, term, max_dist) -> int:
+    """
+    Smallest Levenshtein distance between 'word' and a prefix of 'term' of
+    len(word) ± max_dist chars (one DP; the last row holds every prefix).
+    Returns max_dist + 1 as soon as it must exceed max_dist.
+    """
+    term = term[:len(word) + max_dist]
+    previous = list(range(len(term) + 1))
+    for i, ca in enumerate(word, 1):
+        current = [i]
+        for j, cb in enumerate(term, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_dist: return max_dist + 1
+        previous = current
+    return min(previous[max(0, len(word) - max_dist):])
+
+def complete_word(lexicon, word, limit) -> list[tuple[str, int, bool]]:
+    """[(term, chunk count, fuzzy)] for the (partial) word: prefix matches first, then typo matches."""
+    folded = fold_text(word)
+    if not folded: return []
+    start = bisect.bisect_left(lexicon.keys, (folded,))
+    prefix = []
+    for key in lexicon.keys[start:]:
+        if not key[0].startswith(folded): break
+        prefix.append(key[1])
+        if len(prefix) >= 500: break # Very short prefixes: enough to rank the most common
+    prefix.sort(key=lambda term: -lexicon.df[term])
+    results = [(term, lexicon.df[term], False) for term in prefix[:limit]]
+    if len(results) >= limit or len(folded) < 3: return results
+
+    # Typo tolerance: edit distance to term prefixes of about the word's length
+    max_dist = 1 if len(folded) <= 5 else 2
+    word_grams = _bigrams(folded)
+    min_shared = len(word_grams) - 2 * max_dist # One edit changes at most two bigrams
+    shared = Counter(chain.from_iterable(lexicon.grams.get(gram, ()) for gram in word_grams))
+    seen = set(prefix); fuzzy = []
+    for term_id, count in shared.items():
+        if count < min_shared: continue
+        key_folded, term = lexicon.terms[term_id]
+        if term in seen or len(key_folded) < len(folded) - max_dist: continue
+        dist = _prefix_distance(folded, key_folded, max_dist)
+        if dist <= max_dist: fuzzy.append((dist, -lexicon.df[term], term))
+    fuzzy.sort()
+    results += [(term, -neg_df, True) for _, neg_df, term in fuzzy[:limit - len(results)]]
+    return results
+
+def suggestion_stats() -> dict:
+    with _lock:
+        return {"users": len(_lexicons), "terms": sum(len(lex.df) for lex in _lexicons.values())}
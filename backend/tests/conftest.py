@@ -0,0 +1,43 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# config.py exits without LMS credentials; the tests never talk to the LMS
+os.environ.setdefault("LMS_USERNAME", "test")
+os.environ.setdefault("LMS_PASSWORD", "test")
+os.environ.setdefault("SEMANTIC_MODEL", "hashing")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search_service
+import semantic_service
+import suggest_service
+import search_cache_service
+
+@pytest.fixture
+def search_dirs(tmp_path, monkeypatch):
+    """Points the index, the scraped files and the vector store at tmp_path, with empty in-process caches."""
+    monkeypatch.setattr(search_service, "INDEX_DIR", str(tmp_path / "search_index"))
+    monkeypatch.setattr(search_service, "SAVE_DIR", str(tmp_path / "courses_data"))
+    monkeypatch.setattr(semantic_service, "SEMANTIC_DIR", str(tmp_path / "semantic_index"))
+    monkeypatch.setattr(semantic_service, "SEMANTIC_MODEL", "hashing")
+    os.makedirs(search_service.INDEX_DIR)
+    yield tmp_path
+    for user_id in list(search_service._handles): search_service.close_user_searcher(user_id)
+    search_service._generations.clear(); search_service._current_users.clear()
+    search_service._migrations.clear(); search_service._dirty_users.clear()
+    suggest_service._lexicons.clear(); semantic_service._loaded.clear()
+    search_cache_service._entries.clear()
+
+def write_sidecar(root, user_id, course, file_name, text):
+    """Saves a scraped file and its cleaned .txt sidecar the way the scraper does."""
+    folder = root / "courses_data" / f"user_{user_id}" / course
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / file_name).write_bytes(b"%PDF-1.4")
+    (folder / (os.path.splitext(file_name)[0] + ".txt")).write_text(text, encoding="utf-8")
+
+def index_sidecars(user_id):
+    """Indexes every sidecar of the user in one commit."""
+    ops = [("add", doc) for docs in search_service.sidecar_course_documents(user_id) for doc in docs]
+    return search_service.apply_index_ops(user_id, ops)
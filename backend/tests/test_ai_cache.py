@@ -0,0 +1,35 @@
+# tests/test_ai_cache.py
+import os
+import time
+import base64
+
+import ai_cache_service
+import text_cache_service
+from sqlite_cache import SQLiteCache, MISS
+
+def test_entries_expire_and_lru_trims_to_the_cap(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), "entries", max_mb=1, ttl_hours=1, label="Test")
+    assert cache.put("old", {"answer": 1})
+    conn = cache._connect()
+    conn.execute("UPDATE entries SET created_at = ? WHERE key = 'old'", (time.time() - 7200,)); conn.commit(); conn.close()
+    assert cache.get("old") is MISS
+
+    blobs = [base64.b64encode(os.urandom(300 * 1024)).decode() for _ in range(4)] # ~300KB each after zlib
+    for i, blob in enumerate(blobs):
+        assert cache.put(f"big{i}", blob)
+    stats = cache.stats()
+    assert stats["bytes"] <= stats["max_bytes"] and stats["evictions"] >= 1
+    assert cache.get("big0") is MISS and cache.get("big3") == blobs[3]
+
+def test_both_services_keep_their_key_schema(tmp_path, monkeypatch):
+    monkeypatch.setattr(text_cache_service, "_cache", SQLiteCache(str(tmp_path / "text.db"), "extracted_text", 8))
+    monkeypatch.setattr(ai_cache_service, "_cache", SQLiteCache(str(tmp_path / "ai.db"), "ai_answers", 8, ttl_hours=1))
+    text_cache_service.put_cached_text("abc", "v1", "pdf", "Mạng máy tính", 3)
+    assert text_cache_service.get_cached_text("abc", "v1") == ("pdf", "Mạng máy tính", 3)
+    assert text_cache_service.get_cached_text("abc", "v2") is None
+
+    fingerprint = ai_cache_service.prompt_fingerprint("model", {"temperature": 0}, "hint:1", "prompt")
+    assert ai_cache_service.get_cached_response(fingerprint) is MISS
+    ai_cache_service.put_cached_response(fingerprint, {"hint": "x"})
+    assert ai_cache_service.get_cached_response(fingerprint) == {"hint": "x"}
+    assert ai_cache_service.ai_cache_stats()["entries"] == 1
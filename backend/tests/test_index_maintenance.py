@@ -0,0 +1,24 @@
+# tests/test_index_maintenance.py
+import scrape_scheduler
+import index_maintenance_service
+from scrape_scheduler import ScrapeJob
+
+from conftest import write_sidecar, index_sidecars
+
+def test_maintenance_skips_users_with_an_active_scrape(search_dirs, monkeypatch):
+    write_sidecar(search_dirs, 1, "5_Networks", "Lecture1.pdf", "--- Page 1 ---\nTCP socket hạn nộp")
+    write_sidecar(search_dirs, 1, "5_Networks", "Lecture2.pdf", "--- Page 1 ---\nUDP datagram")
+    index_sidecars(1)
+    job = ScrapeJob(1, "student", "secret")
+    monkeypatch.setitem(scrape_scheduler._jobs_by_user, 1, job)
+
+    report = index_maintenance_service.run_index_maintenance(force=True)
+    entry = report["users"]["1"]
+    assert "error" not in entry
+    assert "verify" not in entry and "optimize" not in entry
+
+    job.status = "succeeded"
+    report = index_maintenance_service.run_index_maintenance(force=True)
+    entry = report["users"]["1"]
+    assert entry["verify"]["repaired"] == 0
+    assert entry["after"]["segments"] == 1
@@ -0,0 +1,22 @@
+# tests/test_index_writer.py
+import search_service
+import rebuild_search_index
+
+from conftest import write_sidecar, index_sidecars
+
+def _write_course(root, pages):
+    text = "\n".join(f"--- Page {n} ---\nsocket lecture page {n}" for n in range(1, pages + 1))
+    write_sidecar(root, 1, "5_Networks", "Lecture1.pdf", text)
+
+def test_server_commits_never_fork_a_writer(search_dirs, monkeypatch):
+    monkeypatch.setattr(search_service, "INDEX_BULK_MIN_DOCS", 5)
+    _write_course(search_dirs, 20)
+    op_stats = index_sidecars(1)
+    assert op_stats["docs"] == 20 and op_stats["procs"] == 1
+
+def test_offline_rebuild_uses_several_processes(search_dirs, monkeypatch):
+    monkeypatch.setattr(search_service, "INDEX_BULK_MIN_DOCS", 5)
+    _write_course(search_dirs, 20)
+    index_sidecars(1)
+    assert rebuild_search_index.rebuild("1", procs=2) == 20
+    assert search_service.index_stats("1")["docs"] == 20
@@ -0,0 +1,22 @@
+# tests/test_suggest.py
+import search_service
+
+from conftest import write_sidecar, index_sidecars
+
+def test_completions_keep_their_accents(search_dirs):
+    write_sidecar(search_dirs, 1, "5_Networks", "Lecture1.pdf",
+                  "--- Page 1 ---\nHạn nộp bài tập mạng máy tính. Mạng LAN và mạng WAN. Măng cụt")
+    index_sidecars(1)
+
+    assert search_service.suggest_terms(1, "hạn n")[0]["text"] == "hạn nộp"
+    terms = [s["term"] for s in search_service.suggest_terms(1, "mang")]
+    assert {"mạng", "măng"} <= set(terms) and "mang" not in terms
+
+def test_lexicon_follows_new_commits(search_dirs):
+    write_sidecar(search_dirs, 1, "5_Networks", "Lecture1.pdf", "--- Page 1 ---\nGiao thức TCP")
+    index_sidecars(1)
+    assert search_service.suggest_terms(1, "giao") # Loads the lexicon
+
+    docs = search_service.file_documents(1, "5", "Networks", "Lecture2.pdf", "PDF", "--- Page 1 ---\nĐịnh tuyến")
+    search_service.apply_index_ops(1, [("add", doc) for doc in docs])
+    assert [s["term"] for s in search_service.suggest_terms(1, "dinh")] == ["định"]
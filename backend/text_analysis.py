@@ -0,0 +1,43 @@
+# text_analysis.py
+import unicodedata
+from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter, Filter, STOP_WORDS
+
+# --- Vietnamese-aware analysis for the search index ---
+# Used for both indexing and query parsing (the analyzer is saved in each
+# index's schema). Chunks and queries are NFC-normalized by search_service,
+# tokenized into syllables (Vietnamese writes each syllable as a separate
+# word, so multi-syllable words match as phrases through the stored
+# positions), stopwords are dropped while the accents still tell them apart,
+# then tokens are accent-folded: "hạn nộp" and "han nop" index the same terms.
+# One-letter syllables ("ý", "ở") and numbers ("chương 1") are kept.
+
+def fold_text(text: str) -> str:
+    """Lowercase without diacritics ('Hạn nộp' -> 'han nop')."""
+    text = unicodedata.normalize("NFKD", text.lower().replace("đ", "d"))
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+# Function words, matched before folding: "có" is dropped but "cơ" (cơ sở) is kept.
+# Negation ("không") is kept: "không bắt buộc" must not match "bắt buộc".
+VIETNAMESE_STOP_WORDS = frozenset("""
+và là của các những cho với một trong được có này để thì sẽ đã đến từ khi về
+cũng nhưng hoặc rằng mà nên vì bị lại ra vào theo tại như nếu đó thế cái việc
+""".split())
+
+class FoldFilter(Filter):
+    """Replaces each token's text with its accent-folded form (character offsets are kept for highlighting)."""
+    def __call__(self, tokens):
+        for token in tokens:
+            token.text = fold_text(token.text)
+            yield token
+
+def vietnamese_analyzer():
+    return surface_analyzer() | FoldFilter()
+
+def surface_analyzer():
+    """vietnamese_analyzer() without the folding: the words as written, for /api/search/suggest."""
+    return (RegexTokenizer() | LowercaseFilter()
+            | StopFilter(stoplist=STOP_WORDS | VIETNAMESE_STOP_WORDS, minsize=1))
+
+def normalize_text(text: str) -> str:
+    """NFC form, so decomposed accents (common in PDF text) tokenize like composed ones."""
+    return unicodedata.normalize("NFC", text)
@@ -0,0 +1,38 @@
+# text_cache_service.py
+import hashlib
+
+from config import TEXT_CACHE_FILE, TEXT_CACHE_MAX_MB
+from sqlite_cache import SQLiteCache, MISS
+
+# --- Content-addressed extracted-text cache ---
+# Keyed by (file sha256, extractor version), so the same bytes are parsed once
+# no matter which endpoint asks (scraper, summary, flashcards, grading, chat)
+# or where the file lives. Kept in its own SQLite file so large text blobs do
+# not bloat lms_data.db; storage and LRU eviction over TEXT_CACHE_MAX_MB are
+# sqlite_cache's. 'text_cache' is the table of the previous layout.
+
+_cache = SQLiteCache(TEXT_CACHE_FILE, "extracted_text", TEXT_CACHE_MAX_MB, label="TextCache", replaces=("text_cache",))
+
+def _key(sha256: str, extractor_version: str) -> str:
+    return f"{sha256}:{extractor_version}"
+
+def file_sha256(file_path: str) -> str:
+    """Hashes a file in 1MB blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_cached_text(sha256: str, extractor_version: str) -> tuple[str, str, int] | None:
+    """Returns (file_type, text, pages) for a cached extraction, or None."""
+    cached = _cache.get(_key(sha256, extractor_version))
+    if cached is MISS: return None
+    return cached["file_type"], cached["text"], cached["pages"]
+
+def put_cached_text(sha256: str, extractor_version: str, file_type: str, text: str, pages: int):
+    """Stores an extraction result (least-recently-used entries go over the size cap)."""
+    _cache.put(_key(sha256, extractor_version), {"file_type": file_type, "text": text, "pages": pages})
+
+def cache_stats() -> dict:
+    return _cache.stats()
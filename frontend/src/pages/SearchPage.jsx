@@ -1,40 +1,110 @@
 
 import React from "react"
-import { useState } from "react"
+import { useState, useEffect, useRef } from "react"
 import Card from "../components/Card"
 import LoadingSpinner from "../components/LoadingSpinner"
 import ErrorAlert from "../components/ErrorAlert"
 import { apiCall } from "../utils/api"
 import "./SearchPage.css"
 
+const PAGE_SIZE = 10
+// While the backend builds a missing/outdated index (202 "building"), the search is retried
+const BUILD_POLL_MS = 5000
+const BUILD_POLL_ATTEMPTS = 24
+
 function SearchPage() {
   const [query, setQuery] = useState("")
+  const [mode, setMode] = useState("keyword")
   const [results, setResults] = useState([])
+  const [total, setTotal] = useState(0)
+  const [page, setPage] = useState(1)
+  const [pages, setPages] = useState(0)
+  const [facets, setFacets] = useState({})
+  const [filters, setFilters] = useState({ course_id: null, file_type: null })
+  const [searchedQuery, setSearchedQuery] = useState("")
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState(null)
   const [searched, setSearched] = useState(false)
+  const [suggestions, setSuggestions] = useState([])
+  const [buildingMessage, setBuildingMessage] = useState(null)
+  const [semanticBuilding, setSemanticBuilding] = useState(false)
+  const pollTimer = useRef(null)
 
-  const handleSearch = async (e) => {
-    e.preventDefault()
-    if (!query.trim()) {
-      setError("Please enter a search query")
+  useEffect(() => () => clearTimeout(pollTimer.current), [])
+
+  // Autocomplete the word being typed (debounced; the suggest endpoint is cheap)
+  useEffect(() => {
+    if (!query.trim() || /\s$/.test(query)) {
+      setSuggestions([])
       return
     }
+    const timer = setTimeout(async () => {
+      try {
+        const data = await apiCall(`/api/search/suggest?q=${encodeURIComponent(query)}`)
+        setSuggestions(data?.suggestions || [])
+      } catch {
+        setSuggestions([])
+      }
+    }, 150)
+    return () => clearTimeout(timer)
+  }, [query])
+
+  const runSearch = async (q, pageNum, activeFilters, attempt = 0) => {
+    clearTimeout(pollTimer.current)
+    const params = new URLSearchParams({ q, page: pageNum, page_size: PAGE_SIZE, mode })
+    if (activeFilters.course_id) params.set("course_id", activeFilters.course_id)
+    if (activeFilters.file_type) params.set("file_type", activeFilters.file_type)
 
     try {
       setLoading(true)
       setError(null)
-      const data = await apiCall(`/api/search?q=${encodeURIComponent(query)}`)
-      setResults(data || [])
+      const data = await apiCall(`/api/search?${params.toString()}`)
+      if (data?.status === "building") {
+        setBuildingMessage(data.message || "Your search index is being built.")
+        setSemanticBuilding(false)
+        setResults([])
+        setSearchedQuery(q)
+        setSearched(true)
+        if (attempt < BUILD_POLL_ATTEMPTS) {
+          pollTimer.current = setTimeout(() => runSearch(q, pageNum, activeFilters, attempt + 1), BUILD_POLL_MS)
+        }
+        return
+      }
+      setBuildingMessage(null)
+      // Meaning/hybrid search before the embeddings exist: the backend answered with keyword results
+      setSemanticBuilding(data?.semantic_status === "building")
+      setResults(data?.results || [])
+      setTotal(data?.total || 0)
+      setPage(data?.page || 1)
+      setPages(data?.pages || 0)
+      setFacets(data?.facets || {})
+      setFilters(activeFilters)
+      setSearchedQuery(q)
       setSearched(true)
     } catch (err) {
       setError(err.message || "Search failed")
+      setBuildingMessage(null)
+      setSemanticBuilding(false)
       setResults([])
     } finally {
       setLoading(false)
     }
   }
 
+  const handleSearch = async (e) => {
+    e.preventDefault()
+    if (!query.trim()) {
+      setError("Please enter a search query")
+      return
+    }
+    runSearch(query, 1, { course_id: null, file_type: null })
+  }
+
+  const toggleFilter = (name, value) => {
+    const next = { ...filters, [name]: filters[name] === value ? null : value }
+    runSearch(searchedQuery, 1, next)
+  }
+
   return (
     <div className="search-page">
       <h1 className="page-title">Search Course Materials</h1>
@@ -47,7 +117,19 @@ function SearchPage() {
             placeholder="Search across all your course materials..."
             value={query}
             onChange={(e) => setQuery(e.target.value)}
+            list="search-suggestions"
+            autoComplete="off"
           />
+          <datalist id="search-suggestions">
+            {suggestions.map((suggestion) => (
+              <option key={suggestion.text} value={suggestion.text} />
+            ))}
+          </datalist>
+          <select className="search-mode" value={mode} onChange={(e) => setMode(e.target.value)}>
+            <option value="keyword">Keyword</option>
+            <option value="semantic">Meaning</option>
+            <option value="hybrid">Hybrid</option>
+          </select>
           <button type="submit" className="search-button" disabled={loading}>
             {loading ? "Searching..." : "Search"}
           </button>
@@ -56,18 +138,61 @@ function SearchPage() {
 
       {error && <ErrorAlert message={error} onDismiss={() => setError(null)} />}
 
+      {semanticBuilding && !loading && (
+        <div className="search-notice">
+          Meaning search is still being prepared for your files. Showing keyword results for now; try again in a few minutes.
+        </div>
+      )}
+
       <div className="results-section">
-        {loading ? (
+        {loading && !buildingMessage ? (
           <LoadingSpinner />
+        ) : buildingMessage ? (
+          <div className="no-results">
+            <p className="no-results-text">{buildingMessage}</p>
+            <p className="no-results-hint">Your results for "{searchedQuery}" will appear here automatically.</p>
+            <button
+              type="button"
+              className="search-button"
+              disabled={loading}
+              onClick={() => runSearch(searchedQuery, 1, filters)}
+            >
+              Try again now
+            </button>
+          </div>
         ) : searched ? (
           results.length > 0 ? (
             <>
               <h2 className="results-title">
-                Found {results.length} result{results.length !== 1 ? "s" : ""}
+                Found {total} result{total !== 1 ? "s" : ""}
               </h2>
+
+              <div className="search-facets">
+                {(facets.course_id || []).map((facet) => (
+                  <button
+                    key={`course-${facet.course_id}`}
+                    type="button"
+                    className={`facet-chip ${filters.course_id === facet.course_id ? "active" : ""}`}
+                    onClick={() => toggleFilter("course_id", facet.course_id)}
+                  >
+                    {facet.course_name || facet.course_id} ({facet.count})
+                  </button>
+                ))}
+                {(facets.file_type || []).map((facet) => (
+                  <button
+                    key={`type-${facet.file_type}`}
+                    type="button"
+                    className={`facet-chip ${filters.file_type === facet.file_type ? "active" : ""}`}
+                    onClick={() => toggleFilter("file_type", facet.file_type)}
+                  >
+                    {facet.file_type} ({facet.count})
+                  </button>
+                ))}
+              </div>
+
               <div className="results-grid">
 {results.map((result, idx) => (
-  <Card key={idx} title={decodeURIComponent(result.file_name || "Result")} className="result-card">
+  <Card key={`${page}-${idx}`} title={`${decodeURIComponent(result.file_name || "Result")}${result.location ? ` ${result.location}` : ""}`} className="result-card">
     <div className="result-content">
       
       {/* Use `dangerouslySetInnerHTML` to render the <strong> tags 
@@ -88,10 +213,32 @@ function SearchPage() {
   </Card>
 ))}
               </div>
+
+              {pages > 1 && (
+                <div className="search-pagination">
+                  <button
+                    type="button"
+                    className="search-button"
+                    disabled={page <= 1}
+                    onClick={() => runSearch(searchedQuery, page - 1, filters)}
+                  >
+                    Previous
+                  </button>
+                  <span className="results-page">Page {page} of {pages}</span>
+                  <button
+                    type="button"
+                    className="search-button"
+                    disabled={page >= pages}
+                    onClick={() => runSearch(searchedQuery, page + 1, filters)}
+                  >
+                    Next
+                  </button>
+                </div>
+              )}
             </>
           ) : (
             <div className="no-results">
-              <p className="no-results-text">No results found for "{query}"</p>
+              <p className="no-results-text">No results found for "{searchedQuery}"</p>
               <p className="no-results-hint">Try different search terms</p>
             </div>
           )